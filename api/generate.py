@@ -4,23 +4,49 @@
 完全零存储，所有文件在内存中生成
 """
 
+import os
+import copy
+import base64
+import re
 import json
+import time
+import zlib
+import hashlib
 import zipfile
+import threading
+from xml.sax.saxutils import escape
 from io import BytesIO
-from datetime import datetime
+from urllib.parse import quote
+from tempfile import SpooledTemporaryFile
+from datetime import datetime, timezone
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
 
 # 检查依赖，提供回退方案
 try:
     from docx import Document
-    from docx.shared import Pt, RGBColor
+    from docx.package import Package
+    from docx.opc.part import XmlPart
+    from docx.parts.styles import StylesPart
+    from docx.oxml.ns import qn, nsdecls
+    from docx.oxml.parser import parse_xml
     HAS_DOCX = True
 except ImportError:
     HAS_DOCX = False
     print("警告：python-docx未安装，将使用纯文本格式")
     # 在except块中定义这些变量以避免错误
     Document = None
-    Pt = None
-    RGBColor = None
+    Package = None
+    XmlPart = None
+    StylesPart = None
+    qn = None
+    nsdecls = None
+    parse_xml = None
+
+# 渲染后端：设置环境变量 DOCX_BACKEND=ooxml 时跳过python-docx，
+# 直接以文本流写出 word/document.xml（未安装python-docx时同样可用）
+USE_OOXML_WRITER = os.environ.get('DOCX_BACKEND', 'python-docx') == 'ooxml'
 
 try:
     from PIL import Image, ImageDraw, ImageFont
@@ -33,6 +59,557 @@ except ImportError:
     ImageDraw = None
     ImageFont = None
 
+# 基础模板：默认使用 build_docx_template.py 生成的精简模板，
+# 只保留生成器用到的样式；可用环境变量 DOCX_TEMPLATE_PATH 指定其他模板
+DOCX_TEMPLATE_PATH = os.environ.get('DOCX_TEMPLATE_PATH') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'templates', 'base.docx')
+
+# 文档样式表：生成器只按角色引用样式，修改这里即可统一调整全部材料的格式
+# 带 based_on 的是自定义样式，加载模板时注入 styles.xml（每个文档只定义一次）；
+# 其余为模板自带样式。paragraph/run 的取值含义见 paragraph_properties_xml / run_properties_xml
+STYLE_SHEET = {
+    'title': {'id': 'ReadingTitle', 'name': 'Reading Title', 'based_on': 'Title',
+              'run': {'size': 24, 'color': '003366'}},
+    'body': {'id': 'ReadingBody', 'name': 'Reading Body', 'based_on': 'Normal',
+             'paragraph': {'line_spacing': 1.5, 'space_after': 6}},
+    'answer': {'id': 'Answer', 'name': 'Answer', 'based_on': 'Normal',
+               'run': {'color': '008000'}},
+    'explanation': {'id': 'Explanation', 'name': 'Explanation', 'based_on': 'ListBullet'},
+    'option': {'id': 'ListBullet', 'name': 'List Bullet'},
+    'bullet': {'id': 'ListBullet', 'name': 'List Bullet'},
+    'vocabulary_table': {'id': 'LightGrid-Accent1', 'name': 'Light Grid Accent 1'},
+}
+
+def style_id(role):
+    """返回样式表中某个角色的样式ID（OOXML后端使用）"""
+    return STYLE_SHEET[role]['id']
+
+def style_name(role):
+    """返回样式表中某个角色的样式名称（python-docx按名称查找样式）"""
+    return STYLE_SHEET[role]['name']
+
+def run_properties_xml(bold=False, color=None, size=None):
+    """生成w:rPr：bold为粗体，color为十六进制颜色（如'003366'），size单位为磅"""
+    props = []
+    if bold:
+        props.append('<w:b/>')
+    if color:
+        props.append(f'<w:color w:val="{color}"/>')
+    if size:
+        props.append(f'<w:sz w:val="{int(size * 2)}"/><w:szCs w:val="{int(size * 2)}"/>')
+    return f'<w:rPr>{"".join(props)}</w:rPr>' if props else ''
+
+def paragraph_properties_xml(style=None, line_spacing=None, space_after=None):
+    """生成w:pPr：style为样式ID，line_spacing为行距倍数，space_after单位为磅"""
+    props = []
+    if style:
+        props.append(f'<w:pStyle w:val="{style}"/>')
+    if line_spacing or space_after is not None:
+        spacing = ''
+        if space_after is not None:
+            spacing += f' w:after="{int(space_after * 20)}"'
+        if line_spacing:
+            spacing += f' w:line="{int(line_spacing * 240)}" w:lineRule="auto"'
+        props.append(f'<w:spacing{spacing}/>')
+    return f'<w:pPr>{"".join(props)}</w:pPr>' if props else ''
+
+def custom_styles_xml(existing_styles_xml=''):
+    """把样式表中的自定义样式生成为w:style元素，模板中已有的样式ID会跳过"""
+    styles = []
+    for definition in STYLE_SHEET.values():
+        if 'based_on' not in definition:
+            continue
+        if f'w:styleId="{definition["id"]}"' in existing_styles_xml:
+            continue
+        styles.append(
+            f'<w:style w:type="paragraph" w:customStyle="1" w:styleId="{definition["id"]}">'
+            f'<w:name w:val="{definition["name"]}"/><w:basedOn w:val="{definition["based_on"]}"/><w:qFormat/>'
+            f'{paragraph_properties_xml(**definition.get("paragraph", {}))}'
+            f'{run_properties_xml(**definition.get("run", {}))}'
+            '</w:style>'
+        )
+    return ''.join(styles)
+
+# ==================== 归档组装 ====================
+# 已压缩的ZIP条目：data为压缩后的数据，写入ZIP时原样复制，不再解压或重新压缩
+CompressedEntry = namedtuple('CompressedEntry', 'data crc file_size compress_type')
+# 流式条目：write(stream) 把内容逐段写入ZIP条目，kind为 'docx' 或 'text'，size为预计大小（用于选择压缩方式）
+StreamedEntry = namedtuple('StreamedEntry', 'write kind size')
+
+# 外层压缩包各条目的压缩策略；可用环境变量按部署调整，也可在请求的 options.compression 中逐项覆盖
+#   docx：已经是ZIP容器的条目（.docx），默认 stored 直接存储，再压缩几乎不会变小
+#   text：文本条目的压缩方式，默认 deflate；text_level 为压缩级别
+#   large_text：不小于 large_text_size 字节的文本条目改用的压缩方式（如 bzip2、lzma），为空时与 text 相同
+COMPRESSION_METHODS = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+DEFAULT_COMPRESSION_POLICY = {
+    'docx': os.environ.get('ZIP_DOCX_COMPRESSION', 'stored'),
+    'text': os.environ.get('ZIP_TEXT_COMPRESSION', 'deflate'),
+    'text_level': int(os.environ.get('ZIP_TEXT_LEVEL', '6')),
+    'large_text': os.environ.get('ZIP_LARGE_TEXT_COMPRESSION') or None,
+    'large_text_size': int(os.environ.get('ZIP_LARGE_TEXT_SIZE', str(256 * 1024))),
+}
+
+# .docx内部各部件的压缩策略：时间戳固定（与精简模板相同），同样的内容总是得到字节相同的文件
+DOCX_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+DOCX_PACKAGE_POLICY = dict(DEFAULT_COMPRESSION_POLICY, docx='stored', text='deflate', text_level=6,
+                           large_text=None, date_time=DOCX_DATE_TIME)
+
+def compression_overrides(options):
+    """请求 options.compression 中的覆盖项；检查类型和取值，无效时抛出RequestBodyError（400）"""
+    overrides = (options or {}).get('compression') or {}
+    if not isinstance(overrides, dict):
+        raise RequestBodyError("options.compression 应为对象")
+    for key in ('docx', 'text', 'large_text'):
+        value = overrides.get(key)
+        if key in overrides and not (value is None and key == 'large_text') and value not in COMPRESSION_METHODS:
+            raise RequestBodyError(f"不支持的压缩方式 {key}={value}，可选：{', '.join(COMPRESSION_METHODS)}")
+    # bool 是 int 的子类，单独排除
+    level = overrides.get('text_level', 0)
+    if isinstance(level, bool) or not isinstance(level, int) or not 0 <= level <= 9:
+        raise RequestBodyError(f"压缩级别 text_level 应为 0 到 9 的整数，收到: {level!r}")
+    size = overrides.get('large_text_size', 0)
+    if isinstance(size, bool) or not isinstance(size, int) or size < 0:
+        raise RequestBodyError(f"large_text_size 应为非负整数，收到: {size!r}")
+    return overrides
+
+def compression_policy(options=None):
+    """合并部署默认策略与请求 options.compression 中的覆盖项
+
+    返回的策略中 date_time 为各条目的时间戳：可重现模式下固定为生成时间，否则为None（写入时的当前时间）。
+    """
+    policy = dict(DEFAULT_COMPRESSION_POLICY)
+    policy.update(compression_overrides(options))
+    policy['date_time'] = archive_date_time(options or {})
+    return policy
+
+def entry_compression(content, policy):
+    """按策略返回条目内容应使用的 (压缩方式, 压缩级别)"""
+    # 以ZIP文件头开头的是已经压缩过的容器（.docx）
+    return kind_compression('docx' if content[:4] == b'PK\x03\x04' else 'text', len(content), policy)
+
+def kind_compression(kind, size, policy):
+    """按策略返回某类条目（'docx' 或 'text'）应使用的 (压缩方式, 压缩级别)，size为条目大小"""
+    if kind == 'docx':
+        return COMPRESSION_METHODS[policy['docx']], None
+
+    method = policy['text']
+    if policy['large_text'] and size >= policy['large_text_size']:
+        method = policy['large_text']
+    compress_type = COMPRESSION_METHODS[method]
+    if compress_type == zipfile.ZIP_DEFLATED:
+        return compress_type, policy['text_level']
+    if compress_type == zipfile.ZIP_BZIP2:
+        return compress_type, min(max(policy['text_level'], 1), 9)
+    return compress_type, None
+
+def compress_entry(data, compress_type=zipfile.ZIP_DEFLATED, level=None):
+    """把数据预先压缩为可直接写入ZIP的条目，适合缓存后反复使用的内容"""
+    if compress_type == zipfile.ZIP_STORED:
+        compressed = data
+    else:
+        compressor = zipfile._get_compressor(compress_type, level)
+        compressed = compressor.compress(data) + compressor.flush()
+    return CompressedEntry(compressed, zlib.crc32(data), len(data), compress_type)
+
+def entry_info(name, policy=None):
+    """新建条目的ZipInfo：时间戳取策略中的 date_time，没有时与 writestr 相同取当前时间"""
+    date_time = (policy or {}).get('date_time') or time.localtime(time.time())[:6]
+    info = zipfile.ZipInfo(name, date_time)
+    info.external_attr = 0o600 << 16
+    return info
+
+def write_entry(zip_file, name, content, policy=None):
+    """向ZIP写入一个条目
+
+    content为CompressedEntry时直接写入本地文件头和压缩数据，耗时只和条目数有关；
+    为StreamedEntry时边生成边压缩写入，不在内存中保留完整内容；
+    其余内容交给 writestr，给出policy时按压缩策略选择压缩方式，否则按归档的默认方式。
+    """
+    if isinstance(content, StreamedEntry):
+        write_streamed_entry(zip_file, name, content, policy)
+        return
+
+    if not isinstance(content, CompressedEntry):
+        if policy is None:
+            zip_file.writestr(name, content)
+        else:
+            compress_type, level = entry_compression(content, policy)
+            zip_file.writestr(entry_info(name, policy), content, compress_type, level)
+        return
+
+    info = entry_info(name, policy)
+    info.compress_type = content.compress_type
+    info.CRC = content.crc
+    info.file_size = content.file_size
+    info.compress_size = len(content.data)
+    if content.compress_type == zipfile.ZIP_LZMA:
+        info.flag_bits |= 0x02
+
+    # zipfile没有写入原始压缩数据的公开接口，这里按 ZipFile._open_to_write 的步骤操作
+    with zip_file._lock:
+        if zip_file._writing:
+            raise ValueError("Can't write to ZIP archive while an open writing handle exists")
+        if zip_file._seekable:
+            zip_file.fp.seek(zip_file.start_dir)
+        info.header_offset = zip_file.fp.tell()
+        zip_file._writecheck(info)
+        zip_file._didModify = True
+        zip_file.fp.write(info.FileHeader())
+        zip_file.fp.write(content.data)
+        zip_file.filelist.append(info)
+        zip_file.NameToInfo[name] = info
+        zip_file.start_dir = zip_file.fp.tell()
+
+# 并行压缩：待压缩数据不少于 ZIP_PARALLEL_MIN_SIZE 字节时在线程池中压缩（zlib/bz2/lzma压缩时释放GIL）
+# ZIP_WORKERS 为线程数，默认等于CPU核数；设为 1 关闭
+ZIP_WORKERS = int(os.environ.get('ZIP_WORKERS', '0')) or os.cpu_count() or 1
+PARALLEL_COMPRESSION_MIN_SIZE = int(os.environ.get('ZIP_PARALLEL_MIN_SIZE', str(1024 * 1024)))
+# 大条目按块并行deflate：每块以前一块末尾32KB为预设字典，块之间用同步刷新衔接（与pigz相同）
+DEFLATE_CHUNK_SIZE = 1024 * 1024
+DEFLATE_WINDOW_SIZE = 32 * 1024
+_compression_pools = {}
+
+def get_compression_pool(workers):
+    """返回指定线程数的压缩线程池（每个进程只创建一次）"""
+    if workers not in _compression_pools:
+        _compression_pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='zip-compress')
+    return _compression_pools[workers]
+
+def deflate_chunk(data, start, end, level=None):
+    """把 data[start:end] 压缩为raw deflate片段；最后一块结束数据流，其余块同步刷新以便直接拼接"""
+    options = {'zdict': data[max(start - DEFLATE_WINDOW_SIZE, 0):start]} if start else {}
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                                  zlib.DEFLATED, -15, **options)
+    flush_mode = zlib.Z_FINISH if end >= len(data) else zlib.Z_SYNC_FLUSH
+    return compressor.compress(memoryview(data)[start:end]) + compressor.flush(flush_mode)
+
+def submit_compression(pool, content, compress_type, level, chunked=True):
+    """把一个条目的压缩任务提交到线程池，返回得到CompressedEntry的函数；chunked为假时大条目也整体压缩"""
+    if not chunked or compress_type != zipfile.ZIP_DEFLATED or len(content) <= DEFLATE_CHUNK_SIZE:
+        return pool.submit(compress_entry, content, compress_type, level).result
+
+    chunks = [pool.submit(deflate_chunk, content, start, min(start + DEFLATE_CHUNK_SIZE, len(content)), level)
+              for start in range(0, len(content), DEFLATE_CHUNK_SIZE)]
+    crc = pool.submit(zlib.crc32, content)
+
+    def result():
+        compressed = b''.join(chunk.result() for chunk in chunks)
+        return CompressedEntry(compressed, crc.result(), len(content), compress_type)
+    return result
+
+def write_entries(zip_file, entries, policy=None, workers=None):
+    """按给定顺序写入多个 (名称, 内容) 条目
+
+    待压缩的数据足够多时，各条目（大条目按块）先在线程池中并行压缩，
+    再按原顺序原样写入，生成的归档与顺序写入时内容一致。
+    分块压缩的数据与整体压缩不同，而是否分块取决于线程数（默认为CPU核数）；
+    策略固定了时间戳（可重现模式）时大条目也整体压缩，同样的请求在任何机器上都得到相同的字节。
+    """
+    workers = workers or ZIP_WORKERS
+    chunked = not (policy or {}).get('date_time')
+    pending_size = sum(len(content) for _, content in entries if not isinstance(content, CompressedEntry))
+    if workers <= 1 or pending_size < PARALLEL_COMPRESSION_MIN_SIZE:
+        for name, content in entries:
+            write_entry(zip_file, name, content, policy)
+        return
+
+    pool = get_compression_pool(workers)
+    results = []
+    for name, content in entries:
+        if isinstance(content, CompressedEntry):
+            results.append((name, lambda entry=content: entry))
+            continue
+        if policy is None:
+            compress_type, level = zip_file.compression, zip_file.compresslevel
+        else:
+            compress_type, level = entry_compression(content, policy)
+        results.append((name, submit_compression(pool, content, compress_type, level, chunked)))
+
+    for name, result in results:
+        write_entry(zip_file, name, result(), policy)
+
+def write_streamed_entry(zip_file, name, content, policy=None):
+    """打开ZIP条目的写入流，由 content.write 逐段写入"""
+    info = entry_info(name, policy)
+    if policy is None:
+        info.compress_type, level = zip_file.compression, zip_file.compresslevel
+    else:
+        info.compress_type, level = kind_compression(content.kind, content.size, policy)
+    # ZipFile.open 从 ZipInfo 读取压缩级别（Python 3.13 起属性名为 compress_level）
+    if hasattr(info, 'compress_level'):
+        info.compress_level = level
+    else:
+        info._compresslevel = level
+    with zip_file.open(info, 'w') as stream:
+        content.write(stream)
+
+class MemoryReader:
+    """只读的内存文件：按需从memoryview中读取，供zipfile读取中央目录和单个文件，不复制整个压缩包"""
+
+    def __init__(self, data):
+        self._view = memoryview(data)
+        self._position = 0
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._position + size, len(self._view))
+        data = self._view[self._position:end].tobytes()
+        self._position = max(end, self._position)
+        return data
+
+    def seek(self, offset, whence=0):
+        base = {0: 0, 1: self._position, 2: len(self._view)}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+def read_member(zip_data, name):
+    """从压缩包中按中央目录定位并返回单个文件的内容，文件不存在时抛出KeyError
+
+    直接存储（stored）的文件返回压缩包对应区间的memoryview，不复制也不解压；
+    其余只解压这一个文件。
+    """
+    with zipfile.ZipFile(MemoryReader(zip_data)) as archive:
+        info = archive.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return archive.read(info)
+
+    # 本地文件头：固定30字节，第26、28字节起为文件名和扩展字段的长度
+    view = memoryview(zip_data)
+    header = view[info.header_offset:info.header_offset + 30]
+    if header[:4].tobytes() != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"{name} 的本地文件头损坏")
+    name_length = int.from_bytes(header[26:28], 'little')
+    extra_length = int.from_bytes(header[28:30], 'little')
+    start = info.header_offset + 30 + name_length + extra_length
+    return view[start:start + info.compress_size]
+
+def dos_date_time(date_time):
+    """把 (年, 月, 日, 时, 分, 秒) 转换为ZIP头中的4字节DOS时间和日期"""
+    year, month, day, hour, minute, second = date_time[:6]
+    dos_time = hour << 11 | minute << 5 | second // 2
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    return dos_time.to_bytes(2, 'little') + dos_date.to_bytes(2, 'little')
+
+def stamp_zip_entries(zip_data, date_time):
+    """把ZIP数据（可写的memoryview或bytearray）中所有条目的时间戳原地改为date_time，不重新压缩"""
+    stamp = dos_date_time(date_time)
+    with zipfile.ZipFile(MemoryReader(zip_data)) as archive:
+        # 中央目录记录依次排列：固定46字节，第28、30、32字节起为文件名、扩展字段、注释的长度
+        offset = archive.start_dir
+        for info in archive.infolist():
+            zip_data[info.header_offset + 10:info.header_offset + 14] = stamp
+            zip_data[offset + 12:offset + 16] = stamp
+            lengths = zip_data[offset + 28:offset + 34]
+            offset += 46 + sum(int.from_bytes(lengths[i:i + 2], 'little') for i in (0, 2, 4))
+
+_template_bytes = {}
+_template_parts = {}
+
+def get_template_bytes():
+    """返回注入了自定义样式的模板.docx数据（每个模板每个进程只处理一次）"""
+    template_path = get_docx_template_path()
+    if template_path not in _template_bytes:
+        buffer = BytesIO()
+        with zipfile.ZipFile(template_path) as template, \
+                zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as patched:
+            for name in template.namelist():
+                data = template.read(name)
+                if name == 'word/styles.xml':
+                    styles_xml = data.decode('utf-8')
+                    closing = styles_xml.rindex('</w:styles>')
+                    styles_xml = (styles_xml[:closing] + custom_styles_xml(styles_xml)
+                                  + styles_xml[closing:])
+                    data = styles_xml.encode('utf-8')
+                patched.writestr(name, data)
+        _template_bytes[template_path] = buffer.getvalue()
+    return _template_bytes[template_path]
+
+def get_template_parts():
+    """返回模板中除 word/document.xml 外的全部部件，已压缩为CompressedEntry（每个模板每个进程只处理一次）"""
+    template_path = get_docx_template_path()
+    if template_path not in _template_parts:
+        with zipfile.ZipFile(BytesIO(get_template_bytes())) as template:
+            _template_parts[template_path] = {
+                name: compress_entry(template.read(name))
+                for name in template.namelist()
+                if name != 'word/document.xml'
+            }
+    return _template_parts[template_path]
+
+# Document原型缓存：每个进程只读取并解析一次模板，之后每个文档使用克隆
+# 设置环境变量 DOCX_PROTOTYPE_CACHE=0 可关闭，退回每次调用 Document()
+DOCX_PROTOTYPE_CACHE = os.environ.get('DOCX_PROTOTYPE_CACHE', '1') != '0'
+_docx_prototypes = {}
+
+def get_docx_template_path():
+    """返回生成文档所使用的基础模板路径"""
+    return DOCX_TEMPLATE_PATH
+
+def get_docx_prototype():
+    """返回已解析的模板包（每个模板每个进程只加载一次）"""
+    template_path = get_docx_template_path()
+    if template_path not in _docx_prototypes:
+        _docx_prototypes[template_path] = Package.open(BytesIO(get_template_bytes()))
+    return _docx_prototypes[template_path]
+
+def clone_docx_package(prototype):
+    """克隆模板包：XML部件深拷贝，样式部件只读共享，二进制部件复用原始字节"""
+    package = Package()
+    cloned_parts = {}
+    for part in prototype.iter_parts():
+        if isinstance(part, StylesPart):
+            # 样式表体积最大且生成过程只读取不修改，直接共享同一棵元素树
+            cloned = StylesPart(part.partname, part.content_type, part.element, package)
+        elif isinstance(part, XmlPart):
+            cloned = part.__class__(part.partname, part.content_type,
+                                    copy.deepcopy(part.element), package)
+        else:
+            cloned = part.__class__.load(part.partname, part.content_type, part.blob, package)
+        cloned_parts[part] = cloned
+
+    # 按原有rId重建关系
+    sources = [(prototype, package)] + list(cloned_parts.items())
+    for source, cloned_source in sources:
+        for rel in source.rels.values():
+            target = rel.target_ref if rel.is_external else cloned_parts[rel.target_part]
+            cloned_source.load_rel(rel.reltype, target, rel.rId, rel.is_external)
+
+    package.after_unmarshal()
+    return package
+
+def new_document():
+    """创建空白Word文档，启用原型缓存时返回模板克隆"""
+    if not DOCX_PROTOTYPE_CACHE:
+        return Document(BytesIO(get_template_bytes()))
+    return clone_docx_package(get_docx_prototype()).main_document_part.document
+
+# 请求体解码：可以用 gzip / deflate 压缩（Content-Encoding 请求头），Vercel事件中的请求体还可以是base64编码（isBase64Encoded）
+# 解压后不超过 MAX_REQUEST_BODY_SIZE 字节，且（超过 DECOMPRESSION_RATIO_MIN_SIZE 后）不超过压缩数据的 MAX_DECOMPRESSION_RATIO 倍，超过时拒绝（防止解压炸弹）
+MAX_REQUEST_BODY_SIZE = int(os.environ.get('MAX_REQUEST_BODY_SIZE', str(64 * 1024 * 1024)))
+MAX_DECOMPRESSION_RATIO = int(os.environ.get('MAX_DECOMPRESSION_RATIO', '100'))
+# 解压后不超过这个大小时不检查倍数：内容重复的正常请求体（如多个版本的同一篇文章）压缩比可达数百倍
+DECOMPRESSION_RATIO_MIN_SIZE = int(os.environ.get('DECOMPRESSION_RATIO_MIN_SIZE', str(1024 * 1024)))
+# 各内容编码对应的zlib wbits；deflate按HTTP规范为zlib格式，不带zlib头时按raw deflate解压
+CONTENT_ENCODING_WBITS = {'gzip': 16 + 15, 'x-gzip': 16 + 15, 'deflate': 15}
+
+class RequestBodyError(ValueError):
+    """请求体无法解码或请求选项无效，status为应返回的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def decompress_body(data, encoding):
+    """按内容编码解压请求体，边解压边检查大小，超过上限时立即停止
+
+    MAX_REQUEST_BODY_SIZE 是绝对上限；相对压缩数据的倍数上限只在解压超过 DECOMPRESSION_RATIO_MIN_SIZE 后检查。
+    """
+    wbits = CONTENT_ENCODING_WBITS[encoding]
+    if encoding == 'deflate' and (len(data) < 2 or data[0] & 0x0f != 8 or int.from_bytes(data[:2], 'big') % 31):
+        wbits = -15
+    limit = MAX_REQUEST_BODY_SIZE
+    if MAX_DECOMPRESSION_RATIO > 0:
+        limit = min(limit, max(len(data) * MAX_DECOMPRESSION_RATIO, DECOMPRESSION_RATIO_MIN_SIZE))
+
+    decompressor = zlib.decompressobj(wbits)
+    output = bytearray()
+    pending = data
+    try:
+        while pending:
+            # max_length 限制单次输出，未处理的输入留在 unconsumed_tail 中
+            output += decompressor.decompress(pending, limit + 1 - len(output))
+            if len(output) > limit:
+                raise RequestBodyError(f"请求体解压后超过 {limit} 字节（压缩数据 {len(data)} 字节），已拒绝", 413)
+            pending = decompressor.unconsumed_tail
+        output += decompressor.flush()
+    except zlib.error as e:
+        raise RequestBodyError(f"请求体 {encoding} 解压失败: {e}")
+    if len(output) > limit:
+        raise RequestBodyError(f"请求体解压后超过 {limit} 字节（压缩数据 {len(data)} 字节），已拒绝", 413)
+    if not decompressor.eof:
+        raise RequestBodyError(f"请求体 {encoding} 数据不完整")
+    return bytes(output)
+
+def parse_request_body(body, content_encoding=None, is_base64_encoded=False):
+    """依次解开base64和内容编码（可以是逗号分隔的多层），再把请求体解析为JSON并检查其中的选项"""
+    if not body:
+        return {}
+    if is_base64_encoded:
+        try:
+            body = base64.b64decode(body, validate=True)
+        except ValueError as e:
+            raise RequestBodyError(f"请求体不是有效的base64: {e}")
+
+    encodings = [item.strip().lower() for item in (content_encoding or '').split(',') if item.strip()]
+    for encoding in reversed(encodings):
+        if encoding == 'identity':
+            continue
+        if encoding not in CONTENT_ENCODING_WBITS:
+            raise RequestBodyError(f"不支持的请求体编码: {encoding}，可选：gzip、deflate", 415)
+        if isinstance(body, str):
+            raise RequestBodyError("压缩的请求体需要以二进制或base64编码传输")
+        body = decompress_body(body, encoding)
+
+    try:
+        data = json.loads(body)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise RequestBodyError(f"请求体不是有效的JSON: {e}")
+
+    # 客户端给出的选项在生成之前检查，无效时返回400而不是在生成中途失败
+    options = data.get('options', {}) if isinstance(data, dict) else {}
+    if not isinstance(options, dict):
+        raise RequestBodyError("options 应为对象")
+    compression_overrides(options)
+    if options.get('generated_at'):
+        parse_generated_at(options['generated_at'])
+    if 'max_part_size' in options:
+        part_size_limit(data)
+    return data
+
+def header_value(headers, name):
+    """不区分大小写地取请求头"""
+    name = name.lower()
+    return next((value for key, value in (headers or {}).items() if key.lower() == name), None)
+
+# 响应体编码：base64 / latin-1（旧方式，非ASCII字节经JSON序列化后会膨胀）/ auto（按编码后的大小选择，默认）
+HANDLER_BODY_ENCODING = os.environ.get('HANDLER_BODY_ENCODING', 'auto')
+# JSON序列化时（ensure_ascii）每个非ASCII字符编码为 \u00XX，占6字节
+JSON_ESCAPED_CHAR_SIZE = 6
+_HIGH_BYTES = bytes(range(0x80, 0x100))
+
+def estimate_text_body_size(data):
+    """估算按latin-1作为字符串返回时经JSON序列化后的大小"""
+    if data.isascii():
+        return len(json.dumps(data.decode('ascii'))) - 2
+    # 非ASCII字节按转义后的大小计算，ASCII控制字符的转义忽略不计（估算偏小）
+    high_count = len(data) - len(data.translate(None, _HIGH_BYTES))
+    return len(data) + high_count * (JSON_ESCAPED_CHAR_SIZE - 1)
+
+def encode_body(data, encoding=None):
+    """把二进制响应体编码为Vercel要求的字符串，返回 (body, isBase64Encoded)"""
+    encoding = encoding or HANDLER_BODY_ENCODING
+    if isinstance(data, memoryview):
+        # 结果缓存中可能是本地服务器放入的memoryview
+        data = data.tobytes()
+    if encoding == 'auto':
+        base64_size = (len(data) + 2) // 3 * 4
+        encoding = 'latin-1' if estimate_text_body_size(data) <= base64_size else 'base64'
+    if encoding == 'latin-1':
+        return data.decode('latin-1'), False
+    if encoding == 'base64':
+        return base64.b64encode(data).decode('ascii'), True
+    raise ValueError(f"不支持的响应体编码: {encoding}")
+
 def handler(event, _context=None):
     """Vercel Serverless Function 入口点"""
     try:
@@ -42,28 +619,95 @@ def handler(event, _context=None):
                 'statusCode': 200,
                 'headers': {
                     'Access-Control-Allow-Origin': '*',
-                    'Access-Control-Allow-Methods': 'POST, OPTIONS',
-                    'Access-Control-Allow-Headers': 'Content-Type',
+                    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                    'Access-Control-Allow-Headers': 'Content-Type, Content-Encoding, If-None-Match',
                 },
                 'body': ''
             }
 
-        # 解析请求体
-        body = json.loads(event.get('body', '{}'))
+        # GET 返回结果缓存的命中统计
+        if event.get('httpMethod') == 'GET':
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'result_cache': result_cache.stats(), 'artifact_memo': artifact_memo_stats(),
+                                    'single_flight': generation_flight.stats()})
+            }
+
+        # 解析请求体：支持base64编码的事件和gzip/deflate压缩的请求体
+        try:
+            body = parse_request_body(event.get('body'), header_value(event.get('headers'), 'Content-Encoding'),
+                                      event.get('isBase64Encoded', False))
+        except RequestBodyError as e:
+            return {
+                'statusCode': e.status,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': str(e)}, ensure_ascii=False)
+            }
+
+        # 按需模式：单个文件请求只渲染该文件，清单请求不渲染任何文件
+        options = body.get('options', {})
+        if options.get('artifact'):
+            name = options['artifact']
+            try:
+                render = find_artifact(body, name)
+            except KeyError:
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'body': json.dumps({'error': f'没有这个文件: {name}'}, ensure_ascii=False)
+                }
+            response_body, is_base64_encoded = encode_body(render())
+            return {
+                'statusCode': 200,
+                'headers': {
+                    'Content-Type': 'application/octet-stream',
+                    'Content-Disposition': f"attachment; filename*=UTF-8''{quote(os.path.basename(name))}",
+                    'Access-Control-Allow-Origin': '*',
+                },
+                'body': response_body,
+                'isBase64Encoded': is_base64_encoded
+            }
+        if options.get('lazy'):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps(artifact_manifest(body), ensure_ascii=False)
+            }
+
+        # 同样的请求：客户端已有结果时返回304，否则优先使用缓存
+        cache_key = lesson_cache_key(body)
+        cache_headers = {
+            'ETag': result_etag(body, cache_key),
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag, X-Cache',
+        }
+        if etag_matches(header_value(event.get('headers'), 'If-None-Match'), cache_key):
+            return {'statusCode': 304, 'headers': cache_headers, 'body': ''}
 
-        # 生成文件 - 重命名变量避免警告
-        zip_binary_data = generate_reading_materials(body)
+        # 生成文件 - 重命名变量避免警告；同时到达的同样请求只生成一次
+        zip_binary_data, cache_headers['X-Cache'] = cached_reading_materials(body, cache_key)
+
+        # 超过平台响应大小限制时返回分卷清单
+        max_part_size = part_size_limit(body)
+        if 'files' not in body.get('options', {}) and 0 < max_part_size < len(zip_binary_data):
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', **cache_headers},
+                'body': json.dumps(part_manifest(zip_binary_data, max_part_size), ensure_ascii=False)
+            }
 
-        # 返回ZIP文件
+        # 返回ZIP文件：Vercel要求字符串，压缩包通常使用base64
+        response_body, is_base64_encoded = encode_body(zip_binary_data)
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/zip',
-                'Content-Disposition': 'attachment; filename="reading_materials.zip"',
-                'Access-Control-Allow-Origin': '*',
+                'Content-Disposition': f'attachment; filename="{part_download_name(body)}"',
+                **cache_headers,
             },
-            'body': zip_binary_data.decode('latin-1'),  # Vercel要求字符串
-            'isBase64Encoded': False
+            'body': response_body,
+            'isBase64Encoded': is_base64_encoded
         }
 
     except Exception as e:
@@ -73,47 +717,468 @@ def handler(event, _context=None):
             'body': json.dumps({'error': str(e)})
         }
 
+# 低内存模式：文章正文按需逐段渲染，直接流式写入压缩包，压缩包超过 SPOOL_MAX_SIZE 字节后转存到临时文件
+# 设置 LOW_MEMORY_MODE=1 总是开启，或在请求中设置 options.low_memory；
+# 文章原文总字数超过 LOW_MEMORY_TEXT_SIZE 时自动开启（设为 0 关闭自动开启）
+LOW_MEMORY_MODE = os.environ.get('LOW_MEMORY_MODE', '0') == '1'
+LOW_MEMORY_TEXT_SIZE = int(os.environ.get('LOW_MEMORY_TEXT_SIZE', str(2 * 1024 * 1024)))
+SPOOL_MAX_SIZE = int(os.environ.get('SPOOL_MAX_SIZE', str(8 * 1024 * 1024)))
+
+def use_low_memory(data):
+    """判断本次请求是否使用低内存模式"""
+    options = data.get('options', {})
+    if 'low_memory' in options:
+        return bool(options['low_memory'])
+    if LOW_MEMORY_MODE:
+        return True
+    text_size = sum(len(content.get('content', '')) for content in data.get('leveled_texts', {}).values())
+    return 0 < LOW_MEMORY_TEXT_SIZE <= text_size
+
 def generate_reading_materials(data):
     """生成阅读材料并返回ZIP文件的二进制数据"""
-    # 创建内存中的ZIP文件
-    zip_buffer = BytesIO()
+    return build_reading_materials(data).read()
+
+def build_reading_materials(data):
+    """生成阅读材料，返回定位在开头的ZIP文件对象
+
+    通常为内存中的BytesIO，需要避免复制时直接用 getbuffer() 取得ZIP数据的memoryview；
+    低内存模式下为 SpooledTemporaryFile，超过 SPOOL_MAX_SIZE 后数据在临时文件中。
+    """
+    policy = compression_policy(data.get('options', {}))
+    low_memory = use_low_memory(data)
 
+    zip_buffer = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) if low_memory else BytesIO()
     with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # 生成各版本阅读文章
-        versions = data.get('leveled_texts', {})
-        for version, content in versions.items():
-            # Word文档
-            doc_content = generate_word_content(version, content)
-            version_name = get_version_name(version)
-            file_name = content.get('title', '文章').replace('/', '_')  # 防止路径问题
-            zip_file.writestr(
-                f"阅读文章_{version_name}_{file_name}.docx",
-                doc_content
-            )
-
-            # 纯文本版本（备用）
-            text_content = f"{content.get('title', '')}\n\n{content.get('content', '')}"
-            zip_file.writestr(
-                f"阅读文章_{version_name}_纯文本.txt",
-                text_content.encode('utf-8')
-            )
-
-        # 生成阅读理解问题
-        questions = data.get('comprehension_questions', {})
-        questions_content = generate_questions_content(questions)
-        zip_file.writestr("阅读理解问题.docx", questions_content)
-
-        # 生成词汇表
-        vocabulary = data.get('support_materials', {})
-        vocab_content = generate_vocabulary_content(vocabulary)
-        zip_file.writestr("词汇表.docx", vocab_content)
-
-        # 生成教师指南（简化版）
-        guide_content = generate_teacher_guide(data)
-        zip_file.writestr("教师使用指南.docx", guide_content)
-
-        # 生成使用说明文件
-        readme = """# 分层阅读材料使用说明
+        if low_memory:
+            # 逐个条目生成并写入，不同时持有所有条目
+            for name, content in lesson_entries(data, low_memory=True):
+                write_entry(zip_file, name, content, policy)
+        else:
+            write_entries(zip_file, list(lesson_entries(data)), policy)
+
+    zip_buffer.seek(0)
+    return zip_buffer
+
+class StreamBuffer:
+    """只追加写入的缓冲区：ZipFile写入的数据暂存在这里，由生成器取走后清空
+
+    没有 seek/tell，ZipFile会按不可定位的流写入（zipfile原生支持）。
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """取出并清空已写入的数据"""
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_reading_materials(data):
+    """流式生成ZIP：每写完一个条目就产出对应的字节，内存中只保留当前条目"""
+    policy = compression_policy(data.get('options', {}))
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for name, content in lesson_entries(data, low_memory=use_low_memory(data)):
+            write_entry(zip_file, name, content, policy)
+            yield buffer.take()
+    # 中央目录
+    yield buffer.take()
+
+# ==================== 分卷 ====================
+# 平台限制响应体大小（Vercel约4.5MB，base64编码后为原始大小的4/3），
+# 压缩包超过 MAX_PART_SIZE 字节时改为返回分卷清单，客户端按清单在 options.files 中列出文件逐个请求各分卷
+# 可在请求的 options.max_part_size 中覆盖；设为 0 关闭分卷
+MAX_PART_SIZE = int(os.environ.get('MAX_PART_SIZE', str(3 * 1024 * 1024)))
+# 每个条目除压缩数据外的开销：本地文件头30字节、中央目录46字节，各含一份文件名；每个ZIP另有22字节结束记录
+ZIP_ENTRY_OVERHEAD = 30 + 46
+ZIP_END_OVERHEAD = 22
+# 分卷请求会重新生成文件（如教师指南的时间），压缩后大小可能略有变化，规划时预留的余量
+PART_SIZE_MARGIN = 0.02
+
+def part_size_limit(data):
+    """返回本次请求的分卷大小上限（字节），0表示不分卷；options.max_part_size 无效时抛出RequestBodyError（400）"""
+    value = data.get('options', {}).get('max_part_size', MAX_PART_SIZE)
+    # bool 是 int 的子类，单独排除
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise RequestBodyError(f"max_part_size 应为非负整数（0表示不分卷），收到: {value!r}")
+    return value
+
+def plan_parts(entry_sizes, max_part_size):
+    """按顺序把 (文件名, 压缩后大小) 分到若干分卷，每个分卷整个ZIP不超过上限，返回各分卷的文件名列表"""
+    budget = int(max_part_size * (1 - PART_SIZE_MARGIN))
+    parts, current, current_size = [], [], ZIP_END_OVERHEAD
+    for name, compress_size in entry_sizes:
+        size = ZIP_ENTRY_OVERHEAD + 2 * len(name.encode('utf-8')) + compress_size
+        if size + ZIP_END_OVERHEAD > budget:
+            raise ValueError(f"文件 {name} 压缩后约 {size} 字节，超过分卷大小上限 {max_part_size} 字节")
+        if current and current_size + size > budget:
+            parts.append(current)
+            current, current_size = [], ZIP_END_OVERHEAD
+        current.append(name)
+        current_size += size
+    if current:
+        parts.append(current)
+    return parts
+
+def part_manifest(zip_source, max_part_size):
+    """根据已生成的压缩包（字节数据或文件对象）的中央目录规划分卷，返回分卷清单"""
+    if isinstance(zip_source, (bytes, bytearray, memoryview)):
+        zip_source = BytesIO(zip_source)
+    with zipfile.ZipFile(zip_source) as archive:
+        entry_sizes = [(info.filename, info.compress_size) for info in archive.infolist()]
+    if hasattr(zip_source, 'seek'):
+        zip_source.seek(0)
+
+    parts = plan_parts(entry_sizes, max_part_size)
+    return {
+        'split': True,
+        'max_part_size': max_part_size,
+        'parts': [{'part': index, 'files': files} for index, files in enumerate(parts, 1)],
+        'usage': '分别以原请求数据重新请求各分卷，并在 options 中加入该分卷的 part 和 files',
+    }
+
+def part_download_name(data, default='reading_materials.zip'):
+    """分卷请求的下载文件名"""
+    part = data.get('options', {}).get('part')
+    return f"{default[:-len('.zip')]}_part{part}.zip" if part else default
+
+# ==================== 按需生成 ====================
+# 按需模式（options.lazy）：先只返回将要生成的文件清单，每个文件在被请求时才渲染，
+# 渲染结果由分文件缓存（artifact_memo）按各文件用到的请求数据缓存
+
+# 只影响返回方式、不影响文件内容的选项，计算请求内容的键时忽略
+RESPONSE_OPTIONS = ('lazy', 'artifact', 'files', 'part', 'max_part_size', 'compression', 'low_memory')
+
+def artifact_request_key(data):
+    """请求中决定文件内容部分的规范化哈希：清单请求和之后的单个文件请求得到相同的键"""
+    options = {key: value for key, value in data.get('options', {}).items() if key not in RESPONSE_OPTIONS}
+    return lesson_cache_key(dict(data, options=options))
+
+def artifact_manifest(data, url_prefix=None):
+    """按需模式的文件清单：只列出文件名，不渲染任何文件
+
+    给出url_prefix时每个文件带有获取地址 {url_prefix}/{文件名}；
+    否则客户端以原请求数据重新请求，并在 options.artifact 中给出文件名。
+    """
+    lesson_id = artifact_request_key(data)[:32]
+    artifacts = []
+    for name, _ in lesson_entry_makers(data):
+        artifact = {'name': name}
+        if url_prefix:
+            artifact['url'] = f"{url_prefix}/{name}"
+        artifacts.append(artifact)
+    return {
+        'lazy': True,
+        'lesson_id': lesson_id,
+        'artifacts': artifacts,
+        'usage': '逐个获取文件：请求各文件的 url，或以原请求数据重新请求并在 options 中加入 artifact（文件名）',
+    }
+
+def entry_bytes(content):
+    """把条目内容（字节、文本或CompressedEntry）转换为文件的原始字节"""
+    if isinstance(content, CompressedEntry):
+        if content.compress_type == zipfile.ZIP_STORED:
+            return content.data
+        return zipfile._get_decompressor(content.compress_type).decompress(content.data)
+    if isinstance(content, str):
+        return content.encode('utf-8')
+    return bytes(content)
+
+def find_artifact(data, name):
+    """查找请求中的一个文件，返回渲染该文件（字节数据）的函数，不渲染；文件名不存在时抛出KeyError"""
+    for entry_name, make_content in lesson_entry_makers(data):
+        if entry_name == name:
+            return lambda: entry_bytes(make_content())
+    raise KeyError(name)
+
+def render_artifact(data, name):
+    """只渲染请求中的一个文件，返回其字节数据；文件名不存在时抛出KeyError"""
+    return find_artifact(data, name)()
+
+# ==================== 结果缓存 ====================
+# 同样的请求（按规范化JSON的哈希）直接返回缓存的压缩包；RESULT_CACHE_SIZE 为缓存的总字节数，默认64MB，设为 0 关闭
+# 响应带有以请求哈希为值的ETag，客户端带 If-None-Match 重复请求时不生成也不查缓存，直接返回304。
+# 非可重现模式下命中缓存时返回第一次生成的压缩包（时间戳不变），ETag为弱ETag
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', str(64 * 1024 * 1024)))
+
+class SizedLRUCache:
+    """按值的总字节数限制大小的LRU缓存（线程安全），记录命中、未命中和淘汰次数
+
+    size_of 计算每个值的大小，默认为字节数；按条目数限制时用 lambda value: 1。
+    """
+
+    def __init__(self, max_size, size_of=len):
+        self.max_size = max_size
+        self.size_of = size_of
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """取出缓存的值，不存在时返回None"""
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """放入缓存，超过总大小时淘汰最久未使用的；单个值超过上限时不缓存"""
+        size = self.size_of(value)
+        if size > self.max_size:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size -= self.size_of(previous)
+            self.entries[key] = value
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= self.size_of(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """缓存的条目数、字节数和命中情况"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+result_cache = SizedLRUCache(RESULT_CACHE_SIZE)
+
+def result_etag(data, key):
+    """请求结果的ETag：可重现模式下内容逐字节相同，为强ETag，否则为弱ETag"""
+    value = etag_value(key)
+    return f'"{value}"' if is_reproducible(data.get('options', {})) else f'W/"{value}"'
+
+def etag_value(key):
+    """ETag的值：生成器版本加请求内容的键，部署新的代码或模板后客户端保存的旧ETag不再匹配"""
+    return f'{generator_version()}-{key}'
+
+@lru_cache(maxsize=None)
+def generator_version():
+    """生成器版本：本模块代码、Word模板、样式表、渲染后端和默认压缩策略的摘要
+
+    加在磁盘、共享内存等跨进程、跨重启的缓存的键中，部署新的代码或模板后不再命中旧版本生成的结果。
+    """
+    digest = hashlib.sha256()
+    for path in (__file__, get_docx_template_path()):
+        try:
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            pass
+        digest.update(b'\0')
+    settings = [STYLE_SHEET, USE_OOXML_WRITER, HAS_DOCX, DEFAULT_COMPRESSION_POLICY]
+    digest.update(json.dumps(settings, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def etag_matches(if_none_match, key):
+    """If-None-Match 请求头中是否包含该键在当前生成器版本下的ETag（弱比较，* 匹配任意值）"""
+    value = etag_value(key)
+    for tag in (if_none_match or '').split(','):
+        tag = tag.strip()
+        if tag == '*' or tag.removeprefix('W/').strip('"') == value:
+            return True
+    return False
+
+# ==================== 合并同样的请求 ====================
+# 全班同时打开同一个分享链接、或者连续点击两次生成时，同样的请求同时到达：
+# 同一个键只有第一个请求生成，同时到达的其他请求等待并共用它的结果（生成失败时一起收到同样的异常）
+
+class SingleFlight:
+    """按键合并同时进行的调用"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executions = self.coalesced = 0
+
+    def do(self, key, function):
+        """执行 function() 并返回 (结果, 是否共用了其他调用的结果)；同一个键已有调用在进行时等待它完成"""
+        with self.lock:
+            future = self.calls.get(key)
+            leader = future is None
+            if leader:
+                future = self.calls[key] = Future()
+                self.executions += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = function()
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+    def stats(self):
+        """进行中的键数、实际执行次数和被合并的调用次数"""
+        with self.lock:
+            requests = self.executions + self.coalesced
+            return {
+                'in_flight': len(self.calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'coalesce_rate': round(self.coalesced / requests, 4) if requests else 0.0,
+            }
+
+generation_flight = SingleFlight()
+
+def cached_reading_materials(data, key=None):
+    """返回 (压缩包数据, 缓存状态)，状态为 HIT、MISS 或 COALESCED（共用同时进行的同样请求的结果）"""
+    key = key or lesson_cache_key(data)
+    zip_data = result_cache.get(key)
+    if zip_data is not None:
+        return zip_data, 'HIT'
+
+    def generate_and_cache():
+        zip_data = generate_reading_materials(data)
+        result_cache.put(key, zip_data)
+        return zip_data
+
+    zip_data, coalesced = generation_flight.do(key, generate_and_cache)
+    return zip_data, 'COALESCED' if coalesced else 'MISS'
+
+# ==================== 分文件缓存 ====================
+# 各文件按实际用到的请求数据（文章按版本、问题、词汇表、教师指南的时间和主题）的哈希分别缓存，
+# 只修改了部分内容的请求只重新渲染变化的文件；ARTIFACT_MEMO_SIZE 为缓存的总字节数，默认32MB，设为 0 关闭
+ARTIFACT_MEMO_SIZE = int(os.environ.get('ARTIFACT_MEMO_SIZE', str(32 * 1024 * 1024)))
+artifact_memo = SizedLRUCache(ARTIFACT_MEMO_SIZE)
+# 按文件类型统计的命中和未命中次数
+artifact_memo_counts = {}
+
+def artifact_input_key(kind, inputs):
+    """文件类型、渲染后端和该文件用到的请求数据的规范化哈希"""
+    canonical = json.dumps([kind, USE_OOXML_WRITER, HAS_DOCX, get_docx_template_path(), inputs],
+                           sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def memoized_artifact(kind, inputs, render):
+    """按输入数据的哈希缓存 render() 的结果；渲染失败（ERROR:开头）的结果不缓存"""
+    if ARTIFACT_MEMO_SIZE <= 0:
+        return render()
+    key = artifact_input_key(kind, inputs)
+    content = artifact_memo.get(key)
+    with artifact_memo.lock:
+        counts = artifact_memo_counts.setdefault(kind, {'hits': 0, 'misses': 0})
+        counts['misses' if content is None else 'hits'] += 1
+    if content is None:
+        content = render()
+        if not content.startswith(b'ERROR:'):
+            artifact_memo.put(key, content)
+    return content
+
+def artifact_memo_stats():
+    """分文件缓存的总体统计和按文件类型的命中次数"""
+    with artifact_memo.lock:
+        by_type = {kind: dict(counts) for kind, counts in artifact_memo_counts.items()}
+    return dict(artifact_memo.stats(), by_type=by_type)
+
+def lesson_entries(data, low_memory=False):
+    """按压缩包中的顺序逐个生成 (文件名, 文件内容)
+
+    low_memory为真时文章以StreamedEntry的形式给出，写入压缩包时才逐段渲染；
+    请求的 options.files 给出文件名列表时只生成其中的文件（用于下载分卷）。
+    """
+    files = data.get('options', {}).get('files')
+    wanted = None if files is None else set(files)
+    for name, make_content in lesson_entry_makers(data, low_memory):
+        if wanted is None or name in wanted:
+            yield name, make_content()
+
+def lesson_entry_makers(data, low_memory=False):
+    """按压缩包中的顺序逐个生成 (文件名, 生成文件内容的函数)，文件内容在调用时才渲染"""
+    # 请求数据只解析一次，各文件都从中间表示渲染
+    lesson = build_lesson(data, low_memory=low_memory)
+    options = data.get('options', {})
+    leveled_texts = data.get('leveled_texts', {})
+    questions_data = data.get('comprehension_questions', {})
+    support_materials = data.get('support_materials', {})
+
+    # 生成各版本阅读文章
+    for article in lesson.articles:
+        # Word文档
+        if low_memory:
+            make_doc = lambda blocks=article.blocks, size=len(article.content): StreamedEntry(
+                lambda stream: render_ooxml(blocks, stream), 'docx', size)
+        else:
+            make_doc = lambda article=article: memoized_artifact(
+                'article', [article.version, leveled_texts[article.version]],
+                lambda: render_document(article.blocks, 'Word文档', fallback='html'))
+        yield f"阅读文章_{article.version_name}_{article.file_name}.docx", make_doc
+
+        # 纯文本版本（备用）
+        if low_memory:
+            make_text = lambda article=article: StreamedEntry(
+                lambda stream: write_article_text(stream, article), 'text', len(article.content) * 3)
+        else:
+            make_text = lambda article=article: f"{article.title}\n\n{article.content}".encode('utf-8')
+        yield f"阅读文章_{article.version_name}_纯文本.txt", make_text
+
+    # 生成阅读理解问题：options.answer_key 为真时分别输出学生版和教师答案版
+    make_questions = lambda: memoized_artifact(
+        'questions', questions_data, lambda: render_document(lesson.questions, '问题文档'))
+    if options.get('answer_key'):
+        yield "阅读理解问题_学生版.docx", lambda: memoized_artifact(
+            'student_questions', questions_data, lambda: render_document(lesson.student_questions, '问题文档'))
+        yield "阅读理解问题_教师答案版.docx", make_questions
+    else:
+        yield "阅读理解问题.docx", make_questions
+
+    # 生成词汇表
+    yield "词汇表.docx", lambda: memoized_artifact(
+        'vocabulary', support_materials, lambda: render_document(lesson.vocabulary, '词汇表'))
+
+    # 生成教师指南（预渲染模板，只替换时间和主题）
+    yield "教师使用指南.docx", lambda: generate_teacher_guide(data)
+
+    # 生成使用说明文件（内容固定，直接复制按本次的压缩策略预先压缩好的数据）
+    yield "使用说明.txt", lambda: get_readme_entry(compression_policy(options))
+
+# 纯文本文章每次编码写入的字符数
+TEXT_CHUNK_SIZE = 64 * 1024
+
+def write_article_text(stream, article):
+    """把文章纯文本分段编码写入流，不生成完整的副本"""
+    stream.write(f"{article.title}\n\n".encode('utf-8'))
+    for start in range(0, len(article.content), TEXT_CHUNK_SIZE):
+        stream.write(article.content[start:start + TEXT_CHUNK_SIZE].encode('utf-8'))
+
+# 压缩包内的使用说明
+README_TEXT = """# 分层阅读材料使用说明
 
 ## 文件说明
 1. 阅读文章_XXX.docx - 分层阅读文章
@@ -129,236 +1194,579 @@ def generate_reading_materials(data):
 ## 技术支持
 如有问题，请联系系统管理员。
 """
-        zip_file.writestr("使用说明.txt", readme.encode('utf-8'))
 
-    # 返回ZIP文件的二进制数据
-    zip_buffer.seek(0)
-    return zip_buffer.getvalue()
+def get_readme_entry(policy=None):
+    """返回按压缩策略（与其他文本条目相同）压缩好的使用说明条目"""
+    compress_type, level = entry_compression(README_TEXT.encode('utf-8'), policy or DEFAULT_COMPRESSION_POLICY)
+    return compressed_readme(compress_type, level)
 
-def generate_word_content(version, content):
-    """生成Word文档内容"""
-    if not HAS_DOCX or Document is None:
-        # 备用方案：返回纯HTML
-        html = f"""
-        <html>
-        <head><meta charset="UTF-8"></head>
-        <body>
-            <h1>{content.get('title', '')}</h1>
-            <h3>{get_version_name(version)}</h3>
-            <p>字数：{content.get('word_count', 0)}</p>
-            <hr>
-            <div style="line-height: 1.6;">
-            {content.get('content', '')}
-            </div>
-        </body>
-        </html>
-        """
-        return html.encode('utf-8')
-
-    # 使用python-docx生成
-    try:
-        doc = Document()
-
-        # 标题
-        title = doc.add_heading(content.get('title', '阅读文章'), 0)
-        title_run = title.add_run(content.get('title', '阅读文章'))
-        title_run.font.size = Pt(24)
-        title_run.font.color.rgb = RGBColor(0, 51, 102)
-
-        # 版本信息
-        version_para = doc.add_paragraph()
-        version_para.add_run(f"版本：{get_version_name(version)}").bold = True
-
-        # 基本信息
-        info = doc.add_paragraph()
-        info.add_run(f"字数：{content.get('word_count', 0)} | ")
-        info.add_run(f"阅读难度：{content.get('reading_level', '标准')}")
-
-        # 分隔线
-        doc.add_paragraph().add_run("─" * 50)
-
-        # 正文 - 直接分段处理
-        content_text = content.get('content', '')
-        paragraphs = content_text.split('\n')
-        for para in paragraphs:
-            if para.strip():
-                paragraph = doc.add_paragraph(para.strip())
-                paragraph.paragraph_format.line_spacing = 1.5
-                paragraph.paragraph_format.space_after = Pt(6)
-
-        # 保存到内存
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer.getvalue()
+@lru_cache(maxsize=None)
+def compressed_readme(compress_type, level):
+    """压缩使用说明（每种压缩方式每个进程只压缩一次）"""
+    return compress_entry(README_TEXT.encode('utf-8'), compress_type, level)
 
-    except Exception as e:
-        print(f"生成Word文档失败: {e}")
-        # 备用方案
-        return f"ERROR: {str(e)}".encode('utf-8')
+def append_body_xml(doc, body_xml):
+    """把一段w:p等正文XML一次性解析后插入到文档末尾（分节设置之前）
 
-def generate_questions_content(questions_data):
-    """生成阅读理解问题文档"""
-    if not HAS_DOCX or Document is None:
-        # 简化版
-        content = "阅读理解问题\n\n"
-        for version, questions in questions_data.items():
-            if not questions:
-                continue
-            version_name = get_version_name(version.replace('_questions', ''))
-            content += f"\n{version_name}问题：\n"
-            for i, q in enumerate(questions, 1):
-                content += f"{i}. {q.get('question', '')}\n"
-        return content.encode('utf-8')
+    逐段调用 doc.add_paragraph(style=...) 每次都要按名称查找样式，
+    连续的段落先拼接成XML文本，再在这里统一解析。
+    """
+    fragment = parse_xml(f'<w:body {nsdecls("w")}>{body_xml}</w:body>')
+    body = doc.element.body
+    sect_pr = body.sectPr
+    for element in list(fragment):
+        if sect_pr is not None:
+            sect_pr.addprevious(element)
+        else:
+            body.append(element)
+    return doc
 
-    try:
-        doc = Document()
-        doc.add_heading('阅读理解问题', 0)
+def paragraphs_xml(texts, style=None):
+    """生成同一样式的多个纯文本段落的XML，style为样式ID"""
+    p_pr = paragraph_properties_xml(style)
+    return ''.join(f'<w:p>{p_pr}<w:r>{run_content_xml(text)}</w:r></w:p>' for text in texts)
 
-        for version, questions in questions_data.items():
-            if not questions:
-                continue
+@lru_cache(maxsize=4096)
+def block_xml(block):
+    """把标题或段落块转换为w:p的XML文本
 
-            version_name = get_version_name(version.replace('_questions', ''))
-            doc.add_heading(f'{version_name}问题', level=1)
+    结果按块内容缓存：学生版与教师版问题卷共用的题目和选项片段只生成一次。
+    """
+    if isinstance(block, Heading):
+        style = 'Title' if block.level == 0 else f'Heading{block.level}'
+        return f'<w:p>{paragraph_properties_xml(style)}<w:r>{run_content_xml(block.text)}</w:r></w:p>'
 
-            for i, q in enumerate(questions, 1):
-                # 问题
-                question_para = doc.add_paragraph()
-                question_para.add_run(f'{i}. {q.get("question", "")}').bold = True
+    runs = ''.join(f'<w:r>{run_properties_xml(run.bold, run.color)}{run_content_xml(run.text)}</w:r>'
+                   for run in block.runs)
+    style = style_id(block.style) if block.style else None
+    return f'<w:p>{paragraph_properties_xml(style)}{runs}</w:p>'
 
-                # 选项
-                if q.get('type') == 'choice' and q.get('options'):
-                    for j, option in enumerate(q.get('options', [])):
-                        doc.add_paragraph(f'   {chr(65+j)}. {option}', style='List Bullet')
+# 词汇表列定义：(字段名, 表头)
+VOCABULARY_COLUMNS = [
+    ('word', '词语'),
+    ('pinyin', '拼音'),
+    ('definition', '解释'),
+    ('example', '例句'),
+]
 
-                # 答案
-                answer_para = doc.add_paragraph()
-                answer_run = answer_para.add_run(f'答案：{q.get("answer", "")}')
-                answer_run.font.color.rgb = RGBColor(0, 128, 0)
+def run_content_xml(text):
+    """把文本转换为w:r内部的XML片段，规则与python-docx的run.text一致"""
+    pieces = []
+    for piece in re.split(r'([\t\r\n])', text):
+        if piece == '\t':
+            pieces.append('<w:tab/>')
+        elif piece in ('\r', '\n'):
+            pieces.append('<w:br/>')
+        elif piece:
+            space = ' xml:space="preserve"' if len(piece.strip()) < len(piece) else ''
+            pieces.append(f'<w:t{space}>{escape(piece)}</w:t>')
+    return ''.join(pieces)
 
-                # 解析
-                if q.get('explanation'):
-                    doc.add_paragraph(f'解析：{q.get("explanation")}', style='List Bullet')
+def add_table_rows(table, rows):
+    """批量追加表格行：所有w:tr拼接成一段XML后只解析一次
 
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer.getvalue()
+    逐行调用 table.add_row().cells 每次都会重新遍历整张表格，
+    行数多时耗时按平方增长；这里的耗时随行数线性增长。
+    """
+    widths = [grid_col.get(qn('w:w')) for grid_col in table._tbl.tblGrid.gridCol_lst]
+    rows_xml = table_rows_xml(rows, widths)
+    fragment = parse_xml(f'<w:tbl {nsdecls("w")}>{rows_xml}</w:tbl>')
+    table._tbl.extend(list(fragment))
+    return table
+
+def table_rows_xml(rows, widths):
+    """生成全部w:tr行的XML文本，widths为每列宽度（单位：twip）"""
+    tc_prs = [f'<w:tcPr><w:tcW w:type="dxa" w:w="{width}"/></w:tcPr>' if width else ''
+              for width in widths]
+
+    rows_xml = []
+    for row in rows:
+        rows_xml.append('<w:tr>')
+        for tc_pr, value in zip(tc_prs, row):
+            rows_xml.append(f'<w:tc>{tc_pr}<w:p><w:r>{run_content_xml(str(value))}</w:r></w:p></w:tc>')
+        rows_xml.append('</w:tr>')
+    return ''.join(rows_xml)
+
+# ==================== 课程中间表示 ====================
+# 请求数据只解析一次，得到与输出格式无关的文档块序列，
+# 再交给 python-docx / 流式OOXML / HTML / 纯文本渲染器输出
+
+Run = namedtuple('Run', 'text bold color', defaults=(False, None))
+Heading = namedtuple('Heading', 'text level')
+Paragraph = namedtuple('Paragraph', 'runs style', defaults=(None,))
+Paragraphs = namedtuple('Paragraphs', 'texts style')  # 同一样式的连续纯文本段落，如文章正文
+Table = namedtuple('Table', 'rows style')
+Article = namedtuple('Article', 'version version_name file_name title content blocks')
+Lesson = namedtuple('Lesson', 'articles questions student_questions vocabulary')
+
+def iter_paragraphs(content_text):
+    """逐个返回文本中去掉首尾空白后的非空段落，不一次性切分整个文本"""
+    start = 0
+    while start <= len(content_text):
+        end = content_text.find('\n', start)
+        if end == -1:
+            end = len(content_text)
+        paragraph = content_text[start:end].strip()
+        if paragraph:
+            yield paragraph
+        start = end + 1
+
+class LazyParagraphs:
+    """按需切分的段落序列：每次遍历重新扫描原文，只引用原文不保存段落列表"""
+
+    def __init__(self, content_text):
+        self.content_text = content_text
+
+    def __iter__(self):
+        return iter_paragraphs(self.content_text)
+
+# 中间表示缓存的条目数（设置环境变量 LESSON_CACHE_SIZE=0 可关闭）
+LESSON_CACHE_SIZE = int(os.environ.get('LESSON_CACHE_SIZE', '32'))
+_lesson_cache = SizedLRUCache(LESSON_CACHE_SIZE, size_of=lambda lesson: 1)
+
+def build_article(version, content, lazy=False):
+    """把一个版本的文章转换为文档块，lazy为真时正文段落在渲染时才逐段切分"""
+    version_name = get_version_name(version)
+    title = content.get('title', '阅读文章')
+    content_text = content.get('content', '')
+    blocks = (
+        Paragraph((Run(title),), 'title'),
+        Paragraph((Run(f"版本：{version_name}", bold=True),)),
+        Paragraph((Run(f"字数：{content.get('word_count', 0)} | "),
+                   Run(f"阅读难度：{content.get('reading_level', '标准')}"))),
+        Paragraph((Run("─" * 50),)),
+        Paragraphs(LazyParagraphs(content_text) if lazy else tuple(iter_paragraphs(content_text)), 'body'),
+    )
+    return Article(
+        version=version,
+        version_name=version_name,
+        file_name=content.get('title', '文章').replace('/', '_'),  # 防止路径问题
+        title=content.get('title', ''),
+        content=content_text,
+        blocks=blocks,
+    )
 
+def build_question_sheets(questions_data):
+    """一次遍历同时生成教师版（含答案和解析）与学生版（不含答案）问题卷的文档块
+
+    题目和选项块两份共用，返回 (教师版, 学生版)。
+    """
+    teacher = [Heading('阅读理解问题', 0)]
+    student = [Heading('阅读理解问题', 0)]
+    for version, questions in questions_data.items():
+        if not questions:
+            continue
+
+        version_name = get_version_name(version.replace('_questions', ''))
+        shared = [Heading(f'{version_name}问题', 1)]
+        teacher.extend(shared)
+        student.extend(shared)
+
+        for i, q in enumerate(questions, 1):
+            shared = [Paragraph((Run(f'{i}. {q.get("question", "")}', bold=True),))]
+            if q.get('type') == 'choice' and q.get('options'):
+                for j, option in enumerate(q.get('options', [])):
+                    shared.append(Paragraph((Run(f'   {chr(65+j)}. {option}'),), 'option'))
+            teacher.extend(shared)
+            student.extend(shared)
+
+            teacher.append(Paragraph((Run(f'答案：{q.get("answer", "")}'),), 'answer'))
+            if q.get('explanation'):
+                teacher.append(Paragraph((Run(f'解析：{q.get("explanation")}'),), 'explanation'))
+    return tuple(teacher), tuple(student)
+
+def build_questions(questions_data):
+    """把阅读理解问题转换为文档块（含答案和解析）"""
+    return build_question_sheets(questions_data)[0]
+
+def build_vocabulary(support_materials):
+    """把各版本词汇表转换为文档块"""
+    blocks = [Heading('词汇表', 0)]
+    for version_key, materials in support_materials.items():
+        version_name = get_version_name(version_key.replace('_materials', ''))
+        blocks.append(Heading(f'{version_name}词汇表', 1))
+
+        vocab_list = materials.get('vocabulary_list', [])
+        if vocab_list:
+            rows = [tuple(header for _, header in VOCABULARY_COLUMNS)]
+            rows.extend(tuple(str(vocab.get(key, '')) for key, _ in VOCABULARY_COLUMNS)
+                        for vocab in vocab_list)
+            blocks.append(Table(tuple(rows), 'vocabulary_table'))
+    return tuple(blocks)
+
+def lesson_cache_key(data):
+    """请求数据的规范化哈希：键顺序不同但内容相同的请求得到相同的键"""
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def build_lesson(data, low_memory=False):
+    """把整个请求转换为课程中间表示，结果按请求内容缓存，与输出格式无关
+
+    low_memory为真时文章正文按需切分，且不放入缓存（避免长期引用大段原文）。
+    """
+    key = lesson_cache_key(data) if LESSON_CACHE_SIZE > 0 and not low_memory else None
+    lesson = _lesson_cache.get(key) if key is not None else None
+    if lesson is not None:
+        return lesson
+
+    questions, student_questions = build_question_sheets(data.get('comprehension_questions', {}))
+    lesson = Lesson(
+        articles=tuple(build_article(version, content, lazy=low_memory)
+                       for version, content in sorted(data.get('leveled_texts', {}).items(),
+                                                      key=lambda item: version_order(item[0]))),
+        questions=questions,
+        student_questions=student_questions,
+        vocabulary=build_vocabulary(data.get('support_materials', {})),
+    )
+
+    if key is not None:
+        _lesson_cache.put(key, lesson)
+    return lesson
+
+def render_document(blocks, description, fallback='text'):
+    """按当前渲染后端把文档块输出为文件内容，失败时返回错误信息"""
+    try:
+        if USE_OOXML_WRITER:
+            return render_ooxml(blocks)
+        if not HAS_DOCX or Document is None:
+            # 备用方案：fallback 为 'ooxml' 时直接写出文档XML（不需要python-docx），为 'html' 时输出HTML，否则输出纯文本
+            if fallback == 'ooxml':
+                return render_ooxml(blocks)
+            return render_html(blocks) if fallback == 'html' else render_text(blocks)
+        return render_docx(blocks)
     except Exception as e:
-        print(f"生成问题文档失败: {e}")
+        print(f"生成{description}失败: {e}")
         return f"ERROR: {str(e)}".encode('utf-8')
 
+def render_docx(blocks):
+    """使用python-docx渲染文档块：连续的段落拼接为XML后一次性插入"""
+    doc = new_document()
+    pending = []
+    for block in blocks:
+        if isinstance(block, Table):
+            if pending:
+                append_body_xml(doc, ''.join(pending))
+                pending = []
+            table = doc.add_table(rows=0, cols=len(block.rows[0]))
+            table.style = style_name(block.style)
+            add_table_rows(table, block.rows)
+        elif isinstance(block, Paragraphs):
+            pending.append(paragraphs_xml(block.texts, style_id(block.style)))
+        else:
+            pending.append(block_xml(block))
+    if pending:
+        append_body_xml(doc, ''.join(pending))
+
+    # 保存到内存，python-docx按当前时间写入各部件的时间戳，统一改为固定值
+    buffer = BytesIO()
+    doc.save(buffer)
+    stamp_zip_entries(buffer.getbuffer(), DOCX_DATE_TIME)
+    return buffer.getvalue()
+
+def render_html(blocks):
+    """把文档块渲染为HTML（python-docx不可用时的文章备用格式）"""
+    tags = {'title': 'h1'}
+    parts = ['<html>\n<head><meta charset="UTF-8"></head>\n<body style="line-height: 1.6;">']
+    for block in blocks:
+        if isinstance(block, Heading):
+            level = min(block.level + 1, 6)
+            parts.append(f'<h{level}>{escape(block.text)}</h{level}>')
+        elif isinstance(block, Paragraphs):
+            parts.extend(f'<p>{escape(text)}</p>' for text in block.texts)
+        elif isinstance(block, Paragraph):
+            text = ''.join(f'<strong>{escape(run.text)}</strong>' if run.bold else escape(run.text)
+                           for run in block.runs)
+            tag = tags.get(block.style, 'p')
+            parts.append(f'<{tag}>{text}</{tag}>')
+        elif isinstance(block, Table):
+            rows = ''.join('<tr>' + ''.join(f'<td>{escape(cell)}</td>' for cell in row) + '</tr>'
+                           for row in block.rows)
+            parts.append(f'<table border="1">{rows}</table>')
+    parts.append('</body>\n</html>')
+    return '\n'.join(parts).encode('utf-8')
+
+def render_text(blocks):
+    """把文档块渲染为纯文本"""
+    lines = []
+    for block in blocks:
+        if isinstance(block, Heading):
+            if lines and lines[-1]:
+                lines.append('')
+            lines.append(block.text)
+            if block.level == 0:
+                lines.append('')
+        elif isinstance(block, Paragraphs):
+            lines.extend(block.texts)
+        elif isinstance(block, Paragraph):
+            lines.append(''.join(run.text for run in block.runs))
+        elif isinstance(block, Table):
+            lines.extend(' | '.join(row) for row in block.rows)
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+def generate_word_content(version, content):
+    """生成Word文档内容"""
+    return memoized_artifact('article', [version, content], lambda: render_document(
+        build_article(version, content).blocks, 'Word文档', fallback='html'))
+
+def generate_questions_content(questions_data):
+    """生成阅读理解问题文档"""
+    return memoized_artifact('questions', questions_data, lambda: render_document(
+        build_questions(questions_data), '问题文档'))
+
 def generate_vocabulary_content(support_materials):
     """生成词汇表文档"""
-    if not HAS_DOCX or Document is None:
-        content = "词汇表\n\n"
-        for version_key, materials in support_materials.items():
-            version = version_key.replace('_materials', '')
-            version_name = get_version_name(version)
-            content += f"\n{version_name}词汇表：\n"
-
-            vocab_list = materials.get('vocabulary_list', [])
-            for vocab in vocab_list:
-                content += f"• {vocab.get('word', '')}：{vocab.get('definition', '')}\n"
-        return content.encode('utf-8')
+    return memoized_artifact('vocabulary', support_materials, lambda: render_document(
+        build_vocabulary(support_materials), '词汇表'))
 
-    try:
-        doc = Document()
-        doc.add_heading('词汇表', 0)
-
-        for version_key, materials in support_materials.items():
-            version = version_key.replace('_materials', '')
-            version_name = get_version_name(version)
-
-            doc.add_heading(f'{version_name}词汇表', level=1)
-
-            # 创建表格
-            vocab_list = materials.get('vocabulary_list', [])
-            if vocab_list:
-                table = doc.add_table(rows=1, cols=4)
-                table.style = 'Light Grid Accent 1'
-
-                # 表头
-                headers = table.rows[0].cells
-                headers[0].text = '词语'
-                headers[1].text = '拼音'
-                headers[2].text = '解释'
-                headers[3].text = '例句'
-
-                # 添加数据
-                for vocab in vocab_list:
-                    row_cells = table.add_row().cells
-                    row_cells[0].text = vocab.get('word', '')
-                    row_cells[1].text = vocab.get('pinyin', '')
-                    row_cells[2].text = vocab.get('definition', '')
-                    row_cells[3].text = vocab.get('example', '')
+# 教师指南的静态内容，随请求变化的字段用占位符表示
+TEACHER_GUIDE_BLOCKS = (
+    Heading('教师使用指南', 0),
+    Heading('一、课程信息', 1),
+    Paragraph((Run('生成时间：{{generated_at}}'),)),
+    Paragraph((Run('主题：{{core_theme}}'),)),
+    Heading('二、使用建议', 1),
+    Heading('1. 分组教学', 2),
+    Paragraph((Run('基础版：适合阅读困难的学生'),), 'bullet'),
+    Paragraph((Run('标准版：适合大多数学生'),), 'bullet'),
+    Paragraph((Run('挑战版：适合阅读能力强的学生'),), 'bullet'),
+    Heading('2. 教学流程', 2),
+    Paragraph((Run('课前：分发适合学生水平的阅读材料'),), 'bullet'),
+    Paragraph((Run('课中：组织小组讨论，鼓励学生分享'),), 'bullet'),
+    Paragraph((Run('课后：使用配套问题进行评估'),), 'bullet'),
+    Heading('3. 差异化策略', 2),
+    Paragraph((Run('允许学生根据自己的进度选择材料'),), 'bullet'),
+    Paragraph((Run('鼓励完成基础版的学生尝试挑战版'),), 'bullet'),
+    Paragraph((Run('组织跨版本的小组合作'),), 'bullet'),
+    Heading('4. 评估建议', 2),
+    Paragraph((Run('使用配套的阅读理解问题'),), 'bullet'),
+    Paragraph((Run('观察学生在讨论中的表现'),), 'bullet'),
+    Paragraph((Run('鼓励学生进行自我评估'),), 'bullet'),
+    Heading('三、注意事项', 1),
+    Paragraph((Run('1. 建议教师先阅读所有版本的材料'),), 'bullet'),
+    Paragraph((Run('2. 根据学生的实际反应调整教学策略'),), 'bullet'),
+    Paragraph((Run('3. 鼓励学生提出问题，激发思考'),), 'bullet'),
+)
 
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        return buffer.getvalue()
+# 预渲染的教师指南，按渲染后端和模板分别缓存
+_teacher_guide_cache = {}
 
-    except Exception as e:
-        print(f"生成词汇表失败: {e}")
-        return f"ERROR: {str(e)}".encode('utf-8')
+def get_teacher_guide_template():
+    """返回预渲染的教师指南 (部件字典, 含占位符的正文, 替换值的转义函数)
+
+    缓存压缩好的各部件，正文为 word/document.xml；没有python-docx时用OOXML写出器渲染，仍是Word文档。
+    渲染失败时部件字典为None，正文为错误信息。
+    """
+    key = (USE_OOXML_WRITER, HAS_DOCX, get_docx_template_path())
+    if key in _teacher_guide_cache:
+        return _teacher_guide_cache[key]
 
+    content = render_document(TEACHER_GUIDE_BLOCKS, '教师指南', fallback='ooxml')
+    if content.startswith(b'ERROR:'):
+        # 渲染失败不缓存，原样返回错误信息
+        return None, content.decode('utf-8'), str
+
+    with zipfile.ZipFile(BytesIO(content)) as guide:
+        parts = {name: compress_entry(guide.read(name)) for name in guide.namelist()}
+        document = guide.read('word/document.xml').decode('utf-8')
+    template = (parts, document, escape)
+    _teacher_guide_cache[key] = template
+    return template
 
 def generate_teacher_guide(data):
-    """生成教师指南 - 修复版"""
-    try:
-        guide = f"""# 教师使用指南
-
-        ## 课程信息
-        - 生成时间：{datetime.now().strftime('%Y年%m月%d日 %H:%M')}
-        - 主题：{data.get('core_theme', '自定义主题')}
-        
-        ## 使用建议
-        
-        ### 1. 分组教学
-        - 基础版：适合阅读困难的学生
-        - 标准版：适合大多数学生  
-        - 挑战版：适合阅读能力强的学生
-        
-        ### 2. 教学流程
-        1. 课前：分发适合学生水平的阅读材料
-        2. 课中：组织小组讨论，鼓励学生分享
-        3. 课后：使用配套问题进行评估
-        
-        ### 3. 差异化策略
-        - 允许学生根据自己的进度选择材料
-        - 鼓励完成基础版的学生尝试挑战版
-        - 组织跨版本的小组合作
-        
-        ### 4. 评估建议
-        - 使用配套的阅读理解问题
-        - 观察学生在讨论中的表现
-        - 鼓励学生进行自我评估
-        
-        ## 注意事项
-        1. 建议教师先阅读所有版本的材料
-        2. 根据学生的实际反应调整教学策略
-        3. 鼓励学生提出问题，激发思考
-        
-        ---
-        *本材料由分层阅读材料生成系统生成，仅供教学参考*
-        """
-
-        # 使用更简单的纯文本格式，避免Word兼容性问题
-        return guide.encode('utf-8')
-    except Exception as e:
-        return f"教师指南生成失败: {str(e)}".encode('utf-8')
+    """生成教师指南：静态内容每个进程只渲染一次，每次请求只替换生成时间和主题（按这两项缓存）"""
+    values = {
+        'generated_at': generation_time(data.get('options', {})).strftime('%Y年%m月%d日 %H:%M'),
+        'core_theme': data.get('core_theme', '自定义主题'),
+    }
+    return memoized_artifact('teacher_guide', values, lambda: fill_teacher_guide(values))
+
+def fill_teacher_guide(values):
+    """把生成时间和主题填入预渲染的教师指南"""
+    parts, document, escape_value = get_teacher_guide_template()
+    for name, value in values.items():
+        document = document.replace(f'{{{{{name}}}}}', escape_value(str(value)))
+
+    if parts is None:
+        return document.encode('utf-8')
+
+    buffer = BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, entry in parts.items():
+            write_entry(package, name, document.encode('utf-8') if name == 'word/document.xml' else entry,
+                        DOCX_PACKAGE_POLICY)
+    return buffer.getvalue()
+
+# 各版本的中文名称，顺序即压缩包中的文章顺序
+VERSION_NAMES = {
+    'basic': '基础版',
+    'standard': '标准版',
+    'advanced': '挑战版',
+    'extension': '拓展版'
+}
 
 def get_version_name(version_key):
     """获取版本的中文名称"""
-    names = {
-        'basic': '基础版',
-        'standard': '标准版',
-        'advanced': '挑战版',
-        'extension': '拓展版'
-    }
-    return names.get(version_key, version_key)
+    return VERSION_NAMES.get(version_key, version_key)
+
+def version_order(version_key):
+    """文章的排序键：已知版本按难度排列，其余按版本名排在后面，与请求中的键顺序无关"""
+    known = list(VERSION_NAMES)
+    return (known.index(version_key), '') if version_key in known else (len(known), version_key)
+
+# ==================== 可重现输出 ====================
+# 可重现模式：同样的请求总是得到字节完全相同的压缩包（可用于ETag、CDN缓存和去重）
+# 设置 REPRODUCIBLE_ARCHIVES=1 总是开启，或在请求中设置 options.reproducible；
+# 请求给出 options.generated_at（ISO格式，如 2024-09-01T08:00）时也会开启，并以它作为生成时间
+REPRODUCIBLE_ARCHIVES = os.environ.get('REPRODUCIBLE_ARCHIVES', '0') == '1'
+# ZIP能表示的最早时间，可重现模式下没有给出生成时间时使用（可用 SOURCE_DATE_EPOCH 环境变量指定）
+ZIP_EPOCH = datetime(1980, 1, 1)
+# ZIP头中的年份为1980起的7位整数，能表示的最后一年
+ZIP_LAST_YEAR = 1980 + 127
+
+def is_reproducible(options):
+    """判断本次请求是否使用可重现模式"""
+    if 'reproducible' in options:
+        return bool(options['reproducible'])
+    return REPRODUCIBLE_ARCHIVES or bool(options.get('generated_at'))
+
+def generation_time(options):
+    """本次生成的时间：优先取 options.generated_at；可重现模式下为 SOURCE_DATE_EPOCH 或 ZIP_EPOCH；否则为当前时间"""
+    if options.get('generated_at'):
+        return parse_generated_at(options['generated_at'])
+    if not is_reproducible(options):
+        return datetime.now()
+    if os.environ.get('SOURCE_DATE_EPOCH'):
+        return datetime.fromtimestamp(int(os.environ['SOURCE_DATE_EPOCH']), timezone.utc)
+    return ZIP_EPOCH
+
+def parse_generated_at(value):
+    """解析 options.generated_at；不是ISO格式或晚于ZIP能表示的时间时抛出RequestBodyError（400）"""
+    try:
+        moment = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise RequestBodyError(f"generated_at 应为ISO格式的时间（如 2024-09-01T08:30），收到: {value!r}")
+    if moment.year > ZIP_LAST_YEAR:
+        raise RequestBodyError(f"generated_at 不能晚于 {ZIP_LAST_YEAR} 年，收到: {value!r}")
+    return moment
+
+def archive_date_time(options):
+    """压缩包各条目的时间戳：可重现模式下为生成时间（不早于1980年），否则为None（写入时的当前时间）"""
+    if not is_reproducible(options):
+        return None
+    return max(generation_time(options).replace(tzinfo=None), ZIP_EPOCH).timetuple()[:6]
+
+# ==================== 流式OOXML写出后端 ====================
+
+W_NAMESPACE = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+XML_DECLARATION = "<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n"
+
+# 页面设置与基础模板一致（Letter纸，左右边距1.25英寸）
+OOXML_TEXT_WIDTH = 8640
+OOXML_SECTION_XML = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800"'
+    ' w:header="720" w:footer="720" w:gutter="0"/>'
+    '<w:cols w:space="720"/><w:docGrid w:linePitch="360"/></w:sectPr>'
+)
+
+class OoxmlDocument:
+    """流式写出 word/document.xml：每个段落和表格生成后立即写入输出流，不构建对象树"""
+
+    # 累积到这个长度再写入ZIP条目，减少压缩器的调用次数
+    FLUSH_SIZE = 64 * 1024
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._chunks = []
+        self._size = 0
+        self._write(XML_DECLARATION + f'<w:document xmlns:w="{W_NAMESPACE}"><w:body>')
+
+    def _write(self, text):
+        self._chunks.append(text)
+        self._size += len(text)
+        if self._size >= self.FLUSH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        self._stream.write(''.join(self._chunks).encode('utf-8'))
+        self._chunks = []
+        self._size = 0
+
+    def add_xml(self, xml):
+        """直接写入已生成的正文XML片段（如 block_xml 的结果）"""
+        self._write(xml)
+
+    def add_paragraphs(self, texts, style=None):
+        """逐段写入同一样式的纯文本段落，texts可以是按需生成段落的迭代器"""
+        p_pr = paragraph_properties_xml(style)
+        for text in texts:
+            self._write(f'<w:p>{p_pr}<w:r>{run_content_xml(text)}</w:r></w:p>')
+
+    def add_heading(self, text, level=1, **run_format):
+        """添加标题：level为0时使用Title样式，其余使用HeadingN样式"""
+        style = 'Title' if level == 0 else f'Heading{level}'
+        self.add_paragraph([(text, run_format)], style=style)
+
+    def add_paragraph(self, runs=(), style=None, line_spacing=None, space_after=None):
+        """添加段落：runs中每项为字符串或 (文本, 格式字典)，格式见 run_properties_xml"""
+        parts = ['<w:p>', paragraph_properties_xml(style, line_spacing, space_after)]
+        for run in runs:
+            text, run_format = (run, {}) if isinstance(run, str) else run
+            parts.append(f'<w:r>{run_properties_xml(**run_format)}{run_content_xml(text)}</w:r>')
+        parts.append('</w:p>')
+        self._write(''.join(parts))
+
+    def add_table(self, rows, style=None):
+        """添加表格：rows为二维文本列表，各列平分页面宽度"""
+        col_count = max((len(row) for row in rows), default=0)
+        if not col_count:
+            return
+        widths = [OOXML_TEXT_WIDTH // col_count] * col_count
+        style_xml = f'<w:tblStyle w:val="{style}"/>' if style else ''
+        grid_xml = ''.join(f'<w:gridCol w:w="{width}"/>' for width in widths)
+        self._write(
+            f'<w:tbl><w:tblPr>{style_xml}<w:tblW w:type="auto" w:w="0"/>'
+            '<w:tblLook w:firstColumn="1" w:firstRow="1" w:lastColumn="0" w:lastRow="0"'
+            ' w:noHBand="0" w:noVBand="1" w:val="04A0"/></w:tblPr>'
+            f'<w:tblGrid>{grid_xml}</w:tblGrid>'
+        )
+        self._write(table_rows_xml(rows, widths))
+        self._write('</w:tbl>')
+
+    def close(self):
+        """写入分节设置并结束文档"""
+        self._write(OOXML_SECTION_XML + '</w:body></w:document>')
+        self._flush()
+
+def write_ooxml_package(render, output=None):
+    """生成.docx：模板部件直接写入，document.xml由render(doc)流式写入ZIP条目
+
+    给出output（可写的二进制流）时直接写入其中并返回None，否则返回.docx二进制数据。
+    """
+    buffer = BytesIO() if output is None else output
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as package:
+        for name, entry in get_template_parts().items():
+            write_entry(package, name, entry, DOCX_PACKAGE_POLICY)
+        info = entry_info('word/document.xml', DOCX_PACKAGE_POLICY)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with package.open(info, 'w') as stream:
+            doc = OoxmlDocument(stream)
+            render(doc)
+            doc.close()
+    return buffer.getvalue() if output is None else None
+
+def render_ooxml(blocks, output=None):
+    """使用流式后端渲染文档块，output的含义见 write_ooxml_package"""
+    def render(doc):
+        for block in blocks:
+            if isinstance(block, Table):
+                doc.add_table(block.rows, style=style_id(block.style))
+            elif isinstance(block, Paragraphs):
+                doc.add_paragraphs(block.texts, style=style_id(block.style))
+            else:
+                doc.add_xml(block_xml(block))
+
+    return write_ooxml_package(render, output)
 
 # 本地测试代码（仅当直接运行此文件时执行）
 if __name__ == "__main__":
@@ -0,0 +1,606 @@
+"""
+分层阅读材料生成系统 - 性能基准脚本
+放在项目根目录运行：python benchmark.py
+"""
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+
+
+def setup_environment():
+    """把项目根目录加入Python路径"""
+    project_root = os.path.dirname(os.path.abspath(__file__))
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+
+
+def build_sample_data(version_count=4, paragraph_count=20, vocab_count=10):
+    """构造与Coze工作流输出结构一致的测试数据"""
+    version_keys = ['basic', 'standard', 'advanced', 'extension'][:version_count]
+    paragraph = "蚂蚁是一种社会性昆虫，它们生活在地下的巢穴中，通过释放特殊的气味来互相交流信息。"
+
+    data = {
+        "leveled_texts": {},
+        "comprehension_questions": {},
+        "support_materials": {},
+        "core_theme": "蚂蚁的社会性"
+    }
+    for key in version_keys:
+        data["leveled_texts"][key] = {
+            "title": f"蚂蚁的生活（{key}）",
+            "content": "\n".join(paragraph for _ in range(paragraph_count)),
+            "word_count": len(paragraph) * paragraph_count,
+            "reading_level": "标准"
+        }
+        data["comprehension_questions"][f"{key}_questions"] = [
+            {
+                "question": "蚂蚁住在哪里？",
+                "type": "choice",
+                "options": ["树上", "地下", "水里"],
+                "answer": "地下",
+                "explanation": "文章中说'它们住在地下'"
+            }
+        ]
+        data["support_materials"][f"{key}_materials"] = {
+            "vocabulary_list": [
+                {
+                    "word": f"昆虫{i}",
+                    "pinyin": "kūn chóng",
+                    "definition": "身体分头、胸、腹三部分，有六只脚的动物",
+                    "example": "蝴蝶和蚂蚁都是昆虫。"
+                }
+                for i in range(vocab_count)
+            ]
+        }
+    return data
+
+
+def time_call(func, repeat):
+    """返回func平均每次调用耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+
+def bench_document_prototype(generate_module):
+    """对比每次 Document() 与原型克隆创建空白文档的耗时"""
+    print("\n📄 空白文档创建耗时（原型缓存）")
+    if not generate_module.HAS_DOCX:
+        print("⚠️  python-docx未安装，跳过")
+        return
+
+    data = build_sample_data()
+    original_setting = generate_module.DOCX_PROTOTYPE_CACHE
+    try:
+        for enabled in (False, True):
+            generate_module.DOCX_PROTOTYPE_CACHE = enabled
+            generate_module.new_document()  # 预热
+            per_doc = time_call(generate_module.new_document, 50)
+            per_request = time_call(lambda: generate_module.generate_reading_materials(data), 5)
+            label = "原型克隆" if enabled else "Document()"
+            print(f"  {label:<12} 每个文档 {per_doc:7.2f} ms | 每个请求 {per_request:8.2f} ms")
+    finally:
+        generate_module.DOCX_PROTOTYPE_CACHE = original_setting
+
+
+def bench_vocabulary_table(generate_module):
+    """对比逐行 add_row 与批量生成词汇表的耗时随行数的变化"""
+    print("\n📋 词汇表生成耗时（批量建表）")
+    if not generate_module.HAS_DOCX:
+        print("⚠️  python-docx未安装，跳过")
+        return
+
+    def add_rows_one_by_one(rows):
+        doc = generate_module.new_document()
+        table = doc.add_table(rows=0, cols=len(generate_module.VOCABULARY_COLUMNS))
+        for row in rows:
+            cells = table.add_row().cells
+            for cell, value in zip(cells, row):
+                cell.text = value
+
+    def add_rows_in_bulk(rows):
+        doc = generate_module.new_document()
+        table = doc.add_table(rows=0, cols=len(generate_module.VOCABULARY_COLUMNS))
+        generate_module.add_table_rows(table, rows)
+
+    for row_count in (100, 1000, 3000):
+        vocab_list = build_sample_data(1, 1, row_count)["support_materials"]["basic_materials"]["vocabulary_list"]
+        rows = [[vocab[key] for key, _ in generate_module.VOCABULARY_COLUMNS] for vocab in vocab_list]
+        one_by_one = time_call(lambda: add_rows_one_by_one(rows), 1)
+        bulk = time_call(lambda: add_rows_in_bulk(rows), 3)
+        print(f"  {row_count:>5} 行  逐行 {one_by_one:8.1f} ms | 批量 {bulk:7.1f} ms")
+
+
+def bench_render_backend(generate_module):
+    """对比python-docx后端与流式OOXML后端生成整套材料的耗时"""
+    print("\n⚙️  渲染后端耗时（python-docx / 流式OOXML）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    original_setting = generate_module.USE_OOXML_WRITER
+    try:
+        for use_ooxml in (False, True):
+            if not use_ooxml and not generate_module.HAS_DOCX:
+                continue
+            generate_module.USE_OOXML_WRITER = use_ooxml
+            per_request = time_call(lambda: generate_module.generate_reading_materials(data), 3)
+            label = "ooxml" if use_ooxml else "python-docx"
+            print(f"  {label:<12} 每个请求 {per_request:8.2f} ms")
+    finally:
+        generate_module.USE_OOXML_WRITER = original_setting
+
+
+def bench_template_size(generate_module):
+    """对比python-docx默认模板与精简模板生成的ZIP大小和耗时"""
+    print("\n📦 模板大小对比（默认模板 / 精简模板）")
+    if not generate_module.HAS_DOCX:
+        print("⚠️  python-docx未安装，跳过")
+        return
+
+    import docx
+    templates = [
+        ("默认模板", os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')),
+        ("精简模板", generate_module.DOCX_TEMPLATE_PATH),
+    ]
+    data = build_sample_data()
+    original_path = generate_module.DOCX_TEMPLATE_PATH
+    try:
+        for label, template_path in templates:
+            generate_module.DOCX_TEMPLATE_PATH = template_path
+            zip_data = generate_module.generate_reading_materials(data)
+            per_request = time_call(lambda: generate_module.generate_reading_materials(data), 5)
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as archive:
+                docx_sizes = [info.compress_size for info in archive.infolist()
+                              if info.filename.endswith('.docx')]
+            print(f"  {label}  ZIP {len(zip_data):>7} 字节 | "
+                  f"平均每个docx {sum(docx_sizes) // len(docx_sizes):>6} 字节 | 每个请求 {per_request:7.2f} ms")
+    finally:
+        generate_module.DOCX_TEMPLATE_PATH = original_path
+
+
+def bench_answer_key(generate_module):
+    """对比只生成问题卷与同时生成学生版+教师答案版的耗时"""
+    print("\n📝 问题卷生成耗时（单份 / 学生版+教师答案版）")
+    data = build_sample_data()
+    dual_data = dict(data, options={"answer_key": True})
+    single = time_call(lambda: generate_module.generate_reading_materials(data), 5)
+    dual = time_call(lambda: generate_module.generate_reading_materials(dual_data), 5)
+    print(f"  单份问题卷     每个请求 {single:8.2f} ms")
+    print(f"  学生版+答案版  每个请求 {dual:8.2f} ms")
+
+
+def bench_teacher_guide(generate_module):
+    """对比每次完整渲染教师指南与预渲染后只替换占位符的耗时"""
+    print("\n👩‍🏫 教师指南生成耗时（完整渲染 / 预渲染替换）")
+    data = build_sample_data(1, 1, 1)
+    full = time_call(lambda: generate_module.render_document(generate_module.TEACHER_GUIDE_BLOCKS, '教师指南'), 20)
+    generate_module.generate_teacher_guide(data)  # 预热
+    patched = time_call(lambda: generate_module.generate_teacher_guide(data), 20)
+    print(f"  完整渲染  每份 {full:7.2f} ms")
+    print(f"  预渲染    每份 {patched:7.2f} ms")
+
+
+def bench_raw_copy(generate_module):
+    """对比缓存产物用 writestr 重新压缩与原样复制压缩数据组装外层ZIP的耗时"""
+    print("\n📎 外层ZIP组装耗时（重新压缩 / 原样复制）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    with zipfile.ZipFile(io.BytesIO(generate_module.generate_reading_materials(data))) as archive:
+        artifacts = {name: archive.read(name) for name in archive.namelist()}
+    entries = {name: generate_module.compress_entry(content) for name, content in artifacts.items()}
+
+    def assemble(contents):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            for name, content in contents.items():
+                generate_module.write_entry(zip_file, name, content)
+        return buffer.getvalue()
+
+    total = sum(len(content) for content in artifacts.values())
+    recompress = time_call(lambda: assemble(artifacts), 10)
+    raw_copy = time_call(lambda: assemble(entries), 10)
+    print(f"  {len(artifacts)} 个条目，共 {total} 字节")
+    print(f"  writestr  每次组装 {recompress:7.2f} ms")
+    print(f"  原样复制  每次组装 {raw_copy:7.2f} ms")
+
+
+def bench_compression_policy(generate_module):
+    """按条目类型测量各压缩方式的压缩后大小和耗时，用于调整压缩策略"""
+    print("\n🗜️  条目压缩策略（字节 / 毫秒，按条目类型）")
+    data = build_sample_data(version_count=1)
+    large_data = build_sample_data(version_count=1, paragraph_count=5000)
+    samples = {}
+    for label, sample_data in (("docx", data), ("txt", data), ("大txt", large_data)):
+        with zipfile.ZipFile(io.BytesIO(generate_module.generate_reading_materials(sample_data))) as archive:
+            suffix = ".docx" if label == "docx" else "_纯文本.txt"
+            name = next(name for name in archive.namelist() if name.endswith(suffix))
+            samples[label] = archive.read(name)
+
+    methods = [
+        ("stored", zipfile.ZIP_STORED, None),
+        ("deflate-1", zipfile.ZIP_DEFLATED, 1),
+        ("deflate-6", zipfile.ZIP_DEFLATED, 6),
+        ("deflate-9", zipfile.ZIP_DEFLATED, 9),
+        ("bzip2", zipfile.ZIP_BZIP2, 9),
+        ("lzma", zipfile.ZIP_LZMA, None),
+    ]
+    for label, content in samples.items():
+        print(f"  {label}（原始 {len(content)} 字节）")
+        for method, compress_type, level in methods:
+            entry = generate_module.compress_entry(content, compress_type, level)
+            elapsed = time_call(lambda: generate_module.compress_entry(content, compress_type, level), 5)
+            print(f"    {method:<10} {len(entry.data):>8} 字节 | {elapsed:7.2f} ms")
+
+
+def bench_parallel_compression(generate_module):
+    """对比不同线程数下并行压缩组装大压缩包的耗时"""
+    print(f"\n🧵 并行压缩耗时（本机 {os.cpu_count()} 核）")
+    data = build_sample_data(paragraph_count=20000)
+    entries = list(generate_module.lesson_entries(data))
+    policy = generate_module.compression_policy({"compression": {"docx": "deflate"}})
+    total = sum(len(content) for _, content in entries
+                if not isinstance(content, generate_module.CompressedEntry))
+    print(f"  {len(entries)} 个条目，待压缩 {total} 字节")
+
+    def assemble(workers):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            generate_module.write_entries(zip_file, entries, policy, workers)
+        return buffer.getvalue()
+
+    for workers in (1, 2, 4, 8):
+        elapsed = time_call(lambda: assemble(workers), 3)
+        print(f"  {workers} 线程  每次组装 {elapsed:8.2f} ms | ZIP {len(assemble(workers))} 字节")
+
+
+def bench_streaming(generate_module):
+    """对比整体生成与流式生成的首字节时间和峰值内存"""
+    print("\n🌊 流式生成（首字节时间 / 总耗时 / 峰值内存）")
+    data = build_sample_data(paragraph_count=2000, vocab_count=500)
+
+    def buffered():
+        yield generate_module.generate_reading_materials(data)
+
+    for label, make_chunks in (("整体生成", buffered),
+                               ("流式生成", lambda: generate_module.stream_reading_materials(data))):
+        tracemalloc.start()
+        start = time.perf_counter()
+        first_byte = None
+        for chunk in make_chunks():
+            if first_byte is None:
+                first_byte = (time.perf_counter() - start) * 1000
+        total = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"  {label}  首字节 {first_byte:8.2f} ms | 总耗时 {total:8.2f} ms | 峰值内存 {peak // 1024:>6} KB")
+
+
+def bench_response_allocations(generate_module):
+    """测量生成ZIP之后、交给响应之前各种取数据方式额外分配的内存"""
+    from local_server import view_chunks
+    print("\n🧮 响应数据分配（生成之后额外分配的内存）")
+    data = build_sample_data(paragraph_count=2000, vocab_count=500)
+    temp_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "temp_benchmark.zip")
+
+    def via_temp_file(zip_buffer):
+        # 原做法：写入临时文件，再由send_file读回
+        with open(temp_path, "wb") as f:
+            f.write(zip_buffer.getvalue())
+        with open(temp_path, "rb") as f:
+            return f.read()
+
+    def via_chunks(zip_buffer):
+        # 现做法：getbuffer() 后按块复制为bytes发送，同一时间只有一块的副本
+        view = zip_buffer.getbuffer()
+        for _ in view_chunks(view):
+            pass
+        return view
+
+    paths = [
+        ("getvalue()", lambda zip_buffer: zip_buffer.getvalue()),
+        ("临时文件", via_temp_file),
+        ("getbuffer()", lambda zip_buffer: zip_buffer.getbuffer()),
+        ("分块发送", via_chunks),
+    ]
+    try:
+        for label, take in paths:
+            zip_buffer = generate_module.build_reading_materials(data)
+            tracemalloc.start()
+            result = take(zip_buffer)
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {label:<12} ZIP {len(result):>8} 字节 | 额外分配 {current:>8} 字节 | 峰值 {peak:>8} 字节")
+            del result
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def bench_low_memory(generate_module):
+    """对比普通模式与低内存模式生成大篇幅文章时的峰值内存"""
+    print("\n🪶 低内存模式（约5MB原文，tracemalloc峰值）")
+    data = build_sample_data(version_count=1, paragraph_count=40000, vocab_count=10)
+    text_size = len(data["leveled_texts"]["basic"]["content"].encode("utf-8"))
+    print(f"  原文 {text_size} 字节")
+
+    for label, low_memory in (("普通模式", False), ("低内存模式", True)):
+        request_data = dict(data, options={"low_memory": low_memory})
+        generate_module._lesson_cache.clear()
+        tracemalloc.start()
+        start = time.perf_counter()
+        zip_buffer = generate_module.build_reading_materials(request_data)
+        elapsed = (time.perf_counter() - start) * 1000
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        on_disk = getattr(zip_buffer, "_rolled", False)
+        print(f"  {label}  峰值内存 {peak // 1024:>7} KB | 耗时 {elapsed:8.2f} ms | "
+              f"ZIP{'在临时文件中' if on_disk else '在内存中'}")
+        zip_buffer.close()
+    generate_module._lesson_cache.clear()
+
+
+def bench_lazy_artifacts(generate_module):
+    """对比生成完整压缩包与按需模式下返回清单、获取第一个文件的耗时"""
+    print("\n📋 按需生成（清单 + 第一个文件 vs 完整压缩包）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+
+    def clear_caches():
+        generate_module._lesson_cache.clear()
+        generate_module.artifact_memo.clear()
+
+    def full_archive():
+        clear_caches()
+        generate_module.generate_reading_materials(data)
+
+    first_name = None
+
+    def manifest_only():
+        nonlocal first_name
+        clear_caches()
+        first_name = generate_module.artifact_manifest(data)["artifacts"][0]["name"]
+
+    def first_artifact():
+        manifest_only()
+        generate_module.render_artifact(data, first_name)
+
+    full_ms = time_call(full_archive, 5)
+    manifest_ms = time_call(manifest_only, 5)
+    first_ms = time_call(first_artifact, 5)
+    # 再次获取由分文件缓存命中（其他基准中关闭了分文件缓存，这里临时打开）
+    memo_size, generate_module.ARTIFACT_MEMO_SIZE = generate_module.ARTIFACT_MEMO_SIZE, 32 * 1024 * 1024
+    generate_module.render_artifact(data, first_name)
+    cached_ms = time_call(lambda: generate_module.render_artifact(data, first_name), 50)
+    generate_module.ARTIFACT_MEMO_SIZE = memo_size
+    clear_caches()
+    print(f"  完整压缩包      {full_ms:8.2f} ms")
+    print(f"  只返回清单      {manifest_ms:8.2f} ms")
+    print(f"  清单+第一个文件 {first_ms:8.2f} ms ({first_name})")
+    print(f"  再次获取(缓存)  {cached_ms:8.3f} ms")
+
+
+def bench_request_bodies(generate_module):
+    """对比各种请求体编码的上传大小和解析耗时"""
+    import base64
+    import gzip
+    import json
+    import zlib
+    print("\n📨 请求体编码（上传字节数和解码+JSON解析耗时）")
+    data = build_sample_data(paragraph_count=500, vocab_count=500)
+    raw = json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+    variants = [
+        ("JSON", raw, None, False),
+        ("JSON+base64", base64.b64encode(raw), None, True),
+        ("gzip", gzip.compress(raw), "gzip", False),
+        ("deflate", zlib.compress(raw), "deflate", False),
+        ("gzip+base64", base64.b64encode(gzip.compress(raw)), "gzip", True),
+    ]
+    for label, body, encoding, is_base64 in variants:
+        elapsed = time_call(lambda: generate_module.parse_request_body(body, encoding, is_base64), 20)
+        print(f"  {label:<12} {len(body):>8} 字节 ({len(body) / len(raw):6.1%}) | 解析 {elapsed:6.2f} ms")
+
+
+def bench_result_cache(generate_module):
+    """对比handler未命中、命中结果缓存和带If-None-Match返回304的耗时"""
+    import json
+    print("\n⚡ 结果缓存（handler，每次请求）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    event = {"httpMethod": "POST", "body": json.dumps(data, ensure_ascii=False), "headers": {}}
+
+    def miss():
+        generate_module.result_cache.clear()
+        generate_module._lesson_cache.clear()
+        return generate_module.handler(event)
+
+    miss_ms = time_call(miss, 5)
+    etag = generate_module.handler(event)["headers"]["ETag"]
+    hit_ms = time_call(lambda: generate_module.handler(event), 50)
+    conditional = dict(event, headers={"If-None-Match": etag})
+    not_modified_ms = time_call(lambda: generate_module.handler(conditional), 50)
+    print(f"  未命中         {miss_ms:8.2f} ms")
+    print(f"  命中缓存       {hit_ms:8.3f} ms（含base64编码）")
+    print(f"  304 Not Modified {not_modified_ms:6.3f} ms")
+    print(f"  统计: {generate_module.result_cache.stats()}")
+    generate_module.result_cache.clear()
+
+
+def bench_artifact_memo(generate_module):
+    """只修改一个版本的文章后重新生成：分文件缓存只重新渲染变化的文件"""
+    import copy
+    print("\n🧩 分文件缓存（修改挑战版文章后重新生成）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    edited = copy.deepcopy(data)
+    edited["leveled_texts"]["advanced"]["content"] += "\n老师补充的一段内容。"
+
+    def regenerate(memo_size):
+        generate_module.ARTIFACT_MEMO_SIZE = memo_size
+        generate_module.artifact_memo.clear()
+        generate_module._lesson_cache.clear()
+        generate_module.generate_reading_materials(data)
+        generate_module._lesson_cache.clear()
+        start = time.perf_counter()
+        generate_module.generate_reading_materials(edited)
+        return (time.perf_counter() - start) * 1000
+
+    memo_size = generate_module.artifact_memo.max_size
+    generate_module.artifact_memo_counts.clear()
+    without_memo = min(regenerate(0) for _ in range(3))
+    with_memo = min(regenerate(memo_size) for _ in range(3))
+    print(f"  不缓存 {without_memo:8.2f} ms")
+    print(f"  分文件缓存 {with_memo:8.2f} ms")
+    for kind, counts in generate_module.artifact_memo_stats()["by_type"].items():
+        print(f"    {kind:<18} 命中 {counts['hits']:>3} | 未命中 {counts['misses']:>3}")
+    generate_module.ARTIFACT_MEMO_SIZE = 0
+    generate_module.artifact_memo.clear()
+
+
+def bench_disk_store(generate_module):
+    """本地服务器：未命中、命中内存缓存和命中磁盘缓存的耗时"""
+    import tempfile
+    import local_server
+    from disk_store import DiskStore
+    print("\n💾 磁盘缓存（本地服务器 /api/generate，每次请求）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    client = local_server.app.test_client()
+    original_store = local_server.disk_store
+
+    with tempfile.TemporaryDirectory() as root:
+        local_server.disk_store = DiskStore(root, 64 * 1024 * 1024)
+
+        def miss():
+            generate_module.result_cache.clear()
+            generate_module._lesson_cache.clear()
+            local_server.disk_store = DiskStore(tempfile.mkdtemp(dir=root), 64 * 1024 * 1024)
+            client.post("/api/generate", json=data)
+
+        def disk_hit():
+            generate_module.result_cache.clear()
+            client.post("/api/generate", json=data)
+
+        miss_ms = time_call(miss, 3)
+        memory_ms = time_call(lambda: client.post("/api/generate", json=data), 20)
+        disk_ms = time_call(disk_hit, 20)
+        size = local_server.disk_store.stats()["size"]
+    local_server.disk_store = original_store
+    generate_module.result_cache.clear()
+    print(f"  未命中（生成并写入磁盘） {miss_ms:8.2f} ms")
+    print(f"  命中内存缓存             {memory_ms:8.2f} ms")
+    print(f"  命中磁盘缓存（send_file）{disk_ms:8.2f} ms（压缩包 {size} 字节）")
+
+
+def bench_shared_cache(generate_module):
+    """本地服务器：命中本进程内存缓存与命中共享内存缓存（其他worker的结果）的耗时，以及直接读写的耗时"""
+    import os
+    import local_server
+    from local_server import persistent_key
+    from shared_cache import SharedCache, fcntl
+    print("\n🔗 共享内存缓存（本地服务器 /api/generate，每次请求）")
+    if fcntl is None:
+        print("  当前系统不支持，跳过")
+        return
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    client = local_server.app.test_client()
+    original_cache, original_store = local_server.shared_cache, local_server.disk_store
+    cache = SharedCache(f'reading-materials-bench-{os.getpid()}', 64 * 1024 * 1024)
+    local_server.shared_cache, local_server.disk_store = cache, None
+    try:
+        served = client.post("/api/generate", json=data).data
+        memory_ms = time_call(lambda: client.post("/api/generate", json=data), 20)
+
+        def shared_hit():
+            generate_module.result_cache.clear()
+            client.post("/api/generate", json=data)
+
+        shared_ms = time_call(shared_hit, 20)
+        zip_data = generate_module.build_reading_materials(data).getvalue()
+        # 用本地服务器写入时的键读取，计时的是命中
+        key = persistent_key(generate_module.lesson_cache_key(data))
+        assert cache.get(key) == served, "共享内存缓存中没有本地服务器写入的压缩包"
+        get_ms = time_call(lambda: cache.get(key), 200)
+        put_ms = time_call(lambda: cache.put(os.urandom(8).hex(), zip_data), 50)
+    finally:
+        local_server.shared_cache, local_server.disk_store = original_cache, original_store
+        generate_module.result_cache.clear()
+        cache.close()
+        cache.unlink()
+    print(f"  命中本进程内存缓存       {memory_ms:8.2f} ms")
+    print(f"  命中共享内存缓存         {shared_ms:8.2f} ms")
+    print(f"  直接读取 / 写入          {get_ms:8.3f} / {put_ms:.3f} ms（压缩包 {len(zip_data)} 字节）")
+
+
+def bench_single_flight(generate_module):
+    """handler同时收到多个同样的请求：合并后只生成一次，与逐个生成比较"""
+    import json
+    import threading
+    print("\n🤝 合并同样的请求（handler，8个请求同时到达）")
+    data = build_sample_data(paragraph_count=200, vocab_count=200)
+    event = {'httpMethod': 'POST', 'body': json.dumps(data), 'headers': {}}
+    barrier = threading.Barrier(8)
+    statuses = []
+
+    def request():
+        barrier.wait()
+        statuses.append(generate_module.handler(event)['headers']['X-Cache'])
+
+    def concurrent():
+        generate_module.result_cache.clear()
+        generate_module._lesson_cache.clear()
+        statuses.clear()
+        threads = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def sequential():
+        generate_module._lesson_cache.clear()
+        for _ in range(8):
+            generate_module.generate_reading_materials(data)
+
+    coalesced_ms = time_call(concurrent, 3)
+    sequential_ms = time_call(sequential, 3)
+    generate_module.result_cache.clear()
+    print(f"  合并（实际生成 {statuses.count('MISS')} 次）  {coalesced_ms:8.2f} ms  {sorted(set(statuses))}")
+    print(f"  逐个生成8次              {sequential_ms:8.2f} ms")
+
+
+def main():
+    """运行所有基准测试"""
+    setup_environment()
+    import importlib
+    generate_module = importlib.import_module('api.generate')
+
+    print("=" * 60)
+    print("分层阅读材料生成系统 - 性能基准")
+    print("=" * 60)
+
+    # 各项基准测量的是实际渲染耗时，关闭分文件缓存（bench_artifact_memo 中单独测量）
+    generate_module.ARTIFACT_MEMO_SIZE = 0
+
+    bench_document_prototype(generate_module)
+    bench_vocabulary_table(generate_module)
+    bench_render_backend(generate_module)
+    bench_template_size(generate_module)
+    bench_answer_key(generate_module)
+    bench_teacher_guide(generate_module)
+    bench_raw_copy(generate_module)
+    bench_compression_policy(generate_module)
+    bench_parallel_compression(generate_module)
+    bench_streaming(generate_module)
+    bench_response_allocations(generate_module)
+    bench_low_memory(generate_module)
+    bench_lazy_artifacts(generate_module)
+    bench_request_bodies(generate_module)
+    bench_result_cache(generate_module)
+    bench_single_flight(generate_module)
+    bench_artifact_memo(generate_module)
+    bench_disk_store(generate_module)
+    bench_shared_cache(generate_module)
+
+    print("\n" + "=" * 60)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+精简Word模板生成脚本
+从python-docx自带的默认模板中只保留生成器用到的部件和样式，
+输出到 api/templates/base.docx。修改生成器使用的样式后重新运行：
+    python build_docx_template.py
+"""
+
+import os
+import zipfile
+
+import docx
+from lxml import etree
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+CT = 'http://schemas.openxmlformats.org/package/2006/content-types'
+
+# 生成器直接引用的样式名称
+USED_STYLES = ['Normal', 'Title', 'Heading 1', 'Heading 2', 'List Bullet', 'Light Grid Accent 1']
+
+# 保留的部件；其余（stylesWithEffects、缩略图、customXml、docProps等）全部去掉
+KEPT_PARTS = [
+    '[Content_Types].xml',
+    '_rels/.rels',
+    'word/document.xml',
+    'word/_rels/document.xml.rels',
+    'word/styles.xml',
+    'word/numbering.xml',
+    'word/settings.xml',
+    'word/theme/theme1.xml',
+]
+
+# settings.xml 中与生成结果无关的设置
+DROPPED_SETTINGS = ['proofState', 'savePreviewPicture', 'rsids', 'mathPr', 'doNotAutoCompressPictures',
+                    'shapeDefaults', 'docId', 'defaultImageDpi']
+
+OUTPUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api', 'templates', 'base.docx')
+
+
+def w(tag):
+    """返回带WordprocessingML命名空间的标签名"""
+    return f'{{{W}}}{tag}'
+
+
+def strip_rsids(root):
+    """去掉所有修订标识属性（w:rsidR 等），对显示没有影响"""
+    for element in root.iter():
+        for attr in [name for name in element.attrib if name.startswith(w('rsid'))]:
+            del element.attrib[attr]
+        if element.tag == w('rsid'):
+            element.getparent().remove(element)
+    return root
+
+
+def slim_styles(root):
+    """只保留用到的样式，以及它们通过basedOn/link/next引用的样式和各类型的默认样式"""
+    styles = {s.get(w('styleId')): s for s in root.findall(w('style'))}
+    by_name = {s.find(w('name')).get(w('val')).lower(): style_id for style_id, s in styles.items()}
+
+    pending = [by_name[name.lower()] for name in USED_STYLES]
+    pending += [style_id for style_id, s in styles.items() if s.get(w('default')) == '1']
+    kept = set()
+    while pending:
+        style_id = pending.pop()
+        if style_id in kept or style_id not in styles:
+            continue
+        kept.add(style_id)
+        for ref in ('basedOn', 'link', 'next'):
+            ref_element = styles[style_id].find(w(ref))
+            if ref_element is not None:
+                pending.append(ref_element.get(w('val')))
+
+    for style_id, style in styles.items():
+        if style_id not in kept:
+            root.remove(style)
+
+    latent = root.find(w('latentStyles'))
+    if latent is not None:
+        root.remove(latent)
+    return strip_rsids(root), kept
+
+
+def slim_numbering(root, styles_root):
+    """只保留保留样式中引用到的编号定义"""
+    used_num_ids = {num_id.get(w('val')) for num_id in styles_root.iter(w('numId'))}
+    used_abstract_ids = set()
+    for num in root.findall(w('num')):
+        if num.get(w('numId')) in used_num_ids:
+            used_abstract_ids.add(num.find(w('abstractNumId')).get(w('val')))
+        else:
+            root.remove(num)
+    for abstract in root.findall(w('abstractNum')):
+        if abstract.get(w('abstractNumId')) not in used_abstract_ids:
+            root.remove(abstract)
+    return root
+
+
+def slim_settings(root):
+    """去掉与生成结果无关的设置项"""
+    for element in list(root):
+        if etree.QName(element).localname in DROPPED_SETTINGS:
+            root.remove(element)
+    return root
+
+
+def slim_relationships(root, base_dir):
+    """去掉指向已删除部件的关系"""
+    for rel in list(root):
+        target = os.path.normpath(os.path.join(base_dir, rel.get('Target'))).replace(os.sep, '/')
+        if target not in KEPT_PARTS:
+            root.remove(rel)
+    return root
+
+
+def slim_content_types(root):
+    """去掉已删除部件的内容类型声明"""
+    for override in root.findall(f'{{{CT}}}Override'):
+        if override.get('PartName').lstrip('/') not in KEPT_PARTS:
+            root.remove(override)
+    for default in root.findall(f'{{{CT}}}Default'):
+        if default.get('Extension') not in ('xml', 'rels'):
+            root.remove(default)
+    return root
+
+
+def build_template(source_path, output_path):
+    """生成精简模板，返回 (原大小, 新大小)"""
+    parser = etree.XMLParser(remove_blank_text=True)
+    with zipfile.ZipFile(source_path) as source:
+        parts = {name: etree.fromstring(source.read(name), parser) for name in KEPT_PARTS}
+
+    parts['word/styles.xml'], kept_styles = slim_styles(parts['word/styles.xml'])
+    parts['word/numbering.xml'] = slim_numbering(parts['word/numbering.xml'], parts['word/styles.xml'])
+    parts['word/settings.xml'] = slim_settings(parts['word/settings.xml'])
+    parts['word/document.xml'] = strip_rsids(parts['word/document.xml'])
+    parts['_rels/.rels'] = slim_relationships(parts['_rels/.rels'], '')
+    parts['word/_rels/document.xml.rels'] = slim_relationships(parts['word/_rels/document.xml.rels'], 'word')
+    parts['[Content_Types].xml'] = slim_content_types(parts['[Content_Types].xml'])
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as output:
+        for name in KEPT_PARTS:
+            xml = etree.tostring(parts[name], xml_declaration=True, encoding='UTF-8', standalone=True)
+            # 固定时间戳，模板内容不变时生成的文件字节完全相同
+            info = zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0))
+            info.compress_type = zipfile.ZIP_DEFLATED
+            output.writestr(info, xml)
+
+    print(f"📋 保留样式: {', '.join(sorted(kept_styles))}")
+    return os.path.getsize(source_path), os.path.getsize(output_path)
+
+
+if __name__ == "__main__":
+    default_path = os.path.join(os.path.dirname(docx.__file__), 'templates', 'default.docx')
+    original_size, slim_size = build_template(default_path, OUTPUT_PATH)
+    print(f"✅ 精简模板已生成: {OUTPUT_PATH}")
+    print(f"📦 模板大小: {original_size} 字节 -> {slim_size} 字节")
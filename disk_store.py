@@ -0,0 +1,192 @@
+"""
+磁盘缓存：把生成的压缩包和文件按内容哈希保存在本地目录中
+同一台机器上的多个进程可以共用同一目录；local_server.py 命中时通过 send_file 直接从磁盘发送，不读入内存
+
+目录结构：
+    objects/ab/abcd…   内容文件，文件名为内容的SHA-256
+    refs/12/1234…      键（如请求哈希）到内容哈希的引用
+    tmp/               写入中的临时文件，写完后原子地重命名到目标位置
+
+文件系统本身就是元数据：内容文件和引用都是写完并fsync后一次性重命名出现的，
+进程崩溃只会在 tmp 中留下残留文件（启动时清理），不会出现写了一半的缓存；
+最近使用时间记录为内容文件的修改时间，总大小超过上限时删除最久未使用的内容文件。
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+COPY_CHUNK_SIZE = 1024 * 1024
+# 超过该秒数的临时文件视为崩溃残留（较新的可能是其他进程正在写入的）
+STALE_TEMP_AGE = 3600
+
+
+class DiskStore:
+    """按内容寻址的磁盘缓存，总大小超过max_size字节时按最近使用时间淘汰"""
+
+    def __init__(self, root, max_size):
+        self.root = root
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        for name in ('objects', 'refs', 'tmp'):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+        self.clean_temporary_files()
+        self.size = sum(size for _, size, _ in self.scan_objects())
+
+    def object_path(self, digest):
+        return os.path.join(self.root, 'objects', digest[:2], digest)
+
+    def ref_path(self, key):
+        return os.path.join(self.root, 'refs', key[:2], key)
+
+    def clean_temporary_files(self):
+        """删除崩溃残留的临时文件"""
+        temp_dir = os.path.join(self.root, 'tmp')
+        now = time.time()
+        for entry in os.scandir(temp_dir):
+            try:
+                if now - entry.stat().st_mtime > STALE_TEMP_AGE:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def scan_objects(self):
+        """列出所有内容文件的 (修改时间, 大小, 路径)"""
+        objects = []
+        for bucket in os.scandir(os.path.join(self.root, 'objects')):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                objects.append((stat.st_mtime, stat.st_size, entry.path))
+        return objects
+
+    def write_temporary(self, source):
+        """把内容写入临时文件并fsync，返回 (临时文件路径, 内容哈希, 大小)；source为字节数据或可读的文件对象"""
+        fd, temp_path = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                chunks = iter(lambda: source.read(COPY_CHUNK_SIZE), b'') if hasattr(source, 'read') else [source]
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return temp_path, digest.hexdigest(), size
+
+    def write_ref(self, key, digest):
+        """原子地写入键的引用"""
+        temp_path, _, _ = self.write_temporary(digest.encode('ascii'))
+        path = self.ref_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+
+    def read_ref(self, key):
+        """读取键引用的内容哈希，不存在时返回None"""
+        try:
+            with open(self.ref_path(key), encoding='ascii') as f:
+                digest = f.read()
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        return digest if len(digest) == 64 else None
+
+    def get(self, key):
+        """返回键对应内容文件的路径并更新其最近使用时间，不存在（或已淘汰）时返回None"""
+        digest = self.read_ref(key)
+        path = None
+        if digest is not None:
+            path = self.object_path(digest)
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                path = None
+        with self.lock:
+            if path is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return path
+
+    def put(self, key, source):
+        """保存内容（字节数据或可读的文件对象）并记录键的引用，返回内容文件的路径；超过总大小上限时不保存，返回None"""
+        temp_path, digest, size = self.write_temporary(source)
+        if size > self.max_size:
+            os.remove(temp_path)
+            return None
+
+        path = self.object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            # 内容相同的文件已经存在时只更新最近使用时间
+            os.utime(path)
+        except FileNotFoundError:
+            # 不存在（或刚被其他进程淘汰）
+            os.replace(temp_path, path)
+            added = size
+        else:
+            os.remove(temp_path)
+            added = 0
+        self.write_ref(key, digest)
+
+        with self.lock:
+            self.size += added
+            over_budget = self.size > self.max_size
+        if over_budget:
+            self.evict()
+        return path
+
+    def evict(self):
+        """删除最久未使用的内容文件直到总大小不超过上限，并删除指向已删除内容的引用
+
+        按目录实际内容重新统计大小，其他进程写入的文件也计算在内。
+        """
+        with self.lock:
+            objects = sorted(self.scan_objects())
+            total = sum(size for _, size, _ in objects)
+            for _, size, path in objects:
+                if total <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                self.evictions += 1
+            self.size = total
+
+        for bucket in os.scandir(os.path.join(self.root, 'refs')):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                digest = self.read_ref(entry.name)
+                if digest is None or not os.path.exists(self.object_path(digest)):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def stats(self):
+        """缓存目录、大小和命中情况"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'root': self.root,
+                'size': self.size,
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
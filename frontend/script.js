@@ -176,7 +176,16 @@ const APIManager = {
                 throw new Error(`API请求失败 (${response.status}): ${errorText}`);
             }
 
-            return await response.blob();
+            // 压缩包超过平台大小限制时，后端返回分卷清单，逐个请求各分卷
+            const contentType = response.headers.get('Content-Type') || '';
+            if (contentType.includes('application/json')) {
+                const manifest = await response.json();
+                if (manifest.split) {
+                    return await this.fetchParts(data, manifest);
+                }
+            }
+
+            return [await response.blob()];
 
         } catch (error) {
             console.error('API调用错误:', error);
@@ -190,6 +199,29 @@ const APIManager = {
         }
     },
 
+    // 按分卷清单逐个下载分卷，返回各分卷的Blob
+    fetchParts: async function(data, manifest) {
+        const blobs = [];
+        for (const part of manifest.parts) {
+            const options = Object.assign({}, data.options, { part: part.part, files: part.files });
+            const response = await fetch(this.getApiUrl(), {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/zip'
+                },
+                body: JSON.stringify(Object.assign({}, data, { options: options }))
+            });
+
+            if (!response.ok) {
+                const errorText = await response.text();
+                throw new Error(`分卷${part.part}下载失败 (${response.status}): ${errorText}`);
+            }
+            blobs.push(await response.blob());
+        }
+        return blobs;
+    },
+
     // 模拟Coze API调用（实际使用时需要替换）
     callCozeAPI: async function(data) {
         // 模拟延迟
@@ -384,18 +416,20 @@ async function handleGenerate() {
 
         // 2. 调用后端生成文件
         console.log('调用后端API生成文件...');
-        const zipBlob = await APIManager.callBackendAPI(cozeData);
+        const zipBlobs = await APIManager.callBackendAPI(cozeData);
 
         // 3. 记录使用次数
         UsageManager.recordUsage();
 
-        // 4. 提供下载
-        const url = window.URL.createObjectURL(zipBlob);
+        // 4. 提供下载（文件较大时分为多个分卷，依次下载）
+        const timestamp = Date.now();
         const downloadLink = document.getElementById('downloadLink');
 
         if (downloadLink) {
-            downloadLink.href = url;
-            downloadLink.download = `分层阅读材料_${Date.now()}.zip`;
+            downloadLink.href = window.URL.createObjectURL(zipBlobs[0]);
+            downloadLink.download = zipBlobs.length > 1
+                ? `分层阅读材料_${timestamp}_part1.zip`
+                : `分层阅读材料_${timestamp}.zip`;
             downloadLink.style.display = 'inline-block';
 
             // 显示结果
@@ -405,6 +439,14 @@ async function handleGenerate() {
             // 自动下载
             setTimeout(() => {
                 downloadLink.click();
+                zipBlobs.slice(1).forEach((blob, index) => {
+                    const partLink = document.createElement('a');
+                    partLink.href = window.URL.createObjectURL(blob);
+                    partLink.download = `分层阅读材料_${timestamp}_part${index + 2}.zip`;
+                    document.body.appendChild(partLink);
+                    partLink.click();
+                    document.body.removeChild(partLink);
+                });
             }, 500);
         }
 
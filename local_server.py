@@ -3,16 +3,27 @@
 用于测试和演示
 """
 
-from flask import Flask, request, send_file
+from flask import Flask, Response, request, send_file, stream_with_context
 from flask_cors import CORS
+from collections import OrderedDict
+from urllib.parse import quote
+import hashlib
+import mimetypes
 import os
+import shutil
+import tempfile
+import threading
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Archive-Id', 'X-Archive-Url', 'Content-Range', 'Accept-Ranges', 'ETag', 'X-Cache'])
 
 # 导入文件生成模块 - 修复变量定义问题
 try:
-    from api.generate import generate_reading_materials
+    from api.generate import (build_reading_materials, stream_reading_materials,
+                              part_size_limit, part_manifest, part_download_name, read_member,
+                              artifact_manifest, find_artifact, parse_request_body, RequestBodyError,
+                              lesson_cache_key, result_cache, result_etag, etag_value, artifact_memo_stats,
+                              use_low_memory, generation_flight, generator_version)
     GENERATE_FUNCTION_AVAILABLE = True
     print("✅ 成功导入文件生成模块")
 except ImportError as import_error:
@@ -20,7 +31,65 @@ except ImportError as import_error:
     print("请在项目根目录运行此脚本")
     # 在except块中定义变量，避免未定义错误
     GENERATE_FUNCTION_AVAILABLE = False
-    generate_reading_materials = None
+    build_reading_materials = None
+    stream_reading_materials = None
+    part_size_limit = part_manifest = part_download_name = read_member = None
+    artifact_manifest = find_artifact = parse_request_body = None
+    lesson_cache_key = result_cache = result_etag = etag_value = artifact_memo_stats = None
+    use_low_memory = generation_flight = generator_version = None
+    RequestBodyError = ValueError
+
+from disk_store import DiskStore
+from shared_cache import SharedCache
+
+# 流式响应：边生成边发送ZIP数据，首字节时间只取决于第一个文件，内存中只保留当前文件
+# 设置环境变量 STREAM_RESPONSES=1 默认开启，也可用查询参数 ?stream=1 / ?stream=0 按请求选择
+STREAM_RESPONSES = os.environ.get('STREAM_RESPONSES', '0') == '1'
+DOWNLOAD_NAME = '分层阅读材料.zip'
+# 内存中的压缩包按该字节数分块复制为bytes发送
+RESPONSE_CHUNK_SIZE = 256 * 1024
+
+# 模拟Serverless平台的响应体大小限制（Vercel约4.5MB，按handler的base64编码后大小计算），
+# 超过时与平台一样返回错误，用于在本地验证分卷；设为 0 关闭。流式响应长度未知，不做检查
+PLATFORM_RESPONSE_LIMIT = int(os.environ.get('PLATFORM_RESPONSE_LIMIT', str(4718592)))
+
+# 最近生成的压缩包按内容哈希保存在内存中，可通过 /api/archives/<id> 断点续传或单独下载其中的文件
+# ARCHIVE_STORE_SIZE 为保存的总字节数上限（默认64MB），超出时淘汰最久未使用的；设为 0 不保存
+ARCHIVE_STORE_SIZE = int(os.environ.get('ARCHIVE_STORE_SIZE', str(64 * 1024 * 1024)))
+_archives = OrderedDict()
+# 请求哈希到压缩包编号：同一请求命中缓存、再次返回同一份数据时沿用编号，不重新计算内容哈希
+_archive_ids = {}
+_archives_size = 0
+_archives_lock = threading.Lock()
+
+# 按需模式（?lazy=1 或 options.lazy）下保存的请求数据，文件在 /api/lessons/<id>/artifacts/<文件名> 被请求时才渲染
+# LAZY_LESSON_LIMIT 为保存的请求个数，超出时淘汰最久未使用的
+LAZY_LESSON_LIMIT = int(os.environ.get('LAZY_LESSON_LIMIT', '256'))
+_lazy_lessons = OrderedDict()
+
+# 磁盘缓存：生成的压缩包和按需渲染的文件按内容哈希保存在 DISK_STORE_DIR 中，多个进程共用，重启后仍然有效；
+# 命中时用 send_file 直接从磁盘发送（部署在gunicorn等支持 wsgi.file_wrapper 的服务器上时为sendfile零拷贝，
+# 设置 USE_X_SENDFILE=1 时交给前端的nginx等发送）。DISK_STORE_SIZE 为总字节数上限（默认512MB），设为 0 关闭
+DISK_STORE_DIR = os.environ.get('DISK_STORE_DIR') or os.path.join(tempfile.gettempdir(), 'reading-materials-store')
+DISK_STORE_SIZE = int(os.environ.get('DISK_STORE_SIZE', str(512 * 1024 * 1024)))
+disk_store = DiskStore(DISK_STORE_DIR, DISK_STORE_SIZE) if DISK_STORE_SIZE > 0 else None
+app.config['USE_X_SENDFILE'] = os.environ.get('USE_X_SENDFILE', '0') == '1'
+
+# 跨进程共享内存缓存：用gunicorn等启动多个worker时，一个worker生成的压缩包在其他worker中直接命中（X-Cache: SHARED）
+# SHARED_CACHE_SIZE 为总字节数（默认 0 关闭），按 SHARED_CACHE_SLAB_SIZE（默认64KB）大小的slab分配；
+# 同一台机器上 SHARED_CACHE_NAME 相同的进程共用一份。只支持 Linux / macOS
+SHARED_CACHE_NAME = os.environ.get('SHARED_CACHE_NAME', 'reading-materials-cache')
+SHARED_CACHE_SIZE = int(os.environ.get('SHARED_CACHE_SIZE', '0'))
+SHARED_CACHE_SLAB_SIZE = int(os.environ.get('SHARED_CACHE_SLAB_SIZE', str(64 * 1024)))
+shared_cache = None
+if SHARED_CACHE_SIZE > 0:
+    try:
+        shared_cache = SharedCache(SHARED_CACHE_NAME, SHARED_CACHE_SIZE, SHARED_CACHE_SLAB_SIZE)
+    except RuntimeError as shared_cache_error:
+        print(f"⚠️ 共享内存缓存不可用: {shared_cache_error}")
+
+# 调试用：设置 DEBUG_DUMP_DIR 后，每次生成的ZIP另存一份到该目录（文件名各不相同，并发请求互不覆盖）
+DEBUG_DUMP_DIR = os.environ.get('DEBUG_DUMP_DIR')
 
 @app.route('/')
 def home():
@@ -145,34 +214,119 @@ def generate():
 
     try:
         # 检查生成功能是否可用
-        if not GENERATE_FUNCTION_AVAILABLE or generate_reading_materials is None:
+        if not GENERATE_FUNCTION_AVAILABLE or build_reading_materials is None:
             return {'error': '文件生成模块未正确加载'}, 500
 
-        # 获取请求数据
-        data = request.get_json()
-        print(f"📥 收到生成请求，主题: {data.get('core_theme', '未知')}")
+        # 获取请求数据：支持 Content-Encoding 为 gzip / deflate 的压缩请求体
+        try:
+            data = parse_request_body(request.get_data(), request.headers.get('Content-Encoding'))
+        except RequestBodyError as e:
+            return {'error': str(e)}, e.status
 
         if not data:
             return {'error': '没有提供数据'}, 400
+        print(f"📥 收到生成请求，主题: {data.get('core_theme', '未知')}")
 
-        # 生成文件
-        print("🔄 正在生成文件...")
-        zip_data = generate_reading_materials(data)
-        print(f"✅ 文件生成完成，大小: {len(zip_data)} 字节")
+        if request.args.get('lazy') == '1' or data.get('options', {}).get('lazy'):
+            return lazy_manifest(data)
 
-        # 保存到临时文件（用于调试）
-        temp_file = "temp_generated.zip"
-        with open(temp_file, "wb") as f:
-            f.write(zip_data)
-        print(f"💾 临时文件保存至: {temp_file}")
-
-        # 返回文件
-        return send_file(
-            temp_file,
-            as_attachment=True,
-            download_name='分层阅读材料.zip',
-            mimetype='application/zip'
+        # 同样的请求：客户端已有结果时返回304，否则优先使用缓存的压缩包
+        cache_key = lesson_cache_key(data)
+        cache_headers = {'ETag': result_etag(data, cache_key)}
+        if request.if_none_match.contains_weak(etag_value(cache_key)):
+            print("⚡ 客户端已有同样的结果，返回304")
+            return Response(status=304, headers=cache_headers)
+
+        zip_buffer = None
+        zip_view = result_cache.get(cache_key)
+        cache_headers['X-Cache'] = 'MISS' if zip_view is None else 'HIT'
+
+        # 本进程没有时查其他worker生成的结果
+        if zip_view is None and shared_cache:
+            zip_view = shared_cache.get(persistent_key(cache_key))
+            if zip_view is not None:
+                cache_headers['X-Cache'] = 'SHARED'
+
+        # 内存中没有时查磁盘缓存，命中时直接从磁盘发送，不读入内存
+        disk_path = disk_store.get(persistent_key(cache_key)) if disk_store and zip_view is None else None
+        if disk_path:
+            try:
+                return disk_response(disk_path, data, dict(cache_headers, **{'X-Cache': 'DISK'}))
+            except FileNotFoundError:
+                print("⚠️ 磁盘缓存文件刚被淘汰，重新生成")
+
+        if zip_view is not None:
+            zip_size = len(zip_view)
+            tier = '共享内存缓存' if cache_headers['X-Cache'] == 'SHARED' else '结果缓存'
+            print(f"⚡ 命中{tier}，大小: {zip_size} 字节")
+        elif request.args.get('stream', '1' if STREAM_RESPONSES else '0') == '1':
+            return stream_response(data)
+        elif not use_low_memory(data):
+            # 同时到达的同样请求只生成一次，共用同一份数据
+            zip_view, coalesced = generation_flight.do(cache_key, lambda: build_archive_view(data, cache_key))
+            zip_size = len(zip_view)
+            if coalesced:
+                cache_headers['X-Cache'] = 'COALESCED'
+                print(f"🤝 与同时进行的同样请求合并，大小: {zip_size} 字节")
+        else:
+            # 低内存模式：ZIP在临时文件中，只能发送一次，不合并同样的请求
+            print("🔄 正在生成文件（低内存模式）...")
+            zip_buffer = build_reading_materials(data)
+            zip_buffer.seek(0, os.SEEK_END)
+            zip_size = zip_buffer.tell()
+            zip_buffer.seek(0)
+            if disk_store:
+                # 从临时文件按块复制到磁盘缓存，之后从磁盘发送
+                disk_path = disk_store.put(persistent_key(cache_key), zip_buffer)
+                if disk_path:
+                    zip_buffer.close()
+                    print("✅ 文件生成完成（低内存模式，保存到磁盘缓存）")
+                    return disk_response(disk_path, data, cache_headers)
+                zip_buffer.seek(0)
+
+        # 超过分卷大小时返回分卷清单
+        max_part_size = part_size_limit(data)
+        if 'files' not in data.get('options', {}) and 0 < max_part_size < zip_size:
+            manifest = part_manifest(zip_buffer if zip_view is None else zip_view, max_part_size)
+            print(f"📚 文件大小 {zip_size} 字节，超过分卷上限，返回 {len(manifest['parts'])} 个分卷的清单")
+            return manifest, 200, cache_headers
+
+        download_name = part_download_name(data, DOWNLOAD_NAME)
+        if zip_view is None:
+            # 低内存模式：ZIP在SpooledTemporaryFile中，按块读取发送
+            print("✅ 文件生成完成（低内存模式）")
+            if DEBUG_DUMP_DIR:
+                dump_debug_file(zip_buffer)
+            response = send_file(
+                zip_buffer,
+                as_attachment=True,
+                download_name=download_name,
+                mimetype='application/zip'
+            )
+            response.content_length = zip_size
+            response.headers.update(cache_headers)
+            return response
+
+        print(f"✅ 文件生成完成，大小: {len(zip_view)} 字节")
+
+        if DEBUG_DUMP_DIR:
+            dump_debug_file(zip_view)
+
+        # 返回文件，同时保存以便之后按 X-Archive-Url 续传或单独下载其中的文件
+        archive_id = store_archive(zip_view, cache_key)
+        response = Response(
+            view_chunks(zip_view),
+            mimetype='application/zip',
+            headers={
+                'Content-Disposition': attachment_header(download_name),
+                'Content-Length': str(len(zip_view)),
+                **cache_headers,
+            }
         )
+        if archive_id:
+            response.headers['X-Archive-Id'] = archive_id
+            response.headers['X-Archive-Url'] = f'/api/archives/{archive_id}'
+        return response
 
     except Exception as exception:
         print(f"❌ 生成失败: {exception}")
@@ -180,6 +334,248 @@ def generate():
         traceback.print_exc()
         return {'error': str(exception)}, 500
 
+def build_archive_view(data, cache_key):
+    """生成压缩包并放入各级缓存，返回BytesIO内部数据的memoryview（不复制、不经过磁盘）"""
+    print("🔄 正在生成文件...")
+    zip_view = build_reading_materials(data).getbuffer()
+    result_cache.put(cache_key, zip_view)
+    if shared_cache:
+        shared_cache.put(persistent_key(cache_key), zip_view)
+    if disk_store:
+        disk_store.put(persistent_key(cache_key), zip_view)
+    return zip_view
+
+
+def persistent_key(key):
+    """磁盘缓存和共享内存缓存的键：加上生成器版本（代码、模板、样式表），部署新版本后不再命中旧版本生成的结果"""
+    return hashlib.sha256(f'{generator_version()}:{key}'.encode('ascii')).hexdigest()
+
+
+def disk_response(path, data, cache_headers):
+    """从磁盘缓存发送压缩包（支持Range），超过分卷大小时只读取中央目录返回分卷清单"""
+    zip_size = os.path.getsize(path)
+    max_part_size = part_size_limit(data)
+    if 'files' not in data.get('options', {}) and 0 < max_part_size < zip_size:
+        with open(path, 'rb') as zip_file:
+            manifest = part_manifest(zip_file, max_part_size)
+        print(f"📚 文件大小 {zip_size} 字节，超过分卷上限，返回 {len(manifest['parts'])} 个分卷的清单")
+        return manifest, 200, cache_headers
+
+    print(f"💾 从磁盘缓存发送，大小: {zip_size} 字节")
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=part_download_name(data, DOWNLOAD_NAME),
+        mimetype='application/zip',
+        etag=False
+    )
+    response.headers.update(cache_headers)
+    return response
+
+def stream_response(data):
+    """以生成器作为响应体，逐个文件发送ZIP数据"""
+    print("🔄 正在流式生成文件...")
+    chunks = stream_reading_materials(data)
+    # 先生成第一段数据，参数错误等异常仍能返回500
+    first_chunk = next(chunks)
+
+    def body():
+        total = len(first_chunk)
+        yield first_chunk
+        for chunk in chunks:
+            total += len(chunk)
+            yield chunk
+        print(f"✅ 流式发送完成，大小: {total} 字节")
+
+    return Response(
+        stream_with_context(body()),
+        mimetype='application/zip',
+        headers={'Content-Disposition': attachment_header()}
+    )
+
+def view_chunks(data, chunk_size=RESPONSE_CHUNK_SIZE):
+    """把内存中的数据按块转换为bytes作为响应体，每次只复制一块（WSGI服务器只接受bytes）"""
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield bytes(view[start:start + chunk_size])
+
+def attachment_header(download_name=DOWNLOAD_NAME):
+    """下载文件名的Content-Disposition（中文文件名按RFC 5987编码）"""
+    return f"attachment; filename*=UTF-8''{quote(download_name)}"
+
+def dump_debug_file(zip_data):
+    """把生成的ZIP另存到调试目录，每次使用不同的文件名；zip_data为字节数据或文件对象"""
+    os.makedirs(DEBUG_DUMP_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix='generated_', suffix='.zip', dir=DEBUG_DUMP_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        if hasattr(zip_data, 'read'):
+            shutil.copyfileobj(zip_data, f)
+            zip_data.seek(0)
+        else:
+            f.write(zip_data)
+    print(f"💾 调试文件保存至: {path}")
+
+def store_archive(zip_view, cache_key):
+    """按内容哈希保存压缩包，返回编号；超出总大小上限时淘汰最久未使用的"""
+    global _archives_size
+    if not ARCHIVE_STORE_SIZE or len(zip_view) > ARCHIVE_STORE_SIZE:
+        return None
+
+    with _archives_lock:
+        archive_id = _archive_ids.get(cache_key)
+        if archive_id in _archives and _archives[archive_id][0] is zip_view:
+            _archives.move_to_end(archive_id)
+            return archive_id
+
+    # 新生成的（或从共享内存缓存取出的）数据才计算内容哈希
+    archive_id = hashlib.sha256(zip_view).hexdigest()[:32]
+    with _archives_lock:
+        _archive_ids[cache_key] = archive_id
+        if archive_id in _archives:
+            # 内容相同，改为引用这一份，之后同一请求的命中不再计算哈希
+            _archives[archive_id] = (zip_view, cache_key)
+            _archives.move_to_end(archive_id)
+            return archive_id
+        _archives[archive_id] = (zip_view, cache_key)
+        _archives_size += len(zip_view)
+        while _archives_size > ARCHIVE_STORE_SIZE:
+            evicted_id, (evicted, evicted_key) = _archives.popitem(last=False)
+            _archives_size -= len(evicted)
+            if _archive_ids.get(evicted_key) == evicted_id:
+                del _archive_ids[evicted_key]
+    return archive_id
+
+def get_archive(archive_id):
+    """取出保存的压缩包，不存在（或已淘汰）时返回None"""
+    with _archives_lock:
+        if archive_id not in _archives:
+            return None
+        _archives.move_to_end(archive_id)
+        return _archives[archive_id][0]
+
+def ranged_response(data, mimetype, download_name, etag):
+    """返回data的全部或Range请求的一段（206），不支持的范围返回416
+
+    只支持单个范围；If-Range与ETag不一致时返回完整内容。
+    """
+    view = memoryview(data)
+    headers = {
+        'Content-Disposition': attachment_header(download_name),
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{etag}"',
+    }
+
+    byte_range = request.range
+    if byte_range is not None and request.if_range.etag not in (None, etag):
+        byte_range = None
+    if byte_range is not None:
+        bounds = byte_range.range_for_length(len(view))
+        if bounds is None:
+            headers['Content-Range'] = f'bytes */{len(view)}'
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{len(view)}'
+        headers['Content-Length'] = str(stop - start)
+        return Response(view_chunks(view[start:stop]), status=206, mimetype=mimetype, headers=headers)
+
+    headers['Content-Length'] = str(len(view))
+    return Response(view_chunks(view), mimetype=mimetype, headers=headers)
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    """结果缓存、分文件缓存、共享内存缓存和磁盘缓存的命中统计，以及合并同样请求的次数"""
+    if result_cache is None:
+        return {'error': '文件生成模块未正确加载'}, 500
+    return {
+        'result_cache': result_cache.stats(),
+        'artifact_memo': artifact_memo_stats(),
+        'shared_cache': shared_cache.stats() if shared_cache else None,
+        'disk_store': disk_store.stats() if disk_store else None,
+        'single_flight': generation_flight.stats(),
+        'generator_version': generator_version(),
+    }
+
+@app.route('/api/archives/<archive_id>')
+def download_archive(archive_id):
+    """下载保存的压缩包，支持Range断点续传"""
+    zip_view = get_archive(archive_id)
+    if zip_view is None:
+        return {'error': '压缩包不存在或已过期，请重新生成'}, 404
+    return ranged_response(zip_view, 'application/zip', DOWNLOAD_NAME, archive_id)
+
+@app.route('/api/archives/<archive_id>/files/<path:name>')
+def download_archive_member(archive_id, name):
+    """只下载压缩包中的一个文件：按中央目录定位，不解压其他文件"""
+    zip_view = get_archive(archive_id)
+    if zip_view is None:
+        return {'error': '压缩包不存在或已过期，请重新生成'}, 404
+    try:
+        member = read_member(zip_view, name)
+    except KeyError:
+        return {'error': f'压缩包中没有文件: {name}'}, 404
+
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    etag = hashlib.sha256(f'{archive_id}/{name}'.encode('utf-8')).hexdigest()[:32]
+    return ranged_response(member, mimetype, os.path.basename(name), etag)
+
+def lazy_manifest(data):
+    """保存请求数据并立即返回文件清单，不渲染任何文件"""
+    manifest = artifact_manifest(data)
+    lesson_id = manifest['lesson_id']
+    with _archives_lock:
+        _lazy_lessons[lesson_id] = data
+        _lazy_lessons.move_to_end(lesson_id)
+        while len(_lazy_lessons) > LAZY_LESSON_LIMIT:
+            _lazy_lessons.popitem(last=False)
+
+    for artifact in manifest['artifacts']:
+        artifact['url'] = f"/api/lessons/{lesson_id}/artifacts/{quote(artifact['name'])}"
+    print(f"📋 按需模式：返回 {len(manifest['artifacts'])} 个文件的清单")
+    return manifest
+
+@app.route('/api/lessons/<lesson_id>/artifacts/<path:name>')
+def download_artifact(lesson_id, name):
+    """按需渲染并下载清单中的一个文件，渲染结果由生成模块的分文件缓存缓存，并保存到磁盘缓存"""
+    mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    etag = hashlib.sha256(f'{generator_version()}/{lesson_id}/{name}'.encode('utf-8')).hexdigest()[:32]
+    disk_path = disk_store.get(persistent_key(etag)) if disk_store else None
+    if disk_path:
+        try:
+            return send_file(disk_path, mimetype=mimetype, as_attachment=True,
+                             download_name=os.path.basename(name), etag=etag)
+        except FileNotFoundError:
+            pass
+
+    with _archives_lock:
+        data = _lazy_lessons.get(lesson_id)
+        if data is not None:
+            _lazy_lessons.move_to_end(lesson_id)
+    if data is None:
+        return {'error': '请求不存在或已过期，请重新生成'}, 404
+    try:
+        render = find_artifact(data, name)
+    except KeyError:
+        return {'error': f'没有这个文件: {name}'}, 404
+    content = render()
+
+    if disk_store:
+        disk_store.put(persistent_key(etag), content)
+    return ranged_response(content, mimetype, os.path.basename(name), etag)
+
+@app.after_request
+def enforce_platform_limit(response):
+    """模拟平台的响应体大小限制：超过时替换为错误响应"""
+    if PLATFORM_RESPONSE_LIMIT and response.content_length:
+        wire_size = (response.content_length + 2) // 3 * 4
+        if wire_size > PLATFORM_RESPONSE_LIMIT:
+            print(f"❌ 响应体 {wire_size} 字节超过平台限制 {PLATFORM_RESPONSE_LIMIT} 字节")
+            return app.response_class(
+                f'{{"error": "FUNCTION_PAYLOAD_TOO_LARGE: {wire_size} > {PLATFORM_RESPONSE_LIMIT}"}}',
+                status=413,
+                mimetype='application/json'
+            )
+    return response
+
 @app.route('/health')
 def health():
     """健康检查端点"""
@@ -125,7 +125,26 @@ def test_file_generation():
             for file in file_list:
                 print(f"   - {file}")
 
-        return True
+        # 没有python-docx时教师指南仍是真正的Word文档（由OOXML写出器渲染）
+        import io
+        has_docx, document_class = generate_module.HAS_DOCX, generate_module.Document
+        generate_module.HAS_DOCX, generate_module.Document = False, None
+        try:
+            guide = generate_module.generate_teacher_guide(test_data)
+        finally:
+            generate_module.HAS_DOCX, generate_module.Document = has_docx, document_class
+        with zipfile.ZipFile(io.BytesIO(guide)) as package:
+            guide_is_docx = '测试主题' in package.read('word/document.xml').decode('utf-8')
+        print(f"{'✅' if guide_is_docx else '❌'} 没有python-docx时教师指南仍为Word文档")
+
+        # options.compression 作用于所有文本条目，包括预先压缩的使用说明
+        stored_data = dict(test_data, options={'compression': {'text': 'stored'}})
+        with zipfile.ZipFile(io.BytesIO(generate_reading_materials(stored_data))) as zip_ref:
+            text_methods = {info.filename: info.compress_type for info in zip_ref.infolist()
+                            if info.filename.endswith('.txt')}
+        text_stored = '使用说明.txt' in text_methods and set(text_methods.values()) == {zipfile.ZIP_STORED}
+        print(f"{'✅' if text_stored else '❌'} 文本条目按请求的压缩方式写入: {text_methods}")
+        return guide_is_docx and text_stored
 
     except Exception as e:
         print(f"❌ 文件生成失败: {e}")
@@ -134,6 +153,1033 @@ def test_file_generation():
         return False
 
 
+def docx_paragraph_texts(docx_data):
+    """用python-docx打开.docx数据，返回正文各段落的文本（不含表格中的段落）"""
+    import io
+    from docx import Document
+    return [paragraph.text for paragraph in Document(io.BytesIO(docx_data)).paragraphs]
+
+
+def test_answer_key():
+    """options.answer_key：学生版和教师答案版都在压缩包中，答案和解析只出现在教师版"""
+    print("\n🗝️  测试学生版和教师答案版...")
+
+    try:
+        import io
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data()
+        data["options"] = {"answer_key": True}
+        with zipfile.ZipFile(io.BytesIO(generate_module.generate_reading_materials(data))) as zip_ref:
+            names = zip_ref.namelist()
+            both = {"阅读理解问题_学生版.docx", "阅读理解问题_教师答案版.docx"} <= set(names)
+            print(f"{'✅' if both else '❌'} 压缩包中有学生版和教师答案版")
+            if not both:
+                return False
+            student = "\n".join(docx_paragraph_texts(zip_ref.read("阅读理解问题_学生版.docx")))
+            teacher = "\n".join(docx_paragraph_texts(zip_ref.read("阅读理解问题_教师答案版.docx")))
+
+        question = data["comprehension_questions"]["basic_questions"][0]
+        answer, explanation = f"答案：{question['answer']}", f"解析：{question['explanation']}"
+        shared = question["question"] in student and question["question"] in teacher
+        only_teacher = answer in teacher and explanation in teacher \
+            and answer not in student and explanation not in student and "答案：" not in student
+        print(f"{'✅' if shared else '❌'} 两份都有题目")
+        print(f"{'✅' if only_teacher else '❌'} 答案和解析只出现在教师答案版")
+        return shared and only_teacher
+
+    except Exception as e:
+        print(f"❌ 学生版和教师答案版测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def describe_docx(docx_data):
+    """用python-docx读取.docx数据：各段落的样式、文本和run格式（粗体、颜色），各表格的样式和单元格文本"""
+    import io
+    from docx import Document
+
+    def color(font):
+        return str(font.color.rgb) if font.color.type is not None else None
+
+    document = Document(io.BytesIO(docx_data))
+    paragraphs = [(paragraph.style.name, color(paragraph.style.font), paragraph.text,
+                   tuple((run.text, run.bold, color(run.font)) for run in paragraph.runs))
+                  for paragraph in document.paragraphs]
+    tables = [(table.style.name if table.style is not None else None,
+               [[cell.text for cell in row.cells] for row in table.rows])
+              for table in document.tables]
+    return paragraphs, tables
+
+
+def test_vocabulary_table():
+    """批量生成的词汇表表格与原来逐行 add_row 填写的表格逐个单元格一致"""
+    print("\n📋 测试词汇表表格...")
+
+    try:
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        vocab_list = build_sample_data(1, 1, 20)["support_materials"]["basic_materials"]["vocabulary_list"]
+        vocab_list.append({"word": " 前后空格 ", "pinyin": "a\tb", "definition": "第一行\n第二行",
+                           "example": "<符号> & \"引号\""})
+        rows = [tuple(header for _, header in generate_module.VOCABULARY_COLUMNS)]
+        rows.extend(tuple(vocab.get(key, '') for key, _ in generate_module.VOCABULARY_COLUMNS) for vocab in vocab_list)
+
+        # 原来的做法：逐行 add_row，再给每个单元格的 text 赋值
+        old_table = generate_module.new_document().add_table(rows=0, cols=len(rows[0]))
+        for row in rows:
+            for cell, value in zip(old_table.add_row().cells, row):
+                cell.text = value
+        new_table = generate_module.add_table_rows(
+            generate_module.new_document().add_table(rows=0, cols=len(rows[0])), rows)
+
+        old_cells = [[cell.text for cell in row.cells] for row in old_table.rows]
+        new_cells = [[cell.text for cell in row.cells] for row in new_table.rows]
+        same_cells = new_cells == old_cells and len(new_cells) == len(rows)
+        same_xml = new_table._tbl.xml == old_table._tbl.xml
+        print(f"{'✅' if same_cells else '❌'} {len(new_cells)} 行 × {len(rows[0])} 列单元格文本一致")
+        print(f"{'✅' if same_xml else '❌'} 表格XML与逐行填写的完全相同")
+        return same_cells and same_xml
+
+    except Exception as e:
+        print(f"❌ 词汇表表格测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_ooxml_writer():
+    """流式OOXML写出后端生成的文档与python-docx后端在python-docx中读出的段落、标题、格式和表格一致"""
+    print("\n🖋️  测试OOXML写出后端...")
+
+    try:
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data(version_count=2, paragraph_count=5, vocab_count=3)
+        data["comprehension_questions"]["basic_questions"][0]["explanation"] = "带\t制表符和\n换行的解析"
+        lesson = generate_module.build_lesson(data)
+        documents = [('文章', lesson.articles[0].blocks), ('问题', lesson.questions),
+                     ('学生版问题', lesson.student_questions), ('词汇表', lesson.vocabulary)]
+
+        all_passed = True
+        for label, blocks in documents:
+            paragraphs, tables = describe_docx(generate_module.render_ooxml(blocks))
+            expected = describe_docx(generate_module.render_docx(blocks))
+            same = (paragraphs, tables) == expected
+            all_passed = all_passed and same
+            print(f"{'✅' if same else '❌'} {label}: {len(paragraphs)} 个段落，{len(tables)} 个表格")
+            if not same:
+                for actual, wanted in zip(paragraphs + tables, expected[0] + expected[1]):
+                    if actual != wanted:
+                        print(f"   OOXML: {actual}\n   python-docx: {wanted}")
+                        break
+
+        # 比较的内容确实包含标题、粗体、颜色和表格
+        described = [describe_docx(generate_module.render_ooxml(blocks)) for _, blocks in documents]
+        paragraphs = [paragraph for document, _ in described for paragraph in document]
+        covered = any(style.startswith('Heading') or style == 'Title' for style, _, _, _ in paragraphs) \
+            and any(bold for *_, runs in paragraphs for _, bold, _ in runs) \
+            and any(style_color for _, style_color, _, _ in paragraphs) \
+            and any(tables for _, tables in described)
+        print(f"{'✅' if covered else '❌'} 比较覆盖了标题、粗体、颜色和表格")
+        return all_passed and covered
+
+    except Exception as e:
+        print(f"❌ OOXML写出后端测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_handler_encoding():
+    """通过handler往返真实压缩包，比较各种响应体编码的传输大小"""
+    print("\n📡 测试handler响应体编码...")
+
+    try:
+        import base64
+        import io
+        import json
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        event = {'httpMethod': 'POST', 'body': json.dumps(build_sample_data())}
+        raw_size = len(generate_module.generate_reading_materials(json.loads(event['body'])))
+        print(f"📦 原始ZIP大小: {raw_size} 字节")
+
+        all_passed = True
+        for encoding in ('latin-1', 'base64', 'auto'):
+            generate_module.HANDLER_BODY_ENCODING = encoding
+            response = generate_module.handler(event)
+
+            # 按JSON序列化后的大小计算传输大小
+            wire_size = len(json.dumps(response['body']))
+            if response['isBase64Encoded']:
+                zip_data = base64.b64decode(response['body'])
+            else:
+                zip_data = response['body'].encode('latin-1')
+
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+                intact = zip_ref.testzip() is None
+            status = "✅" if intact and response['statusCode'] == 200 else "❌"
+            all_passed = all_passed and status == "✅"
+            print(f"{status} {encoding:<8} 传输 {wire_size:>8} 字节 "
+                  f"({wire_size / raw_size:.2f}x)，isBase64Encoded={response['isBase64Encoded']}")
+
+        return all_passed
+
+    except Exception as e:
+        print(f"❌ handler测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    finally:
+        generate_module.HANDLER_BODY_ENCODING = os.environ.get('HANDLER_BODY_ENCODING', 'auto')
+
+
+def test_parallel_compression():
+    """多线程分块压缩超过1MB的条目：压缩包完整，解压后与顺序压缩的内容一致"""
+    print("\n🧵 测试并行分块压缩...")
+
+    try:
+        import io
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data(version_count=2, paragraph_count=12000)
+        entries = list(generate_module.lesson_entries(data))
+        policy = generate_module.compression_policy({"compression": {"docx": "deflate"}})
+        largest = max(len(content) for _, content in entries
+                      if not isinstance(content, generate_module.CompressedEntry))
+        print(f"📦 最大条目 {largest} 字节（分块大小 {generate_module.DEFLATE_CHUNK_SIZE} 字节）")
+
+        # 统计分块压缩的调用次数，确认走的是分块路径
+        original_chunk = generate_module.deflate_chunk
+        chunk_calls = []
+
+        def counted_chunk(*args, **kwargs):
+            chunk_calls.append(args[1])
+            return original_chunk(*args, **kwargs)
+
+        def assemble(workers):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                generate_module.write_entries(zip_file, entries, policy, workers)
+            return buffer.getvalue()
+
+        sequential = assemble(1)
+        generate_module.deflate_chunk = counted_chunk
+        try:
+            parallel = assemble(4)
+        finally:
+            generate_module.deflate_chunk = original_chunk
+        chunked = largest > generate_module.DEFLATE_CHUNK_SIZE and len(chunk_calls) > 1
+        print(f"{'✅' if chunked else '❌'} 分块压缩 {len(chunk_calls)} 块")
+
+        with zipfile.ZipFile(io.BytesIO(sequential)) as expected, zipfile.ZipFile(io.BytesIO(parallel)) as actual:
+            intact = actual.testzip() is None
+            same = expected.namelist() == actual.namelist() \
+                and all(expected.read(name) == actual.read(name) for name in expected.namelist())
+        print(f"{'✅' if intact else '❌'} 并行压缩的压缩包通过 testzip")
+        print(f"{'✅' if same else '❌'} 解压后与顺序压缩的内容一致（{len(sequential)} / {len(parallel)} 字节）")
+        return chunked and intact and same
+
+    except Exception as e:
+        print(f"❌ 并行分块压缩测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_streaming_output():
+    """流式生成：写入不可定位的StreamBuffer（条目带数据描述符），拼接各块后是完整的压缩包"""
+    print("\n🌊 测试流式生成...")
+
+    try:
+        import io
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data(paragraph_count=200)
+        chunks = list(generate_module.stream_reading_materials(data))
+        streamed = b''.join(chunks)
+        with zipfile.ZipFile(io.BytesIO(generate_module.generate_reading_materials(data))) as expected, \
+                zipfile.ZipFile(io.BytesIO(streamed)) as actual:
+            intact = actual.testzip() is None
+            # 不可定位的流写不回本地文件头，大小和CRC写在条目后的数据描述符中（标志位3）；
+            # 预先压缩的使用说明大小和CRC已知，直接写在本地文件头中
+            descriptors = all(info.flag_bits & 0x08 for info in actual.infolist()
+                              if info.filename != '使用说明.txt')
+            same = expected.namelist() == actual.namelist() \
+                and all(expected.read(name) == actual.read(name) for name in expected.namelist()
+                        if name != '教师使用指南.docx')
+        print(f"{'✅' if intact else '❌'} {len(chunks)} 块拼接后通过 testzip（{len(streamed)} 字节）")
+        print(f"{'✅' if descriptors else '❌'} 条目使用数据描述符")
+        print(f"{'✅' if same else '❌'} 文件列表和内容与整体生成一致")
+        return intact and descriptors and same
+
+    except Exception as e:
+        print(f"❌ 流式生成测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_low_memory():
+    """低内存模式：压缩包超过 SPOOL_MAX_SIZE 后转存到临时文件，仍能打开且文件列表与普通模式一致"""
+    print("\n🪶 测试低内存模式...")
+
+    try:
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data(paragraph_count=2000)
+        low_memory = dict(data, options={"low_memory": True})
+        with zipfile.ZipFile(generate_module.build_reading_materials(data)) as expected:
+            expected_names = expected.namelist()
+            expected_texts = {name: expected.read(name) for name in expected_names if name.endswith('.txt')}
+
+        original_spool = generate_module.SPOOL_MAX_SIZE
+        generate_module.SPOOL_MAX_SIZE = 4 * 1024
+        try:
+            zip_buffer = generate_module.build_reading_materials(low_memory)
+        finally:
+            generate_module.SPOOL_MAX_SIZE = original_spool
+        with zip_buffer:
+            spilled = zip_buffer._rolled
+            with zipfile.ZipFile(zip_buffer) as actual:
+                intact = actual.testzip() is None
+                same = actual.namelist() == expected_names \
+                    and all(actual.read(name) == text for name, text in expected_texts.items())
+                documents = all(zipfile.is_zipfile(actual.open(name)) for name in expected_names
+                                if name.endswith('.docx'))
+        print(f"{'✅' if spilled else '❌'} 压缩包转存到临时文件")
+        print(f"{'✅' if intact and documents else '❌'} 压缩包和其中的Word文档都能打开")
+        print(f"{'✅' if same else '❌'} 文件列表和纯文本内容与普通模式一致（{len(expected_names)} 个文件）")
+        return spilled and intact and documents and same
+
+    except Exception as e:
+        print(f"❌ 低内存模式测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_request_bodies():
+    """handler接受gzip压缩、base64编码的请求体，拒绝解压炸弹和无效的选项"""
+    print("\n📨 测试压缩请求体...")
+
+    try:
+        import base64
+        import gzip
+        import json
+        import zlib
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        raw = json.dumps(build_sample_data(), ensure_ascii=False).encode('utf-8')
+        compressed = gzip.compress(raw)
+        response = generate_module.handler({
+            'httpMethod': 'POST',
+            'headers': {'content-encoding': 'gzip'},
+            'body': base64.b64encode(compressed).decode('ascii'),
+            'isBase64Encoded': True,
+        })
+        accepted = response['statusCode'] == 200 and response['headers']['Content-Type'] == 'application/zip'
+        print(f"{'✅' if accepted else '❌'} gzip+base64请求体: {len(raw)} -> {len(compressed)} 字节，状态 {response['statusCode']}")
+
+        # 内容重复的小请求体压缩比超过倍数上限，但解压后很小，应当接受
+        small = json.dumps(build_sample_data(paragraph_count=1000), ensure_ascii=False).encode('utf-8')
+        compressed = zlib.compress(small, 9)
+        response = generate_module.handler({
+            'httpMethod': 'POST',
+            'headers': {'Content-Encoding': 'deflate'},
+            'body': base64.b64encode(compressed).decode('ascii'),
+            'isBase64Encoded': True,
+        })
+        ratio = len(small) / len(compressed)
+        repetitive = ratio > generate_module.MAX_DECOMPRESSION_RATIO and response['statusCode'] == 200
+        print(f"{'✅' if repetitive else '❌'} 高度重复的小请求体（压缩比 {ratio:.0f}:1）: 状态 {response['statusCode']}")
+
+        bomb = gzip.compress(b' ' * (64 * 1024 * 1024))
+        response = generate_module.handler({
+            'httpMethod': 'POST',
+            'headers': {'Content-Encoding': 'gzip'},
+            'body': base64.b64encode(bomb).decode('ascii'),
+            'isBase64Encoded': True,
+        })
+        rejected = response['statusCode'] == 413
+        print(f"{'✅' if rejected else '❌'} 解压炸弹（{len(bomb)} 字节解压为64MB）: 状态 {response['statusCode']}")
+
+        # 无效的选项在生成之前返回400
+        from local_server import app
+        statuses = []
+        invalid_options = [{'compression': compression} for compression in (
+            {'text_level': 'x'}, {'text_level': 99}, {'large_text_size': '1MB'}, {'text': 'zip'})]
+        invalid_options += [{'generated_at': 'yesterday'}, {'generated_at': '2200-01-01T00:00'},
+                            {'max_part_size': 'abc'}, {'max_part_size': -1}]
+        for options in invalid_options:
+            data = dict(build_sample_data(), options=options)
+            response = generate_module.handler({'httpMethod': 'POST', 'body': json.dumps(data), 'headers': {}})
+            statuses.append(response['statusCode'])
+            statuses.append(app.test_client().post('/api/generate', json=data).status_code)
+        invalid = set(statuses) == {400}
+        print(f"{'✅' if invalid else '❌'} 无效的选项: 状态 {statuses}")
+        return accepted and repetitive and rejected and invalid
+
+    except Exception as e:
+        print(f"❌ 压缩请求体测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_result_cache():
+    """重复请求命中结果缓存，带ETag的请求返回304，超出大小上限时淘汰"""
+    print("\n⚡ 测试结果缓存...")
+
+    try:
+        import json
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        generate_module.result_cache.clear()
+        event = {'httpMethod': 'POST', 'body': json.dumps(build_sample_data()), 'headers': {}}
+        first = generate_module.handler(event)
+        second = generate_module.handler(event)
+        cached = (first['headers']['X-Cache'], second['headers']['X-Cache']) == ('MISS', 'HIT') \
+            and first['body'] == second['body']
+        print(f"{'✅' if cached else '❌'} 两次请求: {first['headers']['X-Cache']} / {second['headers']['X-Cache']}")
+
+        conditional = dict(event, headers={'If-None-Match': first['headers']['ETag']})
+        not_modified = generate_module.handler(conditional)['statusCode'] == 304
+        print(f"{'✅' if not_modified else '❌'} If-None-Match 返回304")
+
+        # 部署新版本（生成器版本改变）后，客户端保存的旧ETag不再返回304
+        from local_server import app
+        client = app.test_client()
+        old_etag = client.post('/api/generate', json=build_sample_data()).headers['ETag']
+        local_not_modified = client.post('/api/generate', json=build_sample_data(),
+                                         headers={'If-None-Match': old_etag}).status_code == 304
+        original_version = generate_module.generator_version
+        generate_module.generator_version = lambda: 'another-version'
+        try:
+            statuses = (generate_module.handler(conditional)['statusCode'],
+                        client.post('/api/generate', json=build_sample_data(),
+                                    headers={'If-None-Match': old_etag}).status_code)
+        finally:
+            generate_module.generator_version = original_version
+        upgraded = local_not_modified and statuses == (200, 200)
+        print(f"{'✅' if upgraded else '❌'} 生成器版本改变后旧ETag不再匹配: {statuses}")
+
+        cache = generate_module.SizedLRUCache(100)
+        for key in 'abc':
+            cache.put(key, b'x' * 40)
+        stats = cache.stats()
+        evicted = stats['entries'] == 2 and stats['evictions'] == 1 and cache.get('a') is None
+        print(f"{'✅' if evicted else '❌'} 按字节数淘汰: {stats}")
+
+        # 中间表示缓存：多个线程交替请求两份数据，只能缓存一条时不断淘汰，不应出错
+        import threading
+        variants = [build_sample_data(), dict(build_sample_data(), core_theme="另一个主题")]
+        errors = []
+
+        def build_many(offset):
+            try:
+                for index in range(40):
+                    generate_module.build_lesson(variants[(index + offset) % 2])
+            except Exception as error:
+                errors.append(error)
+
+        original_lessons = generate_module._lesson_cache
+        generate_module._lesson_cache = generate_module.SizedLRUCache(1, size_of=lambda lesson: 1)
+        try:
+            threads = [threading.Thread(target=build_many, args=(index,)) for index in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            generate_module._lesson_cache = original_lessons
+        thread_safe = not errors
+        print(f"{'✅' if thread_safe else '❌'} 多线程使用中间表示缓存: {errors[:1]}")
+        return cached and not_modified and upgraded and evicted and thread_safe
+
+    except Exception as e:
+        print(f"❌ 结果缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def wait_until(condition, timeout=10):
+    """等待condition()为真，超过timeout秒仍不成立时返回False（避免测试卡住）"""
+    import time
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            print(f"❌ 等待超过 {timeout} 秒")
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def join_all(threads, timeout=10):
+    """等待所有线程结束，超过timeout秒仍有线程未结束时返回False"""
+    wait_until(lambda: not any(thread.is_alive() for thread in threads), timeout)
+    return not any(thread.is_alive() for thread in threads)
+
+
+def test_single_flight():
+    """同时到达的同样请求只执行一次，等待的请求共用结果或收到同样的异常"""
+    print("\n🤝 测试合并同样的请求...")
+
+    try:
+        import json
+        import threading
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        flight = generate_module.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        results = []
+
+        def slow():
+            started.set()
+            release.wait(10)
+            return object()
+
+        def call(function):
+            try:
+                results.append(flight.do('key', function))
+            except ValueError as error:
+                results.append(error)
+
+        leader = threading.Thread(target=call, args=(slow,), daemon=True)
+        leader.start()
+        started.wait(10)
+        waiters = [threading.Thread(target=call, args=(slow,), daemon=True) for _ in range(7)]
+        for thread in waiters:
+            thread.start()
+        waited = wait_until(lambda: flight.stats()['coalesced'] >= 7)
+        release.set()
+        waited = join_all([leader] + waiters) and waited
+        merged = waited and len({id(result) for result, _ in results}) == 1 and flight.stats()['executions'] == 1 \
+            and sum(coalesced for _, coalesced in results) == 7
+        print(f"{'✅' if merged else '❌'} 8个同时进行的调用只执行一次: {flight.stats()}")
+
+        started.clear()
+        release.clear()
+        results.clear()
+
+        def failing():
+            started.set()
+            release.wait(10)
+            raise ValueError('生成失败')
+
+        leader = threading.Thread(target=call, args=(failing,), daemon=True)
+        leader.start()
+        started.wait(10)
+        waiters = [threading.Thread(target=call, args=(failing,), daemon=True) for _ in range(3)]
+        for thread in waiters:
+            thread.start()
+        waited = wait_until(lambda: flight.stats()['coalesced'] >= 10)
+        release.set()
+        waited = join_all([leader] + waiters) and waited
+        propagated = waited and len(results) == 4 and all(isinstance(result, ValueError) for result in results) \
+            and flight.stats()['in_flight'] == 0
+        print(f"{'✅' if propagated else '❌'} 生成失败时所有等待的请求都收到异常")
+
+        data = build_sample_data()
+        data["core_theme"] = "合并请求测试"
+        event = {'httpMethod': 'POST', 'body': json.dumps(data), 'headers': {}}
+        responses = []
+
+        def request():
+            responses.append(generate_module.handler(event))
+
+        # 第一个请求停在生成中，直到其他5个请求都在等待它，确保它们是合并而不是在生成后命中缓存
+        original_generate = generate_module.generate_reading_materials
+        generating, proceed = threading.Event(), threading.Event()
+
+        def held_generate(data):
+            generating.set()
+            proceed.wait(10)
+            return original_generate(data)
+
+        coalesced_before = generate_module.generation_flight.stats()['coalesced']
+        generate_module.generate_reading_materials = held_generate
+        try:
+            threads = [threading.Thread(target=request, daemon=True)]
+            threads[0].start()
+            waited = generating.wait(10)
+            threads += [threading.Thread(target=request, daemon=True) for _ in range(5)]
+            for thread in threads[1:]:
+                thread.start()
+            waited = wait_until(lambda: generate_module.generation_flight.stats()['coalesced'] - coalesced_before >= 5) \
+                and waited
+            proceed.set()
+            finished = join_all(threads, timeout=60) and waited
+        finally:
+            proceed.set()
+            generate_module.generate_reading_materials = original_generate
+        statuses = sorted(response['headers']['X-Cache'] for response in responses)
+        handled = finished and statuses == ['COALESCED'] * 5 + ['MISS'] \
+            and len({response['body'] for response in responses}) == 1
+        print(f"{'✅' if handled else '❌'} handler同时收到6个同样的请求: {statuses}")
+        return merged and propagated and handled
+
+    except Exception as e:
+        print(f"❌ 合并请求测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_artifact_memo():
+    """只修改一个版本的文章时，其余文件命中分文件缓存"""
+    print("\n🧩 测试分文件缓存...")
+
+    try:
+        import copy
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data()
+        data["core_theme"] = "分文件缓存测试"
+        data["options"] = {"generated_at": "2024-09-01T08:30"}
+        edited = copy.deepcopy(data)
+        edited["leveled_texts"]["advanced"]["content"] += "\n新增的一段。"
+
+        generate_module.generate_reading_materials(data)
+        before = {kind: dict(counts) for kind, counts in generate_module.artifact_memo_counts.items()}
+        generate_module.generate_reading_materials(edited)
+        after = generate_module.artifact_memo_counts
+
+        delta = {kind: (after[kind]['hits'] - before.get(kind, {}).get('hits', 0),
+                        after[kind]['misses'] - before.get(kind, {}).get('misses', 0)) for kind in after}
+        for kind, (hits, misses) in delta.items():
+            print(f"  {kind}: 命中 {hits}，未命中 {misses}")
+        expected = {'article': (3, 1), 'questions': (1, 0), 'vocabulary': (1, 0), 'teacher_guide': (1, 0)}
+        passed = all(delta.get(kind) == counts for kind, counts in expected.items())
+        print(f"{'✅' if passed else '❌'} 只重新渲染了修改过的挑战版文章")
+
+        # 按需模式获取单个文件：由分文件缓存命中；只有文件名不存在时返回404
+        import json
+        name = generate_module.artifact_manifest(data)['artifacts'][0]['name']
+        lazy = dict(data, options=dict(data["options"], artifact=name))
+        found = generate_module.handler({'httpMethod': 'POST', 'body': json.dumps(lazy), 'headers': {}})
+        lazy["options"]["artifact"] = "不存在.docx"
+        missing = generate_module.handler({'httpMethod': 'POST', 'body': json.dumps(lazy), 'headers': {}})
+        artifacts = found['statusCode'] == 200 and missing['statusCode'] == 404
+        print(f"{'✅' if artifacts else '❌'} 按需获取单个文件: {found['statusCode']}，不存在的文件: {missing['statusCode']}")
+        return passed and artifacts
+
+    except Exception as e:
+        print(f"❌ 分文件缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_split_parts():
+    """按分卷清单逐个下载分卷，检查每个分卷不超过上限且合起来包含全部文件"""
+    print("\n📚 测试分卷下载...")
+
+    try:
+        import base64
+        import io
+        import json
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        max_part_size = 40000
+        data = build_sample_data(paragraph_count=200, vocab_count=200)
+        data["options"] = {"max_part_size": max_part_size}
+        with zipfile.ZipFile(io.BytesIO(generate_module.generate_reading_materials(data))) as zip_ref:
+            all_files = zip_ref.namelist()
+
+        response = generate_module.handler({'httpMethod': 'POST', 'body': json.dumps(data)})
+        manifest = json.loads(response['body'])
+        print(f"📋 共 {len(all_files)} 个文件，分为 {len(manifest['parts'])} 个分卷")
+
+        all_passed = len(manifest['parts']) > 1
+        downloaded = []
+        for part in manifest['parts']:
+            part_data = dict(data, options=dict(data["options"], part=part['part'], files=part['files']))
+            response = generate_module.handler({'httpMethod': 'POST', 'body': json.dumps(part_data)})
+            zip_data = base64.b64decode(response['body']) if response['isBase64Encoded'] \
+                else response['body'].encode('latin-1')
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+                intact = zip_ref.testzip() is None
+                downloaded.extend(zip_ref.namelist())
+            within_limit = len(zip_data) <= max_part_size
+            status = "✅" if intact and within_limit else "❌"
+            all_passed = all_passed and status == "✅"
+            print(f"{status} 分卷{part['part']}: {len(part['files'])} 个文件，{len(zip_data)} 字节 (上限 {max_part_size})")
+
+        if sorted(downloaded) != sorted(all_files):
+            print("❌ 分卷合起来的文件与完整压缩包不一致")
+            all_passed = False
+        return all_passed
+
+    except Exception as e:
+        print(f"❌ 分卷测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_reproducible_output():
+    """可重现模式：同样的请求（键顺序不同）得到字节相同的压缩包，时间戳为给定的生成时间"""
+    print("\n🔁 测试可重现输出...")
+
+    try:
+        import io
+        import hashlib
+        import importlib
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        data = build_sample_data()
+        data["options"] = {"generated_at": "2024-09-01T08:30"}
+        reordered = dict(data, leveled_texts=dict(reversed(list(data["leveled_texts"].items()))))
+
+        first = generate_module.generate_reading_materials(data)
+        generate_module._lesson_cache.clear()
+        second = generate_module.generate_reading_materials(reordered)
+        same = first == second
+        print(f"{'✅' if same else '❌'} 两次生成的SHA-256: {hashlib.sha256(first).hexdigest()[:16]} / "
+              f"{hashlib.sha256(second).hexdigest()[:16]}")
+
+        stamps = set()
+        with zipfile.ZipFile(io.BytesIO(first)) as zip_ref:
+            for info in zip_ref.infolist():
+                stamps.add(info.date_time)
+                if info.filename.endswith('.docx'):
+                    with zipfile.ZipFile(io.BytesIO(zip_ref.read(info))) as package:
+                        stamps.update(part.date_time for part in package.infolist())
+        expected = {(2024, 9, 1, 8, 30, 0), generate_module.DOCX_DATE_TIME}
+        fixed = stamps <= expected
+        print(f"{'✅' if fixed else '❌'} 条目时间戳: {sorted(stamps)}")
+
+        # 超过1MB的条目在多线程时会分块压缩：可重现模式下结果不能随线程数（CPU核数）变化
+        large = build_sample_data(version_count=1, paragraph_count=12000)
+        large["options"] = {"generated_at": "2024-09-01T08:30", "low_memory": False}
+        hashes = []
+        original_workers = generate_module.ZIP_WORKERS
+        try:
+            for workers in (1, 4):
+                generate_module.ZIP_WORKERS = workers
+                hashes.append(hashlib.sha256(generate_module.generate_reading_materials(large)).hexdigest()[:16])
+        finally:
+            generate_module.ZIP_WORKERS = original_workers
+        stable = hashes[0] == hashes[1]
+        print(f"{'✅' if stable else '❌'} 1个和4个压缩线程的SHA-256: {hashes[0]} / {hashes[1]}")
+        return same and fixed and stable
+
+    except Exception as e:
+        print(f"❌ 可重现输出测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_archive_downloads():
+    """通过本地服务器下载保存的压缩包：Range续传和单独下载其中一个文件"""
+    print("\n📎 测试压缩包续传和单文件下载...")
+
+    try:
+        import io
+        from benchmark import build_sample_data
+        from local_server import app
+
+        client = app.test_client()
+        response = client.post('/api/generate', json=build_sample_data())
+        zip_data = response.data
+        archive_url = response.headers.get('X-Archive-Url')
+        if not archive_url:
+            print("❌ 响应中没有 X-Archive-Url")
+            return False
+        print(f"📋 压缩包地址: {archive_url} ({len(zip_data)} 字节)")
+
+        all_passed = True
+        half = len(zip_data) // 2
+        first = client.get(archive_url, headers={'Range': f'bytes=0-{half - 1}'})
+        rest = client.get(archive_url, headers={'Range': f'bytes={half}-'})
+        resumed = first.status_code == rest.status_code == 206 and first.data + rest.data == zip_data
+        print(f"{'✅' if resumed else '❌'} 分两段Range下载后与完整压缩包一致")
+        all_passed = all_passed and resumed
+
+        with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+            for name in zip_ref.namelist():
+                member = client.get(f'{archive_url}/files/{name}')
+                matches = member.status_code == 200 and member.data == zip_ref.read(name)
+                all_passed = all_passed and matches
+                print(f"{'✅' if matches else '❌'} 单独下载: {name} ({len(member.data)} 字节)")
+
+        missing = client.get(f'{archive_url}/files/不存在.txt').status_code == 404
+        print(f"{'✅' if missing else '❌'} 不存在的文件返回404")
+        return all_passed and missing
+
+    except Exception as e:
+        print(f"❌ 压缩包下载测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_real_server():
+    """通过真实的WSGI服务器（werkzeug.serving）请求本地服务器：响应体必须是bytes，测试客户端不检查这一点"""
+    print("\n🌍 测试真实服务器...")
+
+    try:
+        import io
+        import json
+        import threading
+        import urllib.parse
+        import urllib.request
+        from werkzeug.serving import make_server
+        from benchmark import build_sample_data
+        import local_server
+
+        # 测试内存中的压缩包，关闭磁盘缓存，以免之前运行留下的文件先命中
+        original_store, local_server.disk_store = local_server.disk_store, None
+        server = make_server('127.0.0.1', 0, local_server.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        try:
+            data = build_sample_data()
+            data["core_theme"] = "真实服务器测试"
+            post = urllib.request.Request(f'{base_url}/api/generate', data=json.dumps(data).encode('utf-8'),
+                                          headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(post, timeout=60) as response:
+                zip_data = response.read()
+                length = int(response.headers['Content-Length'])
+                archive_url = response.headers['X-Archive-Url']
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+                valid = len(zip_data) == length and zip_ref.testzip() is None
+                name = zip_ref.namelist()[0]
+                member_data = zip_ref.read(name)
+            print(f"{'✅' if valid else '❌'} /api/generate 返回完整的压缩包 ({len(zip_data)} 字节)")
+
+            ranged = urllib.request.Request(f'{base_url}{archive_url}', headers={'Range': 'bytes=100-'})
+            with urllib.request.urlopen(ranged, timeout=60) as response:
+                resumed = response.status == 206 and response.read() == zip_data[100:]
+            with urllib.request.urlopen(f'{base_url}{archive_url}/files/{urllib.parse.quote(name)}',
+                                        timeout=60) as response:
+                member = response.read() == member_data
+            print(f"{'✅' if resumed and member else '❌'} Range续传和单文件下载")
+
+            data["options"] = {"lazy": True}
+            post = urllib.request.Request(f'{base_url}/api/generate', data=json.dumps(data).encode('utf-8'),
+                                          headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(post, timeout=60) as response:
+                artifact_url = json.loads(response.read())['artifacts'][0]['url']
+            with urllib.request.urlopen(f'{base_url}{artifact_url}', timeout=60) as response:
+                artifact = len(response.read()) == int(response.headers['Content-Length']) > 0
+            print(f"{'✅' if artifact else '❌'} 按需渲染的文件")
+            return valid and resumed and member and artifact
+        finally:
+            server.shutdown()
+            thread.join()
+            local_server.disk_store = original_store
+
+    except Exception as e:
+        print(f"❌ 真实服务器测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_disk_store():
+    """磁盘缓存：内容寻址、按最近使用淘汰、清理崩溃残留，本地服务器命中时从磁盘发送"""
+    print("\n💾 测试磁盘缓存...")
+
+    try:
+        import tempfile
+        import time
+        from disk_store import DiskStore, STALE_TEMP_AGE
+
+        with tempfile.TemporaryDirectory() as root:
+            store = DiskStore(root, 100)
+            first = store.put('a' * 64, b'x' * 40)
+            same = store.put('b' * 64, b'x' * 40)
+            deduplicated = first == same and store.stats()['size'] == 40
+            print(f"{'✅' if deduplicated else '❌'} 内容相同的两个键共用一个文件")
+
+            time.sleep(0.01)
+            store.put('c' * 64, b'y' * 40)
+            store.get('a' * 64)
+            time.sleep(0.01)
+            store.put('d' * 64, b'z' * 40)
+            evicted = store.get('c' * 64) is None and store.get('a' * 64) is not None and store.stats()['size'] <= 100
+            print(f"{'✅' if evicted else '❌'} 超过上限时淘汰最久未使用的内容: {store.stats()}")
+
+            # 内容文件被其他进程淘汰后再次放入同样的内容
+            os.remove(store.put('e' * 64, b'w' * 40))
+            recreated = os.path.exists(store.put('f' * 64, b'w' * 40))
+            print(f"{'✅' if recreated else '❌'} 内容文件被淘汰后重新写入")
+
+            stale = os.path.join(root, 'tmp', 'crashed')
+            with open(stale, 'wb') as f:
+                f.write(b'partial')
+            os.utime(stale, (time.time() - STALE_TEMP_AGE - 1,) * 2)
+            DiskStore(root, 100)
+            cleaned = not os.path.exists(stale)
+            print(f"{'✅' if cleaned else '❌'} 重新打开时清理崩溃残留的临时文件")
+
+        import importlib
+        local_server = importlib.import_module('local_server')
+        generate_module = importlib.import_module('api.generate')
+        from benchmark import build_sample_data
+
+        served = True
+        if local_server.disk_store is not None:
+            data = build_sample_data()
+            data["core_theme"] = "磁盘缓存测试"
+            client = local_server.app.test_client()
+            generated = client.post('/api/generate', json=data)
+            generate_module.result_cache.clear()
+            from_disk = client.post('/api/generate', json=data)
+            served = from_disk.headers.get('X-Cache') == 'DISK' and from_disk.data == generated.data
+            print(f"{'✅' if served else '❌'} 本地服务器从磁盘缓存发送: X-Cache={from_disk.headers.get('X-Cache')}")
+
+            # 生成器版本（代码、模板）改变后不再命中旧版本的结果
+            original_version = local_server.generator_version
+            # 每次运行用不同的版本，磁盘缓存会保留上次运行的结果
+            new_version = f'another-version-{os.urandom(8).hex()}'
+            local_server.generator_version = lambda: new_version
+            try:
+                generate_module.result_cache.clear()
+                upgraded = client.post('/api/generate', json=data).headers.get('X-Cache') != 'DISK'
+            finally:
+                local_server.generator_version = original_version
+            served = served and upgraded
+            print(f"{'✅' if upgraded else '❌'} 生成器版本改变后不命中旧的磁盘缓存")
+        return deduplicated and evicted and cleaned and recreated and served
+
+    except Exception as e:
+        print(f"❌ 磁盘缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def shared_cache_value(key):
+    """共享缓存测试用：由键确定的、长短不一（跨越多个slab）的值"""
+    import hashlib
+    seed = hashlib.sha256(key.encode('utf-8')).digest()
+    return seed * (int.from_bytes(seed[:2], 'little') % 2000 + 100)
+
+
+def hammer_shared_cache(name, worker, results):
+    """共享缓存测试的子进程：反复读写同一组键，记录读到错误数据的次数"""
+    from shared_cache import SharedCache
+    cache = SharedCache(name, 512 * 1024, slab_size=8 * 1024)
+    corrupted = 0
+    for round_index in range(400):
+        key = f'key-{(round_index * 7 + worker) % 32}'
+        value = cache.get(key)
+        if value is None:
+            cache.put(key, shared_cache_value(key))
+        elif value != shared_cache_value(key):
+            corrupted += 1
+    results.put((corrupted, cache.hits))
+    cache.close()
+
+
+def test_shared_cache():
+    """共享内存缓存：多个进程同时读写同一组键时不读到错误数据，一个进程放入的结果在其他进程命中"""
+    print("\n🔗 测试共享内存缓存...")
+
+    try:
+        import multiprocessing
+        from shared_cache import SharedCache, fcntl
+
+        if fcntl is None:
+            print("⚠️  当前系统不支持共享内存缓存，跳过")
+            return True
+
+        name = f'reading-materials-test-{os.getpid()}'
+        cache = SharedCache(name, 512 * 1024, slab_size=8 * 1024)
+        try:
+            worker = multiprocessing.Process(target=cache.put, args=('from-child', b'child' * 5000))
+            worker.start()
+            worker.join()
+            shared = cache.get('from-child') == b'child' * 5000
+            print(f"{'✅' if shared else '❌'} 子进程放入的值在父进程命中")
+
+            results = multiprocessing.Queue()
+            workers = [multiprocessing.Process(target=hammer_shared_cache, args=(name, index, results))
+                       for index in range(4)]
+            for worker in workers:
+                worker.start()
+            outcomes = [results.get(timeout=60) for _ in workers]
+            for worker in workers:
+                worker.join()
+            stats = cache.stats()
+            consistent = all(corrupted == 0 for corrupted, _ in outcomes)
+            bounded = stats['size'] <= stats['max_size'] and stats['evictions'] > 0
+            print(f"{'✅' if consistent else '❌'} 4个进程同时读写，读到错误数据 "
+                  f"{sum(corrupted for corrupted, _ in outcomes)} 次，命中 {sum(hits for _, hits in outcomes)} 次")
+            print(f"{'✅' if bounded else '❌'} 总大小不超过上限并淘汰旧数据: {stats}")
+
+            import importlib
+            local_server = importlib.import_module('local_server')
+            generate_module = importlib.import_module('api.generate')
+            from benchmark import build_sample_data
+
+            data = build_sample_data()
+            data["core_theme"] = "共享内存缓存测试"
+            client = local_server.app.test_client()
+            # 关闭磁盘缓存，以免之前运行留下的文件先命中
+            original_cache, original_store = local_server.shared_cache, local_server.disk_store
+            local_server.shared_cache, local_server.disk_store = SharedCache(name, 4 * 1024 * 1024), None
+            try:
+                generated = client.post('/api/generate', json=data)
+                generate_module.result_cache.clear()
+                from_shared = client.post('/api/generate', json=data)
+                # 部署新版本（生成器版本改变）后不再命中其他worker用旧版本生成的结果
+                local_server.generator_version = lambda: 'another-version'
+                generate_module.result_cache.clear()
+                upgraded = client.post('/api/generate', json=data).headers.get('X-Cache') != 'SHARED'
+            finally:
+                local_server.generator_version = generate_module.generator_version
+                local_server.shared_cache.close()
+                local_server.shared_cache, local_server.disk_store = original_cache, original_store
+            served = from_shared.headers.get('X-Cache') == 'SHARED' and from_shared.data == generated.data
+            print(f"{'✅' if served else '❌'} 本地服务器命中其他worker的结果: X-Cache={from_shared.headers.get('X-Cache')}")
+            print(f"{'✅' if upgraded else '❌'} 生成器版本改变后不命中旧的共享内存缓存")
+        finally:
+            cache.close()
+            cache.unlink()
+        return shared and consistent and bounded and served and upgraded
+
+    except Exception as e:
+        print(f"❌ 共享内存缓存测试失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
 def test_frontend_files():
     """测试前端文件是否存在"""
     print("\n🌐 测试前端文件...")
@@ -184,9 +1230,9 @@ def test_local_server():
             # 检查关键内容
             checks = [
                 ('Flask', '包含Flask框架'),
-                ('generate_reading_materials', '调用生成函数'),
+                ('build_reading_materials', '调用生成函数'),
                 ('@app.route', '有路由定义'),
-                ('send_file', '有文件返回功能')
+                ('getbuffer()', '有文件返回功能')
             ]
 
             all_checks_passed = True
@@ -235,6 +1281,23 @@ def main():
     tests = [
         ("Python依赖", test_dependencies),
         ("文件生成", test_file_generation),
+        ("学生版和教师答案版", test_answer_key),
+        ("词汇表表格", test_vocabulary_table),
+        ("OOXML写出后端", test_ooxml_writer),
+        ("并行分块压缩", test_parallel_compression),
+        ("流式生成", test_streaming_output),
+        ("低内存模式", test_low_memory),
+        ("响应体编码", test_handler_encoding),
+        ("压缩请求体", test_request_bodies),
+        ("结果缓存", test_result_cache),
+        ("合并同样的请求", test_single_flight),
+        ("分文件缓存", test_artifact_memo),
+        ("分卷下载", test_split_parts),
+        ("续传和单文件下载", test_archive_downloads),
+        ("真实服务器", test_real_server),
+        ("可重现输出", test_reproducible_output),
+        ("磁盘缓存", test_disk_store),
+        ("共享内存缓存", test_shared_cache),
         ("前端文件", test_frontend_files),
         ("本地服务器", test_local_server)
     ]
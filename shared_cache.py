@@ -0,0 +1,312 @@
+"""
+跨进程共享内存缓存：同一台机器上的多个worker进程（如gunicorn prefork）共用一份生成结果
+基于 multiprocessing.shared_memory，一个worker生成的压缩包在其他worker中直接命中
+
+共享内存布局：
+    头部    魔数、slab大小和数量、索引容量，以及条目数、已用slab数、淘汰次数等统计
+    索引    固定容量的开放寻址哈希表，每项记录版本号、键的摘要、第一个slab、长度、最近使用时间和CRC
+    slab表  每个slab的下一个slab编号（链表）和所属的索引项
+    slab区  固定大小的数据块，一个值依次占用若干个slab
+
+写入（放入、淘汰）时持有文件锁（fcntl.flock），同一时间只有一个进程修改；
+读取不加锁：索引项带有版本号（seqlock），修改前后各加一，读取前后版本号不一致或为奇数时重试，
+再用CRC校验，读到的数据要么完整正确，要么视为未命中。最近使用时间在读取时直接写入，是近似的LRU。
+"""
+
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+
+try:
+    import fcntl
+except ImportError:
+    # Windows 没有 fcntl，不支持共享缓存
+    fcntl = None
+
+MAGIC = b'RMCACHE1'
+# 魔数、slab大小、slab数、索引容量、墓碑数、条目数、已用slab数、淘汰次数
+HEADER = struct.Struct('<8sIIIIQQQ')
+HEADER_SIZE = 64
+# 版本号、键摘要、状态、第一个slab、长度、最近使用时间、CRC
+ENTRY = struct.Struct('<Q16sIiqQI4x')
+LAST_USED_OFFSET = 40
+EMPTY, USED, DELETED = 0, 1, 2
+DEFAULT_SLAB_SIZE = 64 * 1024
+READ_RETRIES = 8
+
+
+def open_shared_memory(name, size):
+    """创建或连接共享内存，返回 (SharedMemory, 是否新建)
+
+    共享内存的生命周期与缓存相同，不随某个worker退出而删除：
+    Python 3.13 起用 track=False，之前的版本从 resource_tracker 中注销。
+    """
+    try:
+        shm, created = shared_memory.SharedMemory(name=name, create=True, size=size, track=False), True
+    except TypeError:
+        try:
+            shm, created = shared_memory.SharedMemory(name=name, create=True, size=size), True
+        except FileExistsError:
+            shm, created = shared_memory.SharedMemory(name=name), False
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except FileExistsError:
+        shm, created = shared_memory.SharedMemory(name=name, track=False), False
+    return shm, created
+
+
+class SharedCache:
+    """多个进程共用的字节缓存，总容量为 max_size 字节（按 slab_size 大小的slab分配），满时淘汰最久未使用的"""
+
+    def __init__(self, name, max_size, slab_size=DEFAULT_SLAB_SIZE):
+        if fcntl is None:
+            raise RuntimeError("共享内存缓存需要 fcntl，只支持 Linux / macOS")
+        self.name = name
+        self.hits = self.misses = 0
+        self.thread_lock = threading.Lock()
+        self.lock_file = open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+b')
+
+        slab_count = max(max_size // slab_size, 1)
+        # 每个值至少占一个slab，索引容量取slab数的两倍，装载率不超过一半
+        capacity = slab_count * 2
+        with self.locked():
+            self.shm, created = open_shared_memory(name, self.layout_size(slab_size, slab_count, capacity))
+            if created or bytes(self.shm.buf[:len(MAGIC)]) != MAGIC:
+                self.initialize(slab_size, slab_count, capacity)
+            # 以共享内存中记录的参数为准（可能由其他进程按不同配置创建）
+            _, self.slab_size, self.slab_count, self.capacity = HEADER.unpack_from(self.shm.buf)[:4]
+        self.map_layout()
+
+    @staticmethod
+    def layout_size(slab_size, slab_count, capacity):
+        tables = HEADER_SIZE + capacity * ENTRY.size + 8 * slab_count
+        return -(-tables // 64) * 64 + slab_count * slab_size
+
+    def initialize(self, slab_size, slab_count, capacity):
+        """清空共享内存并写入头部"""
+        self.shm.buf[:] = bytes(len(self.shm.buf))
+        HEADER.pack_into(self.shm.buf, 0, MAGIC, slab_size, slab_count, capacity, 0, 0, 0, 0)
+        next_offset = HEADER_SIZE + capacity * ENTRY.size
+        self.shm.buf[next_offset:next_offset + 8 * slab_count] = b'\xff' * (8 * slab_count)
+
+    def map_layout(self):
+        buf = self.shm.buf
+        self.index_offset = HEADER_SIZE
+        next_offset = self.index_offset + self.capacity * ENTRY.size
+        owner_offset = next_offset + 4 * self.slab_count
+        self.slab_offset = -(-(owner_offset + 4 * self.slab_count) // 64) * 64
+        # 每个slab的下一个slab编号和所属索引项，-1表示没有
+        self.next_slab = buf[next_offset:owner_offset].cast('i')
+        self.slab_owner = buf[owner_offset:owner_offset + 4 * self.slab_count].cast('i')
+
+    @contextmanager
+    def locked(self):
+        """跨进程的写锁（同一进程内的线程先用线程锁互斥，flock按打开的文件加锁，不区分线程）"""
+        with self.thread_lock:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def key_digest(key):
+        return hashlib.sha256(key.encode('utf-8')).digest()[:16]
+
+    def entry_offset(self, slot):
+        return self.index_offset + slot * ENTRY.size
+
+    def find(self, digest):
+        """按线性探测查找键所在的索引项，找不到时返回None（不加锁，结果需要校验）"""
+        start = int.from_bytes(digest[:8], 'little') % self.capacity
+        for step in range(self.capacity):
+            slot = (start + step) % self.capacity
+            _, entry_digest, state = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))[:3]
+            if state == EMPTY:
+                return None
+            if state == USED and entry_digest == digest:
+                return slot
+        return None
+
+    def read_slabs(self, first, length):
+        """按链表读出值的数据，链表不完整（正被修改）时返回None"""
+        chunks = []
+        slab, remaining = first, length
+        for _ in range(math.ceil(length / self.slab_size)):
+            if not 0 <= slab < self.slab_count:
+                return None
+            start = self.slab_offset + slab * self.slab_size
+            size = min(remaining, self.slab_size)
+            chunks.append(self.shm.buf[start:start + size])
+            remaining -= size
+            slab = self.next_slab[slab]
+        return b''.join(chunks)
+
+    def get(self, key):
+        """取出缓存的值，不存在时返回None；不加锁"""
+        digest = self.key_digest(key)
+        buf = self.shm.buf
+        for _ in range(READ_RETRIES):
+            slot = self.find(digest)
+            if slot is None:
+                break
+            offset = self.entry_offset(slot)
+            version, entry_digest, state, first, length, _, crc = ENTRY.unpack_from(buf, offset)
+            if version & 1 or state != USED or entry_digest != digest:
+                time.sleep(0)
+                continue
+            data = self.read_slabs(first, length)
+            if data is None or ENTRY.unpack_from(buf, offset)[0] != version or zlib.crc32(data) != crc:
+                continue
+            struct.pack_into('<Q', buf, offset + LAST_USED_OFFSET, time.monotonic_ns())
+            self.hits += 1
+            return data
+        self.misses += 1
+        return None
+
+    def write_entry(self, slot, state, digest=bytes(16), first=-1, length=0, crc=0):
+        """修改索引项：版本号先变为奇数，写完后再变为偶数（持有写锁时调用）"""
+        offset = self.entry_offset(slot)
+        version = ENTRY.unpack_from(self.shm.buf, offset)[0]
+        struct.pack_into('<Q', self.shm.buf, offset, version + 1)
+        ENTRY.pack_into(self.shm.buf, offset, version + 1, digest, state, first, length, time.monotonic_ns(), crc)
+        struct.pack_into('<Q', self.shm.buf, offset, version + 2)
+
+    def update_header(self, **changes):
+        """修改头部的统计字段（持有写锁时调用）"""
+        fields = dict(zip(('magic', 'slab_size', 'slab_count', 'capacity', 'tombstones', 'entries',
+                           'used_slabs', 'evictions'), HEADER.unpack_from(self.shm.buf)))
+        for name, delta in changes.items():
+            fields[name] += delta
+        HEADER.pack_into(self.shm.buf, 0, *fields.values())
+        return fields
+
+    def free_entry(self, slot):
+        """删除一个索引项并释放它的slab（持有写锁时调用）"""
+        _, _, _, first, length, _, _ = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))
+        self.write_entry(slot, DELETED)
+        slab, count = first, math.ceil(length / self.slab_size)
+        for _ in range(count):
+            following = self.next_slab[slab]
+            self.slab_owner[slab] = -1
+            self.next_slab[slab] = -1
+            slab = following
+        self.update_header(tombstones=1, entries=-1, used_slabs=-count)
+
+    def evict_for(self, slab_count):
+        """按最近使用时间从旧到新删除索引项，直到空闲slab不少于slab_count（持有写锁时调用）"""
+        used = []
+        for slot in range(self.capacity):
+            _, _, state, _, _, last_used, _ = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))
+            if state == USED:
+                used.append((last_used, slot))
+        used.sort()
+        free = self.slab_count - HEADER.unpack_from(self.shm.buf)[6]
+        for _, slot in used:
+            if free >= slab_count:
+                break
+            length = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))[4]
+            self.free_entry(slot)
+            free += math.ceil(length / self.slab_size)
+            self.update_header(evictions=1)
+
+    def rebuild_index(self):
+        """墓碑过多时重新插入所有索引项，缩短探测链（持有写锁时调用；期间读取可能未命中，但不会读错）"""
+        entries = []
+        for slot in range(self.capacity):
+            _, digest, state, first, length, _, crc = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))
+            if state == USED:
+                entries.append((digest, first, length, crc))
+            if state != EMPTY:
+                self.write_entry(slot, EMPTY)
+        for digest, first, length, crc in entries:
+            slot = self.insert_slot(digest)
+            self.write_entry(slot, USED, digest, first, length, crc)
+            self.relink_owner(first, length, slot)
+        fields = self.update_header()
+        self.update_header(tombstones=-fields['tombstones'])
+
+    def relink_owner(self, first, length, slot):
+        slab = first
+        for _ in range(math.ceil(length / self.slab_size)):
+            self.slab_owner[slab] = slot
+            slab = self.next_slab[slab]
+
+    def insert_slot(self, digest):
+        """新键可用的索引项：探测链上的第一个空项或墓碑"""
+        start = int.from_bytes(digest[:8], 'little') % self.capacity
+        for step in range(self.capacity):
+            slot = (start + step) % self.capacity
+            if ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))[2] != USED:
+                return slot
+        raise RuntimeError("共享缓存索引已满")
+
+    def put(self, key, value):
+        """放入缓存，空间不足时淘汰最久未使用的；键已存在时只更新最近使用时间；值大于缓存总容量时不放入，返回False"""
+        slab_count = math.ceil(len(value) / self.slab_size)
+        if slab_count > self.slab_count:
+            return False
+        digest = self.key_digest(key)
+        with self.locked():
+            slot = self.find(digest)
+            if slot is not None:
+                struct.pack_into('<Q', self.shm.buf, self.entry_offset(slot) + LAST_USED_OFFSET, time.monotonic_ns())
+                return True
+
+            self.evict_for(slab_count)
+            if HEADER.unpack_from(self.shm.buf)[4] > self.capacity // 4:
+                self.rebuild_index()
+
+            slot = self.insert_slot(digest)
+            slabs = [index for index, owner in enumerate(self.slab_owner.tolist()) if owner == -1][:slab_count]
+            view = memoryview(value).cast('B')
+            for position, slab in enumerate(slabs):
+                start = self.slab_offset + slab * self.slab_size
+                chunk = view[position * self.slab_size:(position + 1) * self.slab_size]
+                self.shm.buf[start:start + len(chunk)] = chunk
+                self.next_slab[slab] = slabs[position + 1] if position + 1 < len(slabs) else -1
+                self.slab_owner[slab] = slot
+            reused_tombstone = ENTRY.unpack_from(self.shm.buf, self.entry_offset(slot))[2] == DELETED
+            self.write_entry(slot, USED, digest, slabs[0] if slabs else -1, len(value), zlib.crc32(view))
+            self.update_header(entries=1, used_slabs=slab_count, tombstones=-1 if reused_tombstone else 0)
+        return True
+
+    def stats(self):
+        """容量和命中情况；命中、未命中为本进程的统计，条目数、淘汰次数为所有进程共用的统计"""
+        _, slab_size, slab_count, _, _, entries, used_slabs, evictions = HEADER.unpack_from(self.shm.buf)
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'entries': entries,
+            'size': used_slabs * slab_size,
+            'max_size': slab_count * slab_size,
+            'slab_size': slab_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': evictions,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def close(self):
+        """断开本进程与共享内存的连接（共享内存本身保留）"""
+        self.next_slab.release()
+        self.slab_owner.release()
+        self.shm.close()
+        self.lock_file.close()
+
+    def unlink(self):
+        """删除共享内存和锁文件（所有进程都不再使用时调用）"""
+        if not hasattr(self.shm, '_track'):
+            # Python 3.13 之前 unlink 会从 resource_tracker 注销，而打开时已经注销过
+            resource_tracker.register(self.shm._name, 'shared_memory')
+        self.shm.unlink()
+        try:
+            os.remove(os.path.join(tempfile.gettempdir(), f'{self.name}.lock'))
+        except FileNotFoundError:
+            pass